@@ -12,10 +12,22 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+from matplotlib.collections import LineCollection
+from matplotlib.colors import to_rgba, LogNorm
+from matplotlib.path import Path
 import numpy as np
+import os
 import threading
 import time
-import math
+
+from odcpc import (calculate_cpc_parameters, calculate_uniform_steps_for_tolerance, TRACE_ENGINES, GeometryCache,
+                   trace_ray_from_aperture, transmission_curve,
+                   EXPORT_FORMATS, EXPORT_EXTENSIONS, export_mesh, RayDensity,
+                   RAY_DISTRIBUTIONS, ReceiverIrradiance, RevolvedWall, skew_transmission_for_angles,
+                   dielectric_energy_for_angles)
+
+class LiveJobSuperseded(Exception):
+    """Raised through a progress callback to abandon a live job that newer inputs replaced"""
 
 class CPC_Calculator:
     def __init__(self, root):
@@ -32,6 +44,9 @@ class CPC_Calculator:
         self.d1_var = tk.DoubleVar(value=50.0)
         self.step_var = tk.IntVar(value=100)
         self.n_var = tk.DoubleVar(value=1.0)
+        self.adaptive_var = tk.BooleanVar(value=False)
+        self.tolerance_var = tk.DoubleVar(value=0.01)
+        self.adaptive_info_var = tk.StringVar(value="")
         self.d2_var = tk.DoubleVar()
         self.r2_var = tk.DoubleVar()
         self.s2_var = tk.DoubleVar()
@@ -46,12 +61,43 @@ class CPC_Calculator:
         self.decimal_places_var = tk.IntVar(value=6)
         self.radial_segments_var = tk.IntVar(value=36)
         self.export_half_only_var = tk.BooleanVar(value=False)
+        self.export_format_var = tk.StringVar(value=EXPORT_FORMATS[0])
+        self.export_streaming_var = tk.BooleanVar(value=False)
+        self.export_chunk_var = tk.IntVar(value=65536)
         
         # Variables for ray tracing
         self.ray_pos_var = tk.DoubleVar(value=0.0)
         self.ray_angle_var = tk.DoubleVar(value=0.0)
         self.show_ray_labels_var = tk.BooleanVar(value=False)
         self.accumulate_rays_var = tk.BooleanVar(value=False)
+        self.trace_engine_var = tk.StringVar(value="polyline")
+        self.ray_density_var = tk.BooleanVar(value=False)
+        self.recent_rays_var = tk.IntVar(value=50)
+        self.batch_rays_var = tk.IntVar(value=100000)
+        
+        # Variables for the transmission curve
+        self.transmission_angles_var = tk.IntVar(value=181)
+        self.transmission_rays_var = tk.IntVar(value=1000)
+        self.transmission_skew_var = tk.BooleanVar(value=False)
+        self.transmission_dielectric_var = tk.BooleanVar(value=False)
+        
+        # Variables for the receiver irradiance
+        self.irradiance_rays_var = tk.IntVar(value=1000000)
+        self.irradiance_bins_var = tk.IntVar(value=100)
+        self.irradiance_distribution_var = tk.StringVar(value="uniform")
+        self.irradiance_revolved_var = tk.BooleanVar(value=False)
+        
+        # Live recalculation: debounce timer and the newest job for the background worker
+        self.live_update_var = tk.BooleanVar(value=False)
+        self.live_after_id = None
+        self.live_condition = threading.Condition()
+        self.live_job = 0  # number of the newest job; results of older ones are dropped
+        self.live_request = None  # (job, θ, d1, n, steps, tolerance) waiting for the worker
+        self.live_thread = None
+        
+        # Variables for the nomogram
+        self.nomogram_fine_var = tk.BooleanVar(value=False)
+        self.nomogram_key = None  # (d1, n, fine) of the curves currently drawn
         
         # Variables for the progress bar
         self.progress_var = tk.DoubleVar(value=0.0)
@@ -61,12 +107,32 @@ class CPC_Calculator:
         self.current_theta = None
         self.current_d1 = None
         self.cpc_params = None
-        self.profile_points = None
+        self.profile_z = None  # contiguous float64 array of axial coordinates
+        self.profile_r = None  # contiguous float64 array of wall radii
+        self.geometry_cache = GeometryCache()  # LRU cache of designs and their derived structures
+        self.design = None  # CachedDesign of the current input parameters
+        self.cache_info_var = tk.StringVar(value="")
+        
+        # Transmission curve: (theta_deg, angles, transmission, rays per angle, engine, 3D transmission or None,
+        # 3D wall label) of the last run
+        self.transmission_result = None
+        self.transmission_thread = None
+        # Dielectric fill: (angles, energy reaching the receiver, n) traced with the last curve
+        self.dielectric_transmission_result = None
+        # Imported STL mesh: (angles, 3D transmission, file name, triangles) of the last comparison
+        self.mesh_transmission_result = None
+        self.mesh_transmission_thread = None
+        
+        # Receiver irradiance: (ReceiverIrradiance, distribution, engine) of the last run
+        self.irradiance_result = None
+        self.irradiance_thread = None
         
         # Trace data
         self.ray_paths = []  # list of all traced rays
         self.current_ray_path = []  # current ray
         self.current_ray_segments_info = []  # current ray metadata
+        self.ray_density = None  # RayDensity of all accumulated rays (density view)
+        self.ray_batch_thread = None
         
         # Interpolation step for finding intersections
         self.intersection_eps = 1e-8
@@ -75,6 +141,8 @@ class CPC_Calculator:
         self.calculate_all()
         
         self.root.bind('<Return>', lambda event: self.calculate_all()) # pressing Enter
+        for var in (self.theta_var, self.d1_var, self.step_var, self.n_var, self.adaptive_var, self.tolerance_var):
+            var.trace_add('write', self.on_input_changed)
     
     def create_widgets(self):
         # Main frames
@@ -102,9 +170,19 @@ class CPC_Calculator:
         self.tab2 = ttk.Frame(self.notebook)
         self.notebook.add(self.tab2, text="Parameter Dependencies")
         
+        # Third tab
+        self.tab3 = ttk.Frame(self.notebook)
+        self.notebook.add(self.tab3, text="Transmission")
+        
+        # Fourth tab
+        self.tab4 = ttk.Frame(self.notebook)
+        self.notebook.add(self.tab4, text="Receiver Irradiance")
+        
         # Setting up charts for tabs
         self.setup_tab1_geometry()
         self.setup_tab2_dependencies()
+        self.setup_tab3_transmission()
+        self.setup_tab4_irradiance()
         
         # Input parameters
         ttk.Label(input_frame, text="Acceptance half-angle θ (°):").grid(row=0, column=0, sticky="w")
@@ -123,7 +201,16 @@ class CPC_Calculator:
         
         style = ttk.Style()
         style.configure("TButton", background="yellow")
-        ttk.Button(input_frame, text="Calculate & Redraw", command=self.calculate_all).grid(row=6, column=0, columnspan=2, pady=7)
+        ttk.Checkbutton(input_frame, text="Adaptive, tolerance (mm):", variable=self.adaptive_var).grid(row=6, column=0, sticky="w")
+        ttk.Entry(input_frame, textvariable=self.tolerance_var, width=10).grid(row=6, column=1, sticky="w")
+        ttk.Label(input_frame, textvariable=self.adaptive_info_var, font=("", "8", "italic")).grid(row=7, column=0, columnspan=2, sticky="w")
+        
+        ttk.Button(input_frame, text="Calculate & Redraw", command=self.calculate_all).grid(row=8, column=0, columnspan=2, pady=7)
+        ttk.Checkbutton(input_frame, text="Live update", variable=self.live_update_var,
+                        command=self.on_input_changed).grid(row=9, column=0, sticky="w")
+        ttk.Scale(input_frame, from_=0.5, to=89.5, variable=self.theta_var, orient=tk.HORIZONTAL,
+                  command=lambda value: self.theta_var.set(round(float(value), 1))).grid(row=10, column=0, columnspan=2, sticky="ew")
+        ttk.Label(input_frame, textvariable=self.cache_info_var, font=("", "8", "italic")).grid(row=11, column=0, columnspan=2, sticky="w")
         
         # Ray tracing controls
         ttk.Label(ray_frame, text="🗦 Ray Tracing 🗧", foreground="dark red").grid(row=0, column=0, sticky="w")
@@ -138,8 +225,20 @@ class CPC_Calculator:
                         command=self.on_toggle_show_labels).grid(row=3, column=0, columnspan=2, sticky="w")
         ttk.Checkbutton(ray_frame, text="Accumulate rays", variable=self.accumulate_rays_var).grid(row=4, column=0, columnspan=2, sticky="w")
         
-        ttk.Button(ray_frame, text="Trace", command=self.trace_ray_button).grid(row=5, column=0, pady=7)
-        ttk.Button(ray_frame, text="Clear", command=self.clear_ray).grid(row=5, column=1, pady=7)
+        ttk.Label(ray_frame, text="Engine:").grid(row=5, column=0, sticky="w")
+        ttk.Combobox(ray_frame, textvariable=self.trace_engine_var, values=TRACE_ENGINES,
+                     state="readonly", width=8).grid(row=5, column=1, sticky="w")
+        
+        ttk.Checkbutton(ray_frame, text="Density view, recent rays:", variable=self.ray_density_var,
+                        command=self.on_toggle_density).grid(row=6, column=0, sticky="w")
+        ttk.Entry(ray_frame, textvariable=self.recent_rays_var, width=10).grid(row=6, column=1, sticky="w")
+        ttk.Label(ray_frame, text="Batch of rays:").grid(row=7, column=0, sticky="w")
+        ttk.Entry(ray_frame, textvariable=self.batch_rays_var, width=10).grid(row=7, column=1, sticky="w")
+        self.ray_batch_button = ttk.Button(ray_frame, text="Trace batch", command=self.start_ray_batch)
+        self.ray_batch_button.grid(row=7, column=2, sticky="w")
+        
+        ttk.Button(ray_frame, text="Trace", command=self.trace_ray_button).grid(row=8, column=0, pady=7)
+        ttk.Button(ray_frame, text="Clear", command=self.clear_ray).grid(row=8, column=1, pady=7)
         
         # Results
         ttk.Label(result_frame, text="Calculation Results", font=("", "12", "bold")).grid(row=0, column=0, sticky="w", pady=2)
@@ -183,7 +282,16 @@ class CPC_Calculator:
         
         ttk.Checkbutton(stl_frame, text="Half only", variable=self.export_half_only_var).grid(row=4, column=1, sticky="w")
         
-        ttk.Button(stl_frame, text="Save to STL", command=self.start_stl_export).grid(row=5, column=1, pady=(6,0))
+        ttk.Label(stl_frame, text="Format:").grid(row=5, column=0, sticky="w")
+        ttk.Combobox(stl_frame, textvariable=self.export_format_var, values=EXPORT_FORMATS,
+                     state="readonly", width=10).grid(row=5, column=1)
+        ttk.Label(stl_frame, text="decimal places: ASCII only", font=("", "8", "italic")).grid(row=6, column=1, sticky="w")
+        
+        ttk.Checkbutton(stl_frame, text="Stream in chunks", variable=self.export_streaming_var).grid(row=7, column=1, sticky="w")
+        ttk.Label(stl_frame, text="Chunk (facets):").grid(row=8, column=0, sticky="w")
+        ttk.Entry(stl_frame, textvariable=self.export_chunk_var, width=10).grid(row=8, column=1)
+        
+        ttk.Button(stl_frame, text="Save mesh", command=self.start_stl_export).grid(row=9, column=1, pady=(6,0))
         
         # Progress bar
         self.progress_frame = ttk.Frame(self.root)
@@ -212,8 +320,15 @@ class CPC_Calculator:
         self.toolbar1 = NavigationToolbar2Tk(self.canvas1, self.tab1)
         self.toolbar1.update()
         self.canvas1.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        
+        self.create_geometry_artists()
     
     def setup_tab2_dependencies(self):
+        controls = ttk.Frame(self.tab2, padding=4)
+        controls.pack(side=tk.TOP, fill=tk.X)
+        ttk.Checkbutton(controls, text="Fine resolution (10⁴ angles, aperture Ø and area ratio)",
+                        variable=self.nomogram_fine_var, command=self.plot_dependencies).pack(side=tk.LEFT)
+        
         self.fig2, self.ax2_primary = plt.subplots(figsize=(8, 5))
         self.ax2_secondary = self.ax2_primary.twinx()
         
@@ -227,26 +342,168 @@ class CPC_Calculator:
         # Initializing an empty graph
         self.plot_dependencies()
     
+    def setup_tab3_transmission(self):
+        controls = ttk.Frame(self.tab3, padding=4)
+        controls.pack(side=tk.TOP, fill=tk.X)
+        
+        ttk.Label(controls, text="Angles over ±90°:").pack(side=tk.LEFT)
+        ttk.Entry(controls, textvariable=self.transmission_angles_var, width=8).pack(side=tk.LEFT, padx=(2, 10))
+        ttk.Label(controls, text="Rays per angle:").pack(side=tk.LEFT)
+        ttk.Entry(controls, textvariable=self.transmission_rays_var, width=8).pack(side=tk.LEFT, padx=(2, 10))
+        ttk.Checkbutton(controls, text="Compare with 3D skew rays",
+                        variable=self.transmission_skew_var).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Checkbutton(controls, text="Dielectric fill (n)",
+                        variable=self.transmission_dielectric_var).pack(side=tk.LEFT, padx=(0, 10))
+        self.transmission_button = ttk.Button(controls, text="Compute", command=self.start_transmission_curve)
+        self.transmission_button.pack(side=tk.LEFT)
+        self.mesh_transmission_button = ttk.Button(controls, text="Compare STL...",
+                                                   command=self.start_mesh_transmission)
+        self.mesh_transmission_button.pack(side=tk.LEFT, padx=(10, 0))
+        
+        self.fig3, self.ax3 = plt.subplots(figsize=(8, 5))
+        self.canvas3 = FigureCanvasTkAgg(self.fig3, self.tab3)
+        self.canvas3.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        
+        self.toolbar3 = NavigationToolbar2Tk(self.canvas3, self.tab3)
+        self.toolbar3.update()
+        self.canvas3.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        
+        # Initializing an empty graph
+        self.plot_transmission()
+    
+    def plot_transmission(self):
+        self.ax3.clear()
+        
+        if self.transmission_result is not None:
+            theta_deg, angles, transmission, n_rays, engine, transmission_3d, wall_3d = self.transmission_result
+            self.ax3.plot(angles, transmission * 100, color='tab:green', linewidth=2,
+                          label='Meridional' if transmission_3d is not None else 'Transmission')
+            if transmission_3d is not None:
+                self.ax3.plot(angles, transmission_3d * 100, color='tab:purple', linewidth=2, linestyle='--',
+                              label=f'3D skew rays ({wall_3d})')
+            if self.dielectric_transmission_result is not None:
+                dielectric_angles, dielectric_energy, n = self.dielectric_transmission_result
+                self.ax3.plot(dielectric_angles, dielectric_energy * 100, color='tab:blue', linewidth=1.5,
+                              label=f'Dielectric n = {n:.4G} (energy, Fresnel + TIR)')
+            if self.mesh_transmission_result is not None:
+                mesh_angles, mesh_transmission, name, triangles = self.mesh_transmission_result
+                self.ax3.plot(mesh_angles, mesh_transmission * 100, color='tab:red', linewidth=1.5,
+                              label=f'STL {name} ({triangles} triangles, 3D)')
+            self.ax3.axvline(x=theta_deg, color='orange', linestyle=':', label=f'±θ = {theta_deg:.4G}°')
+            self.ax3.axvline(x=-theta_deg, color='orange', linestyle=':')
+            self.ax3.set_title(f'Angular Transmission ({n_rays} rays per angle, {engine})')
+            self.ax3.legend(loc='upper right')
+        else:
+            self.ax3.set_title('Angular Transmission')
+        
+        self.ax3.set_xlabel('Incidence angle (°)')
+        self.ax3.set_ylabel('Rays reaching the receiver (%)')
+        self.ax3.set_xlim(-90, 90)
+        self.ax3.set_ylim(-2, 102)
+        self.ax3.locator_params(axis='x', nbins=20)
+        self.ax3.grid(True, alpha=0.4)
+        
+        self.fig3.tight_layout()
+        self.canvas3.draw()
+    
+    def setup_tab4_irradiance(self):
+        controls = ttk.Frame(self.tab4, padding=4)
+        controls.pack(side=tk.TOP, fill=tk.X)
+        
+        ttk.Label(controls, text="Rays:").pack(side=tk.LEFT)
+        ttk.Entry(controls, textvariable=self.irradiance_rays_var, width=10).pack(side=tk.LEFT, padx=(2, 10))
+        ttk.Label(controls, text="Bins:").pack(side=tk.LEFT)
+        ttk.Entry(controls, textvariable=self.irradiance_bins_var, width=6).pack(side=tk.LEFT, padx=(2, 10))
+        ttk.Combobox(controls, textvariable=self.irradiance_distribution_var, values=RAY_DISTRIBUTIONS,
+                     state="readonly", width=10).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Checkbutton(controls, text="Revolved (area-weighted)", variable=self.irradiance_revolved_var).pack(side=tk.LEFT)
+        self.irradiance_button = ttk.Button(controls, text="Compute", command=self.start_irradiance)
+        self.irradiance_button.pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Button(controls, text="Save CSV", command=self.save_irradiance_csv).pack(side=tk.LEFT, padx=(4, 0))
+        
+        self.fig4, self.ax4 = plt.subplots(figsize=(8, 5))
+        self.canvas4 = FigureCanvasTkAgg(self.fig4, self.tab4)
+        self.canvas4.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        
+        self.toolbar4 = NavigationToolbar2Tk(self.canvas4, self.tab4)
+        self.toolbar4.update()
+        self.canvas4.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        
+        # Initializing an empty graph
+        self.plot_irradiance()
+    
+    def plot_irradiance(self):
+        self.ax4.clear()
+        
+        if self.irradiance_result is not None:
+            histogram, distribution, engine = self.irradiance_result
+            irradiance = histogram.irradiance()
+            self.ax4.stairs(irradiance, histogram.edges, color='tab:red', linewidth=1.5, fill=True, alpha=0.4,
+                            label='Relative irradiance')
+            self.ax4.axhline(y=histogram.mean_irradiance(), color='k', linestyle='--', alpha=0.6,
+                             label=f'Mean = {histogram.mean_irradiance():.4G}')
+            section = 'revolved absorber' if histogram.area_weighted else 'meridional section'
+            self.ax4.set_title(f'Receiver Irradiance\n{histogram.rays} rays, {distribution}, {section}, {engine}')
+            self.ax4.legend(loc='upper right')
+        else:
+            self.ax4.set_title('Receiver Irradiance')
+        
+        self.ax4.set_xlabel('Receiver radius (mm)')
+        self.ax4.set_ylabel('Irradiance / aperture irradiance')
+        self.ax4.grid(True, alpha=0.4)
+        
+        self.fig4.tight_layout()
+        self.canvas4.draw()
+    
     def plot_dependencies(self): # nomogram
+        """Rebuilds the nomogram curves only when d1, n or the resolution change, otherwise just
+        moves the current-θ line and markers"""
+        if self.design is not None:
+            _, current_d1, current_n = self.design.key[:3]
+        else:
+            current_d1 = self.d1_var.get()
+            current_n = self.n_var.get()
+        key = (current_d1, current_n, self.nomogram_fine_var.get())
+        if key != self.nomogram_key:
+            self.build_nomogram(*key)
+            self.nomogram_key = key
+        
+        # Mark the current angle value if there is a calculation
+        marked = self.current_theta is not None and self.cpc_params is not None
+        if marked:
+            current_theta = self.current_theta
+            self.nomogram_theta_line.set_xdata([current_theta, current_theta])
+            self.nomogram_theta_line.set_label(f'Current θ = {current_theta}°')
+            self.nomogram_C_max_marker.set_data([current_theta], [self.cpc_params['C_max']])
+            self.nomogram_L_marker.set_data([current_theta], [self.cpc_params['L']])
+        for artist in (self.nomogram_theta_line, self.nomogram_C_max_marker, self.nomogram_L_marker):
+            artist.set_visible(marked)
+        
+        # Combining legends from two axes
+        lines1, labels1 = self.ax2_primary.get_legend_handles_labels()
+        lines2, labels2 = self.ax2_secondary.get_legend_handles_labels()
+        handles = [(line, label) for line, label in zip(lines1 + lines2, labels1 + labels2) if line.get_visible()]
+        self.ax2_primary.legend(*zip(*handles), loc='upper right')
+        
+        self.canvas2.draw_idle()
+    
+    def build_nomogram(self, current_d1, current_n, fine):
+        """Curves and axes setup of the nomogram for one receiver diameter and refractive index"""
         self.ax2_primary.clear()
         self.ax2_secondary.clear()
         
         # Range of angles for analysis (from 1 to 89 degrees)
-        theta_range = np.linspace(1, 89, 100)
-        theta_rad = np.radians(theta_range)
+        theta_range = np.linspace(1, 89, 10001 if fine else 100)
         
-        # Current parameters
-        current_d1 = self.d1_var.get()
-        current_n = self.n_var.get()
-        
-        # Calculating dependencies
-        #d2_range = current_d1 / np.sin(theta_rad)  # aperture diameter
-        L_range = (current_d1/2 * (1 + np.sin(theta_rad)) * np.cos(theta_rad)) / (np.sin(theta_rad) ** 2)  # length
-        C_max_range = current_n ** 2 / (np.sin(theta_rad) ** 2)  # maximum concentration
+        # Calculating dependencies: the closed-form parameters broadcast over the angles
+        params = calculate_cpc_parameters(theta_range, current_d1, current_n)
         
         # The graph on the main axis (left) is Concentration
         color_red = 'tab:red'
-        self.ax2_primary.plot(theta_range, C_max_range, color=color_red, linewidth=2, label='Max Concentration')
+        self.ax2_primary.plot(theta_range, params['C_max'], color=color_red, linewidth=2, label='Max Concentration')
+        if fine:
+            self.ax2_primary.plot(theta_range, (params['d2'] / current_d1) ** 2, color='tab:orange',
+                                  linewidth=1.5, linestyle=':', label='Area ratio')
         self.ax2_primary.set_xlabel('Acceptance Half-Angle θ (°)')
         self.ax2_primary.locator_params(axis='x', nbins=20)
         self.ax2_primary.set_xlim(0, 90)
@@ -259,8 +516,11 @@ class CPC_Calculator:
         
         # Graph on the second axis (right) is Length
         color_blue = 'tab:blue'
-        self.ax2_secondary.plot(theta_range, L_range, color=color_blue, linewidth=2, linestyle='--', label='Length')
-        self.ax2_secondary.set_ylabel('Length (mm)', color=color_blue)
+        self.ax2_secondary.plot(theta_range, params['L'], color=color_blue, linewidth=2, linestyle='--', label='Length')
+        if fine:
+            self.ax2_secondary.plot(theta_range, params['d2'], color='tab:cyan', linewidth=1.5,
+                                    linestyle='-.', label='Aperture Ø')
+        self.ax2_secondary.set_ylabel('Length, aperture Ø (mm)' if fine else 'Length (mm)', color=color_blue)
         self.ax2_secondary.tick_params(axis='y', direction='inout', length=10, width=2, color=color_blue, labelcolor=color_blue)
         self.ax2_secondary.tick_params(axis='y', which='minor', direction='in', length=5, color=color_blue, labelcolor=color_blue)
         self.ax2_secondary.yaxis.set_label_position("right")  # signature on the right
@@ -269,100 +529,16 @@ class CPC_Calculator:
         self.ax2_secondary.grid(visible=True, which='minor', color='b', alpha=0.1, linestyle='--')
         self.ax2_secondary.set_yscale('log')  # log scale
         
-        # Mark the current angle value if there is a calculation
-        if self.current_theta is not None:
-            current_theta = self.current_theta
-            current_C_max = self.cpc_params['C_max'] if self.cpc_params else current_n ** 2 / (np.sin(np.radians(current_theta)) ** 2)
-            current_L = self.cpc_params['L'] if self.cpc_params else (current_d1/2 * (1 + np.sin(np.radians(current_theta))) * np.cos(np.radians(current_theta))) / (np.sin(np.radians(current_theta)) ** 2)
-            
-            # Vertical line at the current angle
-            self.ax2_primary.axvline(x=current_theta, color='green', linestyle=':', alpha=0.7, label=f'Current θ = {current_theta}°')
-            
-            # Points on curves
-            self.ax2_primary.plot(current_theta, current_C_max, 'ro', markersize=7)
-            self.ax2_secondary.plot(current_theta, current_L, 'bo', markersize=7)
+        # Vertical line at the current angle and points on curves, moved by plot_dependencies
+        self.nomogram_theta_line = self.ax2_primary.axvline(x=45, color='green', linestyle=':', alpha=0.7)
+        self.nomogram_C_max_marker, = self.ax2_primary.plot([], [], 'ro', markersize=7)
+        self.nomogram_L_marker, = self.ax2_secondary.plot([], [], 'bo', markersize=7)
         
         # Setting up a schedule
         self.ax2_primary.grid(True, alpha=0.4)
         self.ax2_primary.set_title('Maximum Concentration vs Acceptance Half-Angle vs Lenght')
         
-        # Combining legends from two axes
-        lines1, labels1 = self.ax2_primary.get_legend_handles_labels()
-        lines2, labels2 = self.ax2_secondary.get_legend_handles_labels()
-        self.ax2_primary.legend(lines1 + lines2, labels1 + labels2, loc='upper right')
-        
         self.fig2.tight_layout()
-        self.canvas2.draw()
-    
-    def calculate_cpc_parameters(self, theta_deg, d1, n):
-        """Calculates all CPC parameters once and caches them"""
-        # z = (f/2)(1 + cosφ)  ⇒  cosφ = 2z/f - 1; r = f·sinφ/(1 + cosφ) + d/2 = f·tan(φ/2) + d/2
-        theta = np.radians(theta_deg)
-        
-        # Basic constants
-        C = np.cos(theta)
-        S = np.sin(theta)
-        P = 1 + S
-        Q = 1 + P
-        T = 1 + Q
-        
-        # Basic calculations
-        d2 = d1 / S
-        focus = (d1 / 2) * (1 + S)
-        L = (focus * C) / (S ** 2)
-        C_max = n ** 2 / (S ** 2)
-        
-        # Pre-calculated constants for the profile equation
-        A_const = C ** 2
-        B_const_part1 = 2 * C * S
-        B_const_part2 = 2 * (d1 / 2) * P ** 2
-        D_const_part1 = S ** 2
-        D_const_part2 = 2 * (d1 / 2) * C * Q
-        D_const_part3 = (d1 / 2) ** 2 * P * T
-        
-        return {
-            'theta': theta,
-            'theta_deg': theta_deg,
-            'd1': d1,
-            'd2': d2,
-            'focus': focus,
-            'L': L,
-            'C_max': C_max,
-            'C': C,
-            'S': S,
-            'P': P,
-            'Q': Q,
-            'T': T,
-            'A_const': A_const,
-            'B_const_part1': B_const_part1,
-            'B_const_part2': B_const_part2,
-            'D_const_part1': D_const_part1,
-            'D_const_part2': D_const_part2,
-            'D_const_part3': D_const_part3
-        }
-    
-    def calculate_profile_points(self, params, num_points):
-        if num_points == 1:
-            z_values = np.array([0, params['L']])
-        else:
-            z_values = np.linspace(0, params['L'], num_points + 1)
-            
-        profile_points = []
-        
-        for z in z_values:
-            B = params['B_const_part1'] * z + params['B_const_part2']
-            D = (params['D_const_part1'] * z ** 2 - 
-                 params['D_const_part2'] * z - 
-                 params['D_const_part3'])
-            
-            discriminant = B ** 2 - 4 * params['A_const'] * D
-            if discriminant >= 0:
-                r = (-B + np.sqrt(discriminant)) / (2 * params['A_const'])
-                profile_points.append((z, r))
-            else:
-                profile_points.append((z, 0.0))
-        
-        return profile_points
     
     def calculate_all(self):
         try:
@@ -375,111 +551,223 @@ class CPC_Calculator:
                 messagebox.showerror("Error", "Angle θ must be between 0 and 90 degrees")
                 return
             
-            # Calculate all parameters once
-            self.cpc_params = self.calculate_cpc_parameters(theta_deg, d1, n)
-            self.profile_points = self.calculate_profile_points(self.cpc_params, max(1, int(num_points)))
+            # Parameters and profile of the design, computed once and then taken from the cache
+            tolerance = None
+            if self.adaptive_var.get() and int(num_points) != 1:
+                tolerance = self.tolerance_var.get()
+                if tolerance <= 0:
+                    messagebox.showerror("Error", "Tolerance must be positive")
+                    return
+            self.cancel_live_recalculation()
+            design = self.geometry_cache.design(theta_deg, d1, n, num_points, tolerance)
+            self.apply_design(design, theta_deg, d1, tolerance)
             
-            # Updating variables
-            self.d2_var.set(f"{self.cpc_params['d2']:.7G}")
-            self.r2_var.set(f"{self.cpc_params['d2']/2:.7G}")
-            self.s2_var.set(f"{np.pi*(self.cpc_params['d2']/2)**2:.7G}")
-            self.r1_var.set(f"{self.cpc_params['d1']/2:.7G}")
-            self.s1_var.set(f"{np.pi*(self.cpc_params['d1']/2)**2:.7G}")
-            self.ratio_var.set(f"1:{self.cpc_params['d2']/self.cpc_params['d1']:.7G}")
-            self.f_var.set(f"{self.cpc_params['focus']:.7G}")
-            self.L_var.set(f"{self.cpc_params['L']:.7G}")
-            self.C_max_var.set(f"{self.cpc_params['C_max']:.7G}")
-            
-            # Caching current parameters
-            self.current_theta = theta_deg
-            self.current_d1 = d1
+        except (ValueError, tk.TclError):
+            messagebox.showerror("Error", "Please enter valid numeric values")
+    
+    def apply_design(self, design, theta_deg, d1, tolerance):
+        """Makes a computed design current: result fields and both plots"""
+        self.design = design
+        self.cpc_params = self.design.params
+        self.profile_z, self.profile_r = self.design.profile_z, self.design.profile_r
+        if tolerance:
+            uniform_steps = self.design.get('uniform_steps', lambda: calculate_uniform_steps_for_tolerance(self.cpc_params, tolerance))
+            self.adaptive_info_var.set(f"Adaptive: {len(self.profile_z) - 1} steps (uniform: {uniform_steps})")
+        else:
+            self.adaptive_info_var.set("")
+        
+        stats = self.geometry_cache.stats()
+        self.cache_info_var.set(f"Cache: {stats['entries']} designs, {stats['nbytes'] / 2**20:.1f} MB, "
+                                f"{stats['hits']} hits / {stats['misses']} misses")
+        
+        # Updating variables
+        self.d2_var.set(f"{self.cpc_params['d2']:.7G}")
+        self.r2_var.set(f"{self.cpc_params['d2']/2:.7G}")
+        self.s2_var.set(f"{np.pi*(self.cpc_params['d2']/2)**2:.7G}")
+        self.r1_var.set(f"{self.cpc_params['d1']/2:.7G}")
+        self.s1_var.set(f"{np.pi*(self.cpc_params['d1']/2)**2:.7G}")
+        self.ratio_var.set(f"1:{self.cpc_params['d2']/self.cpc_params['d1']:.7G}")
+        self.f_var.set(f"{self.cpc_params['focus']:.7G}")
+        self.L_var.set(f"{self.cpc_params['L']:.7G}")
+        self.C_max_var.set(f"{self.cpc_params['C_max']:.7G}")
+        
+        # Caching current parameters
+        self.current_theta = theta_deg
+        self.current_d1 = d1
+        
+        # Redraw the graphs on both tabs
+        self.plot_cpc_profile()
+        self.plot_dependencies()
+    
+    # Live recalculation
+    def on_input_changed(self, *args):
+        """Debounces input edits: the recalculation starts once the input pauses"""
+        if not self.live_update_var.get():
+            return
+        if self.live_after_id is not None:
+            self.root.after_cancel(self.live_after_id)
+        with self.live_condition:
+            self.live_job += 1  # results of jobs in flight are stale now
+            self.live_request = None
+        self.live_after_id = self.root.after(300, self.request_live_recalculation)
+    
+    def design_inputs(self):
+        """(θ, d1, n, steps, tolerance) of the input panel, or None while the input is incomplete or invalid"""
+        try:
+            theta_deg = self.theta_var.get()
+            d1 = self.d1_var.get()
+            num_points = self.step_var.get()
+            n = self.n_var.get()
+            tolerance = self.tolerance_var.get() if self.adaptive_var.get() and int(num_points) != 1 else None
+        except (ValueError, tk.TclError):
+            return None
+        if not 0 < theta_deg < 90 or d1 <= 0 or n <= 0 or num_points < 1 or (tolerance is not None and tolerance <= 0):
+            return None
+        return theta_deg, d1, n, num_points, tolerance
+    
+    def request_live_recalculation(self):
+        """Hands the newest inputs to the worker, superseding any job still in flight"""
+        self.live_after_id = None
+        inputs = self.design_inputs()
+        if inputs is None:
+            return
+        
+        with self.live_condition:
+            self.live_job += 1
+            self.live_request = (self.live_job,) + inputs
+            self.live_condition.notify()
+        
+        if self.live_thread is None:
+            self.live_thread = threading.Thread(target=self.live_worker)
+            self.live_thread.daemon = True
+            self.live_thread.start()
+    
+    def cancel_live_recalculation(self):
+        """Drops the pending and in-flight live jobs (an explicit calculation supersedes them)"""
+        if self.live_after_id is not None:
+            self.root.after_cancel(self.live_after_id)
+            self.live_after_id = None
+        with self.live_condition:
+            self.live_job += 1
+            self.live_request = None
+    
+    def live_worker(self):
+        """Computes only the newest requested design; a job superseded meanwhile is abandoned at the
+        next checkpoint (between stages and between the rounds of the adaptive profile and the
+        uniform-step search) and its result is never handed to the Tk thread"""
+        while True:
+            with self.live_condition:
+                while self.live_request is None:
+                    self.live_condition.wait()
+                job, theta_deg, d1, n, num_points, tolerance = self.live_request
+                self.live_request = None
             
-            # Redraw the graphs on both tabs
-            self.plot_cpc_profile()
-            self.plot_dependencies()
+            def checkpoint(*progress, job=job):
+                if job != self.live_job:
+                    raise LiveJobSuperseded
             
-        except ValueError:
-            messagebox.showerror("Error", "Please enter valid numeric values")
+            try:
+                design = self.geometry_cache.design(theta_deg, d1, n, num_points, tolerance, progress=checkpoint)
+                checkpoint()
+                design.wall("polyline")
+                if tolerance:
+                    design.get('uniform_steps', lambda: calculate_uniform_steps_for_tolerance(design.params, tolerance,
+                                                                                              progress=checkpoint))
+                checkpoint()
+                self.root.after(0, self.finish_live_recalculation, job, design, theta_deg, d1, tolerance)
+            except LiveJobSuperseded:
+                continue
+            except Exception as e:
+                message = f"Live recalculation failed: {str(e)}"
+                self.root.after(0, self.adaptive_info_var.set, message)
+    
+    def finish_live_recalculation(self, job, design, theta_deg, d1, tolerance):
+        if job != self.live_job:
+            return  # the inputs changed again after this job finished
+        self.apply_design(design, theta_deg, d1, tolerance)
+    
+    def create_geometry_artists(self):
+        """Persistent artists of the geometry tab, updated in place instead of redrawing the axes"""
+        ax = self.ax1
+        
+        # Wall, canonical rays, aperture, receiver, optical axis
+        self.profile_fill = ax.fill([], [], color='silver', alpha=0.35)[0]
+        self.profile_upper, = ax.plot([], [], 'b-', linewidth=2, label='Profile')
+        self.profile_lower, = ax.plot([], [], 'b-', linewidth=2)
+        self.canonical_ray_lower, = ax.plot([], [], color='orange', linewidth=1, label='Canonical ray')
+        self.canonical_ray_upper, = ax.plot([], [], color='orange', linewidth=1)
+        self.aperture_line, = ax.plot([], [], color='orangered', linewidth=3, label='Aperture')
+        self.receiver_line, = ax.plot([], [], 'r-', linewidth=3, label='Receiver')
+        ax.axhline(y=0, color='k', linestyle='-.', alpha=0.5, label='Optical axis')
+        self.canonical_cross_point, = ax.plot([], [], 'mo', markersize=2) #label='Intersection of rays'
+        
+        # Ray-density image of the accumulated rays (density view), under the profile lines
+        self.density_image = ax.imshow(np.zeros((1, 1)), extent=(0, 1, 0, 1), origin='lower', cmap='inferno',
+                                       norm=LogNorm(), interpolation='nearest', zorder=1.5, visible=False)
+        self.density_image.cmap.set_bad(alpha=0)
+        self.density_image.sticky_edges.x.clear()  # autoscaling keeps the usual margins
+        self.density_image.sticky_edges.y.clear()
+        
+        # All rays on screen: one polyline per ray in a single collection, vertices in one scatter
+        self.ray_collection = LineCollection([], linewidths=1)
+        ax.add_collection(self.ray_collection)
+        self.ray_points = ax.scatter(np.empty(0), np.empty(0), s=9, zorder=2)
+        self.reset_ray_artists()
+        self.ray_label_artists = []  # segment labels and the end point marker of the last ray
+        
+        # Artists of the newest ray, drawn alone over the saved background (blitting)
+        self.new_ray_collection = LineCollection([], linewidths=1, animated=True)
+        ax.add_collection(self.new_ray_collection)
+        self.new_ray_points = ax.scatter(np.empty(0), np.empty(0), s=9, zorder=2, animated=True)
+        self.geometry_background = None
+        self.canvas1.mpl_connect('draw_event', self.on_geometry_draw)
+        
+        ax.set_xlabel('Axial coordinate (mm)')
+        ax.set_ylabel('Radial coordinate (mm)')
+        ax.grid(True, alpha=0.5)
+        ax.minorticks_on()
+        ax.grid(which="minor", linestyle='dotted', alpha=0.2)
+        ax.set_aspect('equal')
+        self.fig1.patch.set_facecolor('#f0f0f0')
+    
+    def on_geometry_draw(self, event):
+        """Keeps the rendered geometry tab as the background for blitting new rays"""
+        self.geometry_background = self.canvas1.copy_from_bbox(self.ax1.bbox)
+    
+    def redraw_geometry(self):
+        self.geometry_background = None
+        self.canvas1.draw_idle()
     
     def plot_cpc_profile(self):
-        """Builds a CPC profile graph using cached data and draws ray traces"""
-        if not self.cpc_params or not self.profile_points:
+        """Updates the CPC profile artists from cached data; rays are kept as they are"""
+        if not self.cpc_params or self.profile_z is None:
             return
-            
-        self.ax1.clear()
+        
         params = self.cpc_params
         
-        # Extracting data from a profile
-        z_values = [p[0] for p in self.profile_points]
-        r_values = [p[1] for p in self.profile_points]
+        # Profile arrays are used directly, no copies
+        z_values = self.profile_z
+        r_values = self.profile_r
         
         # Filling the area between the top and bottom of the profile
         if self.n_var.get() == 1:
             cpc_color = 'silver'
         else:
             cpc_color = 'lightblue'
-        self.ax1.fill_between(z_values, r_values, [-r for r in r_values], color=cpc_color, alpha=0.35)
-        # Building a profile
-        self.ax1.plot(z_values, r_values, 'b-', linewidth=2, label='Profile')
-        self.ax1.plot(z_values, [-r for r in r_values], 'b-', linewidth=2)
-        
-        # Lower and upper canonical ray
-        self.ax1.plot([params['L'], 0], 
-                    [-params['d2']/2, params['d1']/2], 
-                    color='orange', linewidth=1, label='Canonical ray')
-        self.ax1.plot([params['L'], 0], 
-                    [params['d2']/2, -params['d1']/2], 
-                    color='orange', linewidth=1)
-        # Aperture
-        self.ax1.plot([params['L'], params['L']], 
-                    [-params['d2']/2, params['d2']/2], 
-                    color='orangered', linewidth=3, label='Aperture')
-        # Receiver
-        self.ax1.plot([0, 0], 
-                    [-params['d1']/2, params['d1']/2], 
-                    'r-', linewidth=3, label='Receiver')
-        
-        # Optical axis and point of intersection of rays
-        self.ax1.axhline(y=0, color='k', linestyle='-.', alpha=0.5, label='Optical axis')
-        self.ax1.plot(params['d1']/(2*np.tan(params["theta"])), 0, 'mo', markersize=2) #label='Intersection of rays'
-        
-        # Draw all accumulated rays
-        colors = ['green', 'purple', 'brown', 'pink', 'gray', 'olive', 'cyan']
-        for idx, (ray_path, segments_info) in enumerate(self.ray_paths):
-            color = colors[idx % len(colors)]
-            zs = [p[0] for p in ray_path]
-            rs = [p[1] for p in ray_path]
-            
-            # Draw ray segments
-            for i in range(len(zs)-1):
-                z0, z1 = zs[i], zs[i+1]
-                r0, r1 = rs[i], rs[i+1]
-                self.ax1.plot([z0, z1], [r0, r1], color=color, linewidth=1, marker='o', markersize=3)
-                
-                if self.show_ray_labels_var.get() and i < len(segments_info):
-                    angle_deg = segments_info[i].get("angle_deg", None)
-                    mz = 0.5*(z0+z1)
-                    mr = 0.5*(r0+r1)
-                    if angle_deg is not None:
-                        self.ax1.text(mz, mr, f"{i+1}: {angle_deg:.1f}°", fontsize=8, 
-                                   color='darkred', bbox=dict(boxstyle="round,pad=0.2", fc="white", alpha=0.7))
-                    else:
-                        self.ax1.text(mz, mr, f"{i+1}", fontsize=8, 
-                                   color='darkred', bbox=dict(boxstyle="round,pad=0.2", fc="white", alpha=0.7))
-            
-            # Show end point on collector for last beam only when labels are enabled
-            if self.show_ray_labels_var.get() and idx == len(self.ray_paths) - 1 and len(ray_path) > 1:
-                final_z, final_r = ray_path[-1]
-                if abs(final_z) < 1e-6:  # if the beam reached the collector (z=0)
-                    self.ax1.plot(final_z, final_r, 's', markersize=8, color=color, 
-                               label=f'Ray position: {final_r:.3f} mm')
-                    self.ax1.text(final_z + params['L']*0.02, final_r, 
-                               f'{final_r:.3f} mm', fontsize=9, color=color,
-                               bbox=dict(boxstyle="round,pad=0.3", fc="yellow", alpha=0.8))
+        self.profile_fill.set_xy(np.column_stack((np.concatenate((z_values, z_values[::-1])),
+                                                  np.concatenate((r_values, -r_values[::-1])))))
+        self.profile_fill.set_color(cpc_color)
+        self.profile_upper.set_data(z_values, r_values)
+        self.profile_lower.set_data(z_values, -r_values)
         
-        # Setting up a schedule
-        self.ax1.set_xlabel('Axial coordinate (mm)')
-        self.ax1.set_ylabel('Radial coordinate (mm)')
+        # Lower and upper canonical ray, aperture, receiver
+        self.canonical_ray_lower.set_data([params['L'], 0], [-params['d2']/2, params['d1']/2])
+        self.canonical_ray_upper.set_data([params['L'], 0], [params['d2']/2, -params['d1']/2])
+        self.aperture_line.set_data([params['L'], params['L']], [-params['d2']/2, params['d2']/2])
+        self.receiver_line.set_data([0, 0], [-params['d1']/2, params['d1']/2])
+        
+        # Point of intersection of rays
+        self.canonical_cross_point.set_data([params['d1']/(2*np.tan(params["theta"]))], [0])
         
         # Determining the name depending on the parameters
         if self.radial_segments_var.get() == 4 and self.step_var.get() == 1:
@@ -492,24 +780,132 @@ class CPC_Calculator:
             name = 'CPC'
             
         self.ax1.set_title(f'{name} Drawing (2θ = {2*params["theta_deg"]:.4G}°)')
-        self.ax1.grid(True, alpha=0.5)
-        self.ax1.minorticks_on()
-        self.ax1.grid(which="minor", linestyle='dotted', alpha=0.2)
-        self.ax1.set_aspect('equal')
-        #self.ax1.set_xlim(-params['L']*0.05, params['L']*1.05)
-        #self.ax1.set_ylim(-params['d2']/2*1.5, params['d2']/2*1.5)
-        
-        # Legend only if there are elements and labels are enabled
-        if self.show_ray_labels_var.get() and len(self.ax1.get_legend_handles_labels()[0]) > 0:
-            self.ax1.legend(fontsize=8)
+        
+        # The density grid covers the previous geometry
+        self.ray_density = None
+        self.density_image.set_visible(False)
+        if self.ray_density_var.get():
+            self.seed_density()
+            self.update_density_image()
+        
+        self.ax1.relim(visible_only=True)
+        self.ax1.autoscale_view()
+        self.fig1.tight_layout()
+        
+        self.redraw_geometry()
+    
+    def plot_rays(self):
+        """Rebuilds the ray artists from self.ray_paths (after clearing, replacing or toggling labels)"""
+        self.reset_ray_artists()
+        for ray_path, _ in self.ray_paths:
+            self.append_ray_artists(ray_path)
+        self.update_ray_collection()
+        self.update_ray_labels()
+        self.redraw_geometry()
+    
+    def reset_ray_artists(self):
+        self.ray_collection.set_segments([])
+        self.ray_count = 0
+        self.ray_line_colors = np.empty((16, 4))  # RGBA per ray
+        self.vertex_count = 0
+        self.ray_vertices = np.empty((64, 2))  # (z, r) of all ray vertices
+        self.ray_vertex_colors = np.empty((64, 4))
+    
+    def append_rows(self, buffer, used, rows):
+        """Writes rows after the first used rows of buffer, doubling its capacity when it is full"""
+        if used + len(rows) > len(buffer):
+            grown = np.empty((max(2 * len(buffer), used + len(rows)),) + buffer.shape[1:])
+            grown[:used] = buffer[:used]
+            buffer = grown
+        buffer[used:used + len(rows)] = rows
+        return buffer
+    
+    def append_ray_artists(self, ray_path):
+        """Appends one ray to the ray artists without touching the earlier ones; returns its vertices and color"""
+        colors = ['green', 'purple', 'brown', 'pink', 'gray', 'olive', 'cyan']
+        vertices = np.asarray(ray_path, dtype=float).reshape(-1, 2)
+        color = to_rgba(colors[self.ray_count % len(colors)])
+        
+        self.ray_collection.get_paths().append(Path(vertices))
+        self.ray_line_colors = self.append_rows(self.ray_line_colors, self.ray_count, [color])
+        self.ray_vertices = self.append_rows(self.ray_vertices, self.vertex_count, vertices)
+        self.ray_vertex_colors = self.append_rows(self.ray_vertex_colors, self.vertex_count,
+                                                  np.tile(color, (len(vertices), 1)))
+        self.ray_count += 1
+        self.vertex_count += len(vertices)
+        return vertices, color
+    
+    def update_ray_collection(self):
+        self.ray_collection.set_color(self.ray_line_colors[:self.ray_count])
+        self.ray_points.set_offsets(self.ray_vertices[:self.vertex_count])
+        self.ray_points.set_color(self.ray_vertex_colors[:self.vertex_count])
+    
+    def update_ray_labels(self):
+        """Segment labels of all rays and the receiver position of the last one (only when enabled)"""
+        for artist in self.ray_label_artists:
+            artist.remove()
+        self.ray_label_artists = []
+        if self.ax1.get_legend() is not None:
+            self.ax1.get_legend().remove()
+        
+        if not self.show_ray_labels_var.get():
+            return
+        
+        for idx, (ray_path, segments_info) in enumerate(self.ray_paths):
+            self.add_ray_labels(ray_path, segments_info)
             
-        self.fig1.patch.set_facecolor('#f0f0f0')
-        plt.tight_layout()
+            # Show end point on collector for last beam only
+            if idx == len(self.ray_paths) - 1 and len(ray_path) > 1:
+                final_z, final_r = ray_path[-1]
+                if abs(final_z) < 1e-6:  # if the beam reached the collector (z=0)
+                    color = self.ray_line_colors[idx]
+                    self.ray_label_artists += self.ax1.plot(final_z, final_r, 's', markersize=8, color=color, 
+                                                            label=f'Ray position: {final_r:.3f} mm')
+                    self.ray_label_artists.append(
+                        self.ax1.text(final_z + self.cpc_params['L']*0.02, final_r, 
+                                      f'{final_r:.3f} mm', fontsize=9, color=color,
+                                      bbox=dict(boxstyle="round,pad=0.3", fc="yellow", alpha=0.8)))
+        
+        self.ax1.legend(fontsize=8)
+    
+    def add_ray_labels(self, ray_path, segments_info):
+        for i in range(len(ray_path)-1):
+            (z0, r0), (z1, r1) = ray_path[i], ray_path[i+1]
+            if i < len(segments_info):
+                angle_deg = segments_info[i].get("angle_deg", None)
+                text = f"{i+1}: {angle_deg:.1f}°" if angle_deg is not None else f"{i+1}"
+                self.ray_label_artists.append(
+                    self.ax1.text(0.5*(z0+z1), 0.5*(r0+r1), text, fontsize=8, 
+                                  color='darkred', bbox=dict(boxstyle="round,pad=0.2", fc="white", alpha=0.7)))
+    
+    def add_ray_to_plot(self):
+        """Draws the last ray of self.ray_paths on top of the ones already shown"""
+        vertices, color = self.append_ray_artists(self.ray_paths[-1][0])
+        self.update_ray_collection()
+        
+        if self.show_ray_labels_var.get():
+            # The end point marker moves to the new ray, so the labels need a full redraw
+            self.update_ray_labels()
+            self.redraw_geometry()
+            return
         
-        self.canvas1.draw()
+        if self.geometry_background is None:
+            self.redraw_geometry()
+            return
+        
+        # Blitting: restore the last rendered frame and draw only the new ray over it
+        self.new_ray_collection.set_segments([vertices])
+        self.new_ray_collection.set_color(color)
+        self.new_ray_points.set_offsets(vertices)
+        self.new_ray_points.set_color(color)
+        self.canvas1.restore_region(self.geometry_background)
+        self.ax1.draw_artist(self.new_ray_collection)
+        self.ax1.draw_artist(self.new_ray_points)
+        self.canvas1.blit(self.ax1.bbox)
+        self.geometry_background = self.canvas1.copy_from_bbox(self.ax1.bbox)
     
     def trace_ray_button(self):
-        if not self.cpc_params or not self.profile_points:
+        if not self.cpc_params or self.profile_z is None:
             messagebox.showwarning("Warning", "Please calculate the CPC profile first")
             return
         
@@ -533,227 +929,170 @@ class CPC_Calculator:
         self.current_ray_segments_info = segments_info
         
         # Add to the list of rays if accumulation is enabled
-        if self.accumulate_rays_var.get():
+        if self.accumulate_rays_var.get() and self.ray_density_var.get():
+            # Density view: every ray goes into the image, only the recent ones are drawn
+            self.ray_paths.append((ray_path, segments_info))
+            self.add_path_to_density(ray_path)
+            self.ray_paths = self.ray_paths[-self.recent_rays_count():]
+            self.plot_rays()
+            self.update_density_image()
+        elif self.accumulate_rays_var.get():
             self.ray_paths.append((ray_path, segments_info))
+            self.add_ray_to_plot()
         else:
             self.ray_paths = [(ray_path, segments_info)]  # replacing all rays with the current one
-        
-        self.plot_cpc_profile()
+            self.plot_rays()
     
     def clear_ray(self):
         self.ray_paths = []
         self.current_ray_path = []
         self.current_ray_segments_info = []
-        self.plot_cpc_profile()
+        if self.ray_density is not None:
+            self.ray_density = None  # a running batch keeps filling the old image, which is dropped
+            self.update_density_image()
+        self.plot_rays()
+    
+    # Density view
+    def recent_rays_count(self):
+        try:
+            return max(1, int(self.recent_rays_var.get()))
+        except (ValueError, tk.TclError):
+            return 50
+    
+    def seed_density(self):
+        """Starts the density image of the current geometry from the rays already traced"""
+        self.ray_density = RayDensity.for_design(self.cpc_params)
+        for ray_path, _ in self.ray_paths:
+            self.add_path_to_density(ray_path)
+    
+    def add_path_to_density(self, ray_path):
+        if self.ray_density is None:
+            self.ray_density = RayDensity.for_design(self.cpc_params)
+        path = np.asarray(ray_path, dtype=float).reshape(-1, 2)
+        self.ray_density.add_segments(path[:-1, 0], path[:-1, 1], path[1:, 0], path[1:, 1])
+        with self.ray_density.lock:
+            self.ray_density.rays += 1
+    
+    def update_density_image(self, image=None):
+        """Shows the density image (or a snapshot of it passed by the batch thread)"""
+        if self.ray_density is None or not self.ray_density_var.get():
+            self.density_image.set_visible(False)
+            self.redraw_geometry()
+            return
+        
+        image = self.ray_density.snapshot() if image is None else image
+        peak = image.max()
+        if peak > 0:
+            self.density_image.set_data(np.ma.masked_less_equal(image, 0))
+            self.density_image.set_extent(self.ray_density.extent)
+            self.density_image.set_clim(peak * 1e-4, peak)
+        self.density_image.set_visible(peak > 0)
+        self.redraw_geometry()
+    
+    def on_toggle_density(self):
+        if not self.cpc_params:
+            return
+        if self.ray_density_var.get():
+            if self.ray_density is None:
+                self.seed_density()
+            self.ray_paths = self.ray_paths[-self.recent_rays_count():]
+            self.plot_rays()
+        self.update_density_image()
+    
+    def start_ray_batch(self):
+        if not self.cpc_params or self.profile_z is None:
+            messagebox.showwarning("Warning", "Please calculate the CPC profile first")
+            return
+        
+        if self.ray_batch_thread is not None and self.ray_batch_thread.is_alive():
+            return
+        
+        try:
+            n_rays = int(self.batch_rays_var.get())
+            angle_deg = float(self.ray_angle_var.get())
+        except (ValueError, tk.TclError):
+            messagebox.showerror("Error", "Please enter valid numeric values for the batch size and angle")
+            return
+        
+        if n_rays < 1:
+            messagebox.showerror("Error", "At least 1 ray is required")
+            return
+        
+        # A batch always accumulates into the density view
+        self.accumulate_rays_var.set(True)
+        if not self.ray_density_var.get():
+            self.ray_density_var.set(True)
+            self.on_toggle_density()
+        elif self.ray_density is None:
+            self.seed_density()
+        
+        self.progress_frame.grid()
+        self.progress_var.set(0)
+        self.progress_label_var.set("Tracing ray batch...")
+        self.ray_batch_button.state(['disabled'])
+        
+        self.ray_batch_thread = threading.Thread(
+            target=self.ray_batch_thread_run,
+            args=(self.cpc_params, self.current_wall(), self.ray_density, n_rays, angle_deg, self.recent_rays_count()))
+        self.ray_batch_thread.daemon = True
+        self.ray_batch_thread.start()
+    
+    def ray_batch_thread_run(self, params, wall, density, n_rays, angle_deg, recent, chunk=20000):
+        """Traces a collimated batch over the whole aperture into the density image, chunk by chunk"""
+        try:
+            rng = np.random.default_rng()
+            half_r = params['d2'] / 2
+            r0 = rng.uniform(-half_r, half_r, n_rays)
+            for start in range(0, n_rays, chunk):
+                density.trace(params, wall, r0[start:start + chunk], angle_deg)
+                done = min(n_rays, start + chunk)
+                self.root.after(0, self.ray_batch_progress, density, density.snapshot(), done, n_rays)
+            
+            # The last rays of the batch are also drawn individually
+            paths = [trace_ray_from_aperture(params, wall, r, angle_deg) for r in r0[-recent:]]
+            self.root.after(0, self.finish_ray_batch, density, paths)
+        except Exception as e:
+            message = f"Failed to trace ray batch:\n{str(e)}"
+            self.root.after(0, lambda: messagebox.showerror("Error", message))
+            self.root.after(0, self.hide_progress)
+            self.root.after(0, lambda: self.ray_batch_button.state(['!disabled']))
+    
+    def ray_batch_progress(self, density, image, done, n_rays):
+        self.set_progress(done / n_rays * 100, f"Tracing ray batch: {done}/{n_rays} rays")
+        if density is self.ray_density:
+            self.update_density_image(image)
+    
+    def finish_ray_batch(self, density, paths):
+        self.hide_progress()
+        self.ray_batch_button.state(['!disabled'])
+        if density is not self.ray_density:
+            return  # the geometry changed or the rays were cleared meanwhile
+        self.ray_paths = (self.ray_paths + paths)[-self.recent_rays_count():]
+        self.plot_rays()
+        self.update_density_image()
     
     def on_toggle_show_labels(self):
-        self.plot_cpc_profile()
+        self.plot_rays()
     
     def trace_ray_from_aperture(self, r0_aperture, angle_deg, max_bounces=50):
-        params = self.cpc_params
-        profile = self.profile_points
-        
-        # Convert angle to radians
-        alpha = math.radians(angle_deg)
-        
-        # Beam direction: inside CPC (towards collector)
-        dz = -1.0  # moving towards z=0
-        dr = math.tan(alpha)  # radial component
-        
-        # Normalize the direction
-        v = np.array([dz, dr], dtype=float)
-        v_len = np.linalg.norm(v)
-        if v_len > 0:
-            v = v / v_len
-        
-        # Starting point on the aperture
-        z0 = params['L']
-        r0 = float(r0_aperture)
-        path = [(z0, r0)]
-        segments = []
-        
-        bounce_count = 0
-        current_point = np.array([z0, r0], dtype=float)
-        current_direction = v.copy()
-        
-        # Pre-calculate profile segments
-        seg_z = np.array([p[0] for p in profile])
-        seg_r_upper = np.array([p[1] for p in profile])  # upper surface
-        seg_r_lower = np.array([-p[1] for p in profile])  # bottom surface (mirror)
-        
-        # We first check whether the beam comes back out through the aperture (simplified check)
-        # If the angle is too large (greater than the concentrator angle), the beam will not hit the collector
-        if abs(angle_deg) > params['theta_deg'] + 5:  # adding a small margin of error
-            # The beam will not enter the collector, but will exit through the aperture.
-            # Find the exit point through the aperture
-            if abs(current_direction[0]) > 1e-12:
-                t_to_aperture = (z0 - current_point[0]) / current_direction[0]
-                if t_to_aperture > 1e-9:
-                    exit_pt = current_point + current_direction * t_to_aperture
-                    path.append((float(exit_pt[0]), float(exit_pt[1])))
-                    segments.append({"angle_deg": angle_deg, "type": "escape_direct"})
-                    return path, segments
-        
-        while bounce_count <= max_bounces:
-            # 1. Check the intersection with the collector (z=0)
-            if abs(current_direction[0]) > 1e-12:
-                t_to_receiver = (0.0 - current_point[0]) / current_direction[0]
-                if t_to_receiver > 1e-9:
-                    receiver_intersect = current_point + current_direction * t_to_receiver
-                    receiver_r = receiver_intersect[1]
-                    # Check if it gets to the manifold
-                    if abs(receiver_r) <= params['d1']/2 + 1e-9:
-                        path.append((0.0, receiver_r))
-                        segments.append({"angle_deg": angle_deg, "type": "receiver", "final_r": receiver_r})
-                        break
-            
-            # 2. Check intersection with aperture (z = L)
-            aperture_z = params['L']
-            if current_direction[0] > 0 and current_point[0] < aperture_z:  # moves towards the aperture
-                t_to_aperture = (aperture_z - current_point[0]) / current_direction[0]
-                if t_to_aperture > 1e-9:
-                    aperture_intersect = current_point + current_direction * t_to_aperture
-                    aperture_r = aperture_intersect[1]
-                    
-                    # Check if it fits into the aperture and does not go inside the hub
-                    if abs(aperture_r) <= params['d2']/2 + 1e-9:
-                        # Check if the beam enters the concentrator along the way
-                        # Find intersections with the profile that may occur earlier
-                        t_min = t_to_aperture
-                        profile_intersection_earlier = False
-                        
-                        # Find any intersections with the profile that occur earlier
-                        for profile_r, surface_type in [(seg_r_upper, "upper"), (seg_r_lower, "lower")]:
-                            for i in range(len(seg_z)-1):
-                                # Profile segment points
-                                z1, r1 = seg_z[i], profile_r[i]
-                                z2, r2 = seg_z[i+1], profile_r[i+1]
-                                
-                                # Segment vector
-                                seg_vec = np.array([z2 - z1, r2 - r1])
-                                
-                                # Solve the system: current_point + t*current_direction = [z1, r1] + u*seg_vec
-                                A = np.column_stack((current_direction, -seg_vec))
-                                b = np.array([z1 - current_point[0], r1 - current_point[1]])
-                                
-                                try:
-                                    t, u = np.linalg.solve(A, b)
-                                    
-                                    # Check the validity of the intersection
-                                    if t > 1e-9 and t < t_min - 1e-9 and 0 <= u <= 1.0:
-                                        profile_intersection_earlier = True
-                                        break
-                                except np.linalg.LinAlgError:
-                                    continue
-                            
-                            if profile_intersection_earlier:
-                                break
-                        
-                        if not profile_intersection_earlier:
-                            # The beam actually comes out through the aperture
-                            path.append((float(aperture_intersect[0]), float(aperture_intersect[1])))
-                            segments.append({"angle_deg": math.degrees(math.atan2(current_direction[1], -current_direction[0])), 
-                                           "type": "escape_aperture", "final_r": aperture_r})
-                            break
-            
-            # 3. Find the intersections with the upper and lower surfaces
-            t_candidates = []
-            intersection_info = []
-            
-            # Check both profiles (upper and lower)
-            for profile_r, surface_type in [(seg_r_upper, "upper"), (seg_r_lower, "lower")]:
-                for i in range(len(seg_z)-1):
-                    # Profile segment points
-                    z1, r1 = seg_z[i], profile_r[i]
-                    z2, r2 = seg_z[i+1], profile_r[i+1]
-                    
-                    # Segment vector
-                    seg_vec = np.array([z2 - z1, r2 - r1])
-                    
-                    # Solve the system: current_point + t*current_direction = [z1, r1] + u*seg_vec
-                    A = np.column_stack((current_direction, -seg_vec))
-                    b = np.array([z1 - current_point[0], r1 - current_point[1]])
-                    
-                    try:
-                        t, u = np.linalg.solve(A, b)
-                        
-                        # Checking the validity of the intersection
-                        if t > 1e-9 and 0 <= u <= 1.0:
-                            intersection_pt = current_point + t * current_direction
-                            t_candidates.append(t)
-                            intersection_info.append({
-                                "t": t, 
-                                "point": intersection_pt,
-                                "segment_index": i,
-                                "u": u,
-                                "surface_type": surface_type,
-                                "segment_points": ((z1, r1), (z2, r2))
-                            })
-                    except np.linalg.LinAlgError:
-                        continue
-            
-            # Selecting the nearest intersection
-            if t_candidates:
-                min_t_idx = np.argmin(t_candidates)
-                nearest = intersection_info[min_t_idx]
-                
-                # Add an intersection point to a path
-                intersect_pt = nearest["point"]
-                path.append((float(intersect_pt[0]), float(intersect_pt[1])))
-                
-                # Calculate the normal at the intersection point
-                z1, r1 = nearest["segment_points"][0]
-                z2, r2 = nearest["segment_points"][1]
-                seg_tangent = np.array([z2 - z1, r2 - r1])
-                seg_tangent = seg_tangent / (np.linalg.norm(seg_tangent) + 1e-12)
-                
-                # Normal to the segment (perpendicular to the tangent)
-                if nearest["surface_type"] == "upper":
-                    normal = np.array([seg_tangent[1], -seg_tangent[0]])  # for the top surface
-                else:
-                    normal = np.array([-seg_tangent[1], seg_tangent[0]])  # for the bottom surface (mirror)
-                
-                normal = normal / (np.linalg.norm(normal) + 1e-12)
-                
-                # Reflection
-                incident = current_direction
-                dot = np.dot(incident, normal)
-                reflected = incident - 2 * dot * normal
-                reflected = reflected / (np.linalg.norm(reflected) + 1e-12)
-                
-                # Save segment information
-                current_angle = math.degrees(math.atan2(current_direction[1], -current_direction[0]))
-                segments.append({
-                    "angle_deg": current_angle, 
-                    "type": "reflect", 
-                    "surface": nearest["surface_type"],
-                    "segment_index": nearest["segment_index"]
-                })
-                
-                # Update point and direction for next step
-                current_point = intersect_pt + reflected * 1e-6  # a slight shift to avoid self-intersection
-                current_direction = reflected
-                bounce_count += 1
-                
-            else:
-                # There are no intersections - the beam goes to infinity
-                far_point = current_point + current_direction * params['L']
-                path.append((float(far_point[0]), float(far_point[1])))
-                segments.append({"angle_deg": angle_deg, "type": "no_intersection"})
-                break
-        
-        return path, segments
-
+        return trace_ray_from_aperture(self.cpc_params, self.current_wall(), r0_aperture, angle_deg, max_bounces)
+    
+    def current_wall(self):
+        """Wall intersection engine selected in the ray tracing panel"""
+        return self.design.wall(self.trace_engine_var.get())
+    
     # STL
     def start_stl_export(self):
-        if not self.cpc_params or not self.profile_points:
+        if not self.cpc_params or self.profile_z is None:
             messagebox.showwarning("Warning", "Please calculate the CPC profile first")
             return
         
+        export_format = self.export_format_var.get()
+        extension = EXPORT_EXTENSIONS[export_format]
         file_path = filedialog.asksaveasfilename(
-            defaultextension=".stl",
-            filetypes=[("STL files", "*.stl"), ("All files", "*.*")],
-            title="Save STL file"
+            defaultextension=extension,
+            filetypes=[(f"{export_format} files", f"*{extension}"), ("All files", "*.*")],
+            title=f"Save {export_format} file"
         )
         
         if not file_path:
@@ -769,94 +1108,248 @@ class CPC_Calculator:
         thread.start()
     
     def save_to_stl_thread(self, file_path):
-        """Stream for generating STL file with progress update"""
+        """Stream for generating the mesh file with progress update"""
+        export_format = self.export_format_var.get()
         try:
-            decimal_places = self.decimal_places_var.get()
-            radial_segments = self.radial_segments_var.get()
-            export_half = self.export_half_only_var.get()
-            
-            total_triangles = (len(self.profile_points) - 1) * (radial_segments if not export_half else radial_segments // 2) * 2
-            triangles_generated = 0
-            
-            fmt = f".{decimal_places}f"
-            azimuth_step = 2 * np.pi / radial_segments
+            mesh = None
+            if export_format in ("OBJ", "Binary PLY"):
+                mesh = self.design.mesh(self.radial_segments_var.get(), self.export_half_only_var.get())
+            export_mesh(file_path, self.profile_z, self.profile_r,
+                        export_format=export_format,
+                        radial_segments=self.radial_segments_var.get(),
+                        half_only=self.export_half_only_var.get(),
+                        decimal_places=self.decimal_places_var.get(),
+                        streaming=self.export_streaming_var.get(),
+                        chunk_triangles=max(1, self.export_chunk_var.get()),
+                        mesh=mesh,
+                        progress=lambda value, text: self.root.after(0, self.set_progress, value, text))
             
-            if export_half:
-                azimuth_range = np.linspace(0, np.pi, radial_segments // 2 + 1)
-            else:
-                azimuth_range = np.linspace(0, 2 * np.pi, radial_segments + 1)
-            
-            cos_phi = np.cos(azimuth_range)
-            sin_phi = np.sin(azimuth_range)
-            
-            # Writing to a file
-            with open(file_path, 'w', encoding='ascii') as f:
-                f.write("solid OD-CPC_3D_Model\n")
-                
-                for i in range(len(self.profile_points) - 1):
-                    z1, r1 = self.profile_points[i]
-                    z2, r2 = self.profile_points[i + 1]
-                    
-                    for j in range(len(azimuth_range) - 1):
-                        cos_phi1 = cos_phi[j]
-                        sin_phi1 = sin_phi[j]
-                        cos_phi2 = cos_phi[j + 1]
-                        sin_phi2 = sin_phi[j + 1]
-                        
-                        x11 = r1 * cos_phi1
-                        y11 = r1 * sin_phi1
-                        x12 = r1 * cos_phi2
-                        y12 = r1 * sin_phi2
-                        x21 = r2 * cos_phi1
-                        y21 = r2 * sin_phi1
-                        x22 = r2 * cos_phi2
-                        y22 = r2 * sin_phi2
-                        
-                        self.write_triangle(f, (x11, y11, z1), (x21, y21, z2), (x12, y12, z1), fmt)
-                        self.write_triangle(f, (x21, y21, z2), (x22, y22, z2), (x12, y12, z1), fmt)
-                        
-                        triangles_generated += 2
-                        
-                        if triangles_generated % 200 == 0:
-                            progress = min(100.0, (triangles_generated / total_triangles) * 100 if total_triangles>0 else 100.0)
-                            self.progress_var.set(progress)
-                            self.progress_label_var.set(f"Generating STL: {triangles_generated}/{total_triangles} triangles ({progress:.1f}%)")
-                            self.root.update()
-                
-                f.write("endsolid OD-CPC_3D_Model\n")
-            
-            self.progress_var.set(100)
-            self.progress_label_var.set("STL export completed successfully!")
+            self.root.after(0, self.set_progress, 100, f"{export_format} export completed successfully!")
             time.sleep(0.5)
             self.root.after(0, self.hide_progress)
-            self.root.after(0, lambda: messagebox.showinfo("Success", f"STL file saved successfully:\n{file_path}"))
+            self.root.after(0, lambda: messagebox.showinfo("Success", f"{export_format} file saved successfully:\n{file_path}"))
             
         except Exception as e:
-            self.root.after(0, lambda: messagebox.showerror("Error", f"Failed to save STL file:\n{str(e)}"))
+            message = f"Failed to save mesh file:\n{str(e)}"
+            self.root.after(0, lambda: messagebox.showerror("Error", message))
             self.root.after(0, self.hide_progress)
     
-    def hide_progress(self):
-        self.progress_frame.grid_remove()
+    # Transmission curve
+    def start_transmission_curve(self):
+        if not self.cpc_params or self.profile_z is None:
+            messagebox.showwarning("Warning", "Please calculate the CPC profile first")
+            return
+        
+        if self.transmission_thread is not None and self.transmission_thread.is_alive():
+            return
+        
+        try:
+            n_angles = int(self.transmission_angles_var.get())
+            n_rays = int(self.transmission_rays_var.get())
+        except (ValueError, tk.TclError):
+            messagebox.showerror("Error", "Please enter valid numeric values for angles and rays")
+            return
+        
+        if n_angles < 2 or n_rays < 1:
+            messagebox.showerror("Error", "At least 2 angles and 1 ray per angle are required")
+            return
+        
+        angles = np.linspace(-90, 90, n_angles)
+        engine = self.trace_engine_var.get()
+        # The square export (4 radial segments) is traced with its flat faces, anything else as a smooth revolution
+        radial_segments = None
+        if self.transmission_skew_var.get():
+            try:
+                radial_segments = 4 if self.radial_segments_var.get() == 4 else 0
+            except tk.TclError:
+                radial_segments = 0
+        # The dielectric curve uses the refractive index of the current design
+        dielectric_n = self.design.key[2] if self.transmission_dielectric_var.get() else None
+        
+        self.progress_frame.grid()
+        self.progress_var.set(0)
+        self.progress_label_var.set("Starting transmission curve...")
+        self.transmission_button.state(['disabled'])
+        
+        self.transmission_thread = threading.Thread(
+            target=self.transmission_curve_thread,
+            args=(self.cpc_params, self.profile_z, self.profile_r, angles, n_rays, engine, radial_segments,
+                  dielectric_n))
+        self.transmission_thread.daemon = True
+        self.transmission_thread.start()
+    
+    def transmission_curve_thread(self, params, profile_z, profile_r, angles, n_rays, engine, radial_segments,
+                                  dielectric_n):
+        """Runs the process pool off the Tk thread; results are handed back with root.after.
+        radial_segments None skips the 3D curve, 0 traces it on the smooth revolved wall;
+        dielectric_n None skips the meridional dielectric curve."""
+        phases = 1 + (radial_segments is not None) + (dielectric_n is not None)
+        
+        def progress_for(phase, name):
+            def progress(done, total):
+                self.root.after(0, self.set_progress, (phase + done / total) / phases * 100,
+                                f"Tracing {name} curve: {done}/{total}")
+            return progress
+        
+        try:
+            transmission = transmission_curve(params, profile_z, profile_r, angles, n_positions=n_rays,
+                                              engine=engine, progress=progress_for(0, "transmission"))
+            transmission_3d, wall_3d = None, None
+            if radial_segments is not None:
+                transmission_3d = transmission_curve(params, profile_z, profile_r, angles, n_positions=n_rays,
+                                                     progress=progress_for(1, "3D transmission"), skew=True,
+                                                     radial_segments=radial_segments or None)
+                wall_3d = "square" if radial_segments == 4 else "round"
+            dielectric = None
+            if dielectric_n is not None:
+                energy = dielectric_energy_for_angles(RevolvedWall(profile_z, profile_r), angles, n_rays, dielectric_n,
+                                                      meridional=True,
+                                                      progress=progress_for(phases - 1, "dielectric transmission"))
+                dielectric = (angles, energy[:, 0], dielectric_n)
+            result = (params['theta_deg'], angles, transmission, n_rays, engine, transmission_3d, wall_3d)
+            self.root.after(0, self.finish_transmission_curve, result, dielectric)
+        except Exception as e:
+            message = f"Failed to compute transmission curve:\n{str(e)}"
+            self.root.after(0, lambda: messagebox.showerror("Error", message))
+            self.root.after(0, self.hide_progress)
+            self.root.after(0, lambda: self.transmission_button.state(['!disabled']))
     
-    def write_triangle(self, file, v1, v2, v3, fmt):
-        """Write one triangle to an STL file"""
-        v1_arr = np.array(v1)
-        v2_arr = np.array(v2)
-        v3_arr = np.array(v3)
+    def finish_transmission_curve(self, result, dielectric=None):
+        self.transmission_result = result
+        self.dielectric_transmission_result = dielectric
+        self.hide_progress()
+        self.transmission_button.state(['!disabled'])
+        self.plot_transmission()
+        self.notebook.select(self.tab3)
+    
+    def start_mesh_transmission(self):
+        """Traces an imported STL wall (e.g. a scanned reflector) at the angles of the transmission curve"""
+        if self.transmission_result is None:
+            messagebox.showwarning("Warning", "Please compute the transmission curve first")
+            return
+        
+        if self.mesh_transmission_thread is not None and self.mesh_transmission_thread.is_alive():
+            return
+        
+        file_path = filedialog.askopenfilename(filetypes=[("STL files", "*.stl"), ("All files", "*.*")])
+        if not file_path:
+            return
         
-        normal = np.cross(v2_arr - v1_arr, v3_arr - v1_arr)
-        norm = np.linalg.norm(normal)
-        if norm > 0:
-            normal = normal / norm
+        _, angles, _, n_rays, _, _, _ = self.transmission_result
+        self.progress_frame.grid()
+        self.progress_var.set(0)
+        self.progress_label_var.set("Loading STL mesh and building BVH...")
+        self.mesh_transmission_button.state(['disabled'])
         
-        file.write(f"  facet normal {normal[0]:{fmt}} {normal[1]:{fmt}} {normal[2]:{fmt}}\n")
-        file.write("    outer loop\n")
+        self.mesh_transmission_thread = threading.Thread(target=self.mesh_transmission_thread_run,
+                                                         args=(file_path, angles, n_rays))
+        self.mesh_transmission_thread.daemon = True
+        self.mesh_transmission_thread.start()
+    
+    def mesh_transmission_thread_run(self, file_path, angles, n_rays):
+        def progress(done, total):
+            self.root.after(0, self.set_progress, done / total * 100,
+                            f"Tracing STL mesh: {done}/{total} angles")
+        
+        try:
+            bvh = self.geometry_cache.imported_mesh(file_path)
+            transmission = skew_transmission_for_angles(bvh, angles, n_rays, rng=0, progress=progress)
+            result = (angles, transmission, os.path.basename(file_path), bvh.n_triangles)
+            self.root.after(0, self.finish_mesh_transmission, result)
+        except Exception as e:
+            message = f"Failed to trace STL mesh:\n{str(e)}"
+            self.root.after(0, lambda: messagebox.showerror("Error", message))
+            self.root.after(0, self.hide_progress)
+            self.root.after(0, lambda: self.mesh_transmission_button.state(['!disabled']))
+    
+    def finish_mesh_transmission(self, result):
+        self.mesh_transmission_result = result
+        self.hide_progress()
+        self.mesh_transmission_button.state(['!disabled'])
+        self.plot_transmission()
+        self.notebook.select(self.tab3)
+    
+    # Receiver irradiance
+    def start_irradiance(self):
+        if not self.cpc_params or self.profile_z is None:
+            messagebox.showwarning("Warning", "Please calculate the CPC profile first")
+            return
         
-        for vertex in [v1, v2, v3]:
-            file.write(f"      vertex {vertex[0]:{fmt}} {vertex[1]:{fmt}} {vertex[2]:{fmt}}\n")
+        if self.irradiance_thread is not None and self.irradiance_thread.is_alive():
+            return
         
-        file.write("    endloop\n")
-        file.write("  endfacet\n")
+        try:
+            n_rays = int(self.irradiance_rays_var.get())
+            bins = int(self.irradiance_bins_var.get())
+        except (ValueError, tk.TclError):
+            messagebox.showerror("Error", "Please enter valid numeric values for rays and bins")
+            return
+        
+        if n_rays < 1 or bins < 1:
+            messagebox.showerror("Error", "At least 1 ray and 1 bin are required")
+            return
+        
+        histogram = ReceiverIrradiance(self.cpc_params, bins, self.irradiance_revolved_var.get())
+        distribution = self.irradiance_distribution_var.get()
+        engine = self.trace_engine_var.get()
+        
+        self.progress_frame.grid()
+        self.progress_var.set(0)
+        self.progress_label_var.set("Starting receiver irradiance...")
+        self.irradiance_button.state(['disabled'])
+        
+        self.irradiance_thread = threading.Thread(
+            target=self.irradiance_thread_run,
+            args=(histogram, self.current_wall(), n_rays, distribution, engine))
+        self.irradiance_thread.daemon = True
+        self.irradiance_thread.start()
+    
+    def irradiance_thread_run(self, histogram, wall, n_rays, distribution, engine):
+        """Streams the ray batch through the histogram chunk by chunk; results are handed back with root.after"""
+        def progress(done, total):
+            self.root.after(0, self.set_progress, done / total * 100,
+                            f"Tracing receiver irradiance: {done}/{total} rays")
+        
+        try:
+            histogram.trace(wall, n_rays, distribution, progress=progress)
+            self.root.after(0, self.finish_irradiance, (histogram, distribution, engine))
+        except Exception as e:
+            message = f"Failed to compute receiver irradiance:\n{str(e)}"
+            self.root.after(0, lambda: messagebox.showerror("Error", message))
+            self.root.after(0, self.hide_progress)
+            self.root.after(0, lambda: self.irradiance_button.state(['!disabled']))
+    
+    def finish_irradiance(self, result):
+        self.irradiance_result = result
+        self.hide_progress()
+        self.irradiance_button.state(['!disabled'])
+        self.plot_irradiance()
+        self.notebook.select(self.tab4)
+    
+    def save_irradiance_csv(self):
+        if self.irradiance_result is None:
+            messagebox.showwarning("Warning", "Please compute the receiver irradiance first")
+            return
+        
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
+            title="Save receiver irradiance"
+        )
+        if not file_path:
+            return
+        
+        try:
+            self.irradiance_result[0].save_csv(file_path)
+        except OSError as e:
+            messagebox.showerror("Error", f"Failed to save CSV file:\n{str(e)}")
+    
+    def set_progress(self, value, text):
+        self.progress_var.set(value)
+        self.progress_label_var.set(text)
+    
+    def hide_progress(self):
+        self.progress_frame.grid_remove()
 
 def main():
     root = tk.Tk()
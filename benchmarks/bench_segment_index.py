@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Per-bounce cost of the profile segment index as the step count grows.
+
+Run from the repository root:  python benchmarks/bench_segment_index.py
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import odcpc
+
+THETA = 30.0
+D1 = 50.0
+N_RAYS = 20000
+STEPS = (100, 1000, 10000, 100000)
+
+def main():
+    params = odcpc.calculate_cpc_parameters(THETA, D1, 1.0)
+    rng = np.random.default_rng(0)
+    r0 = rng.uniform(-params['d2'] / 2, params['d2'] / 2, N_RAYS)
+    angles = rng.uniform(-THETA, THETA, N_RAYS)
+
+    print(f"θ = {THETA}°, d1 = {D1} mm, {N_RAYS} rays")
+    print(f"{'steps':>8} {'build (ms)':>11} {'single ray (µs/bounce)':>23} {'batch (µs/ray-bounce)':>22}")
+    for steps in STEPS:
+        z, r = odcpc.calculate_profile_points(params, steps)
+
+        t = time.perf_counter()
+        index = odcpc.SegmentIndex(z, r)
+        build = time.perf_counter() - t
+
+        # One ray, one query: the cost paid per bounce by trace_ray_from_aperture
+        pz, pr = np.array([params['L']]), np.array([0.3 * params['d2']])
+        dz, dr = np.array([-0.95]), np.array([np.sqrt(1 - 0.95 ** 2)])
+        repeats = 200
+        t = time.perf_counter()
+        for _ in range(repeats):
+            index.nearest(pz, pr, dz, dr)
+        single = (time.perf_counter() - t) / repeats
+
+        # Whole batch, normalised by the number of wall reflections plus the final step of each ray
+        t = time.perf_counter()
+        result = odcpc.trace_rays_batch(params, z, r, r0, angles, wall=index)
+        batch = (time.perf_counter() - t) / (result['bounces'].sum() + N_RAYS)
+
+        print(f"{steps:>8} {build * 1e3:>11.2f} {single * 1e6:>23.1f} {batch * 1e6:>22.2f}")
+
+if __name__ == "__main__":
+    main()
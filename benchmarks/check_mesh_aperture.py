@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# -*- coding:utf-8 -*-
+"""
+Regression check: an exported N-gon wall traced through the BVH matches RevolvedWall(..., N).
+
+Rays on an imported mesh start over its rim polygon, so the transmission of a faceted export
+must agree with the analytic polygonal wall within the Monte Carlo noise.
+
+Run from the repository root:  python benchmarks/check_mesh_aperture.py
+"""
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import odcpc
+
+THETA = 30.0
+D1 = 50.0
+STEPS = 100
+N_RAYS = 5000
+SEGMENTS = (4, 8, 36)
+ANGLES = (0.0, 10.0, 20.0, 28.0)
+AZIMUTHS = (0.0, 30.0)
+TOLERANCE = 0.03
+
+def main():
+    params = odcpc.calculate_cpc_parameters(THETA, D1, 1.0)
+    z, r = odcpc.calculate_profile_points(params, STEPS)
+
+    print(f"θ = {THETA}°, d1 = {D1} mm, {N_RAYS} rays per angle, angles {ANGLES}")
+    print(f"{'segments':>8} {'azimuth':>8} {'largest |BVH - RevolvedWall|':>29}")
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        for segments in SEGMENTS:
+            file_path = os.path.join(directory, f"wall-{segments}.stl")
+            odcpc.export_mesh(file_path, z, r, "Binary STL", radial_segments=segments)
+            bvh = odcpc.MeshBVH.from_stl(file_path)
+            wall = odcpc.RevolvedWall(z, r, segments)
+            for azimuth in AZIMUTHS:
+                mesh = odcpc.skew_transmission_for_angles(bvh, ANGLES, N_RAYS, azimuth, rng=1)
+                ideal = odcpc.skew_transmission_for_angles(wall, ANGLES, N_RAYS, azimuth, rng=1)
+                difference = float(np.abs(mesh - ideal).max())
+                failed |= difference > TOLERANCE
+                print(f"{segments:>8} {azimuth:>8.1f} {difference:>29.4f}")
+
+    if failed:
+        print(f"FAILED: the mesh differs from the polygonal wall by more than {TOLERANCE}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,35 @@
+# -*- coding:utf-8 -*-
+"""
+OD-CPC engine
+
+@Author: Otkupman D.G.
+@Description: Headless Compound Parabolic Concentrator computations (numpy only, no GUI imports)
+@License: MIT
+"""
+
+from .geometry import (calculate_cpc_parameters, calculate_profile_points, calculate_profile_radius,
+                       calculate_chord_deviation, calculate_adaptive_profile_points,
+                       calculate_uniform_steps_for_tolerance, calculate_design)
+from .tracing import (RAY_FATES, FATE_RECEIVER, FATE_ESCAPE_APERTURE, FATE_ESCAPE_DIRECT,
+                      FATE_NO_INTERSECTION, FATE_MAX_BOUNCES, FATE_WALL_LEAK, TRACE_ENGINES, SegmentIndex,
+                      ParabolicWall, make_wall, trace_rays_batch, trace_ray_from_aperture)
+from .skew import (RevolvedWall, trace_skew_rays, sample_aperture_points, collimated_directions,
+                   skew_transmission_for_angles)
+from .dielectric import (ENERGY_SINKS, fresnel_reflectance, trace_dielectric_rays, launch_points,
+                         dielectric_energy_for_angles)
+from .transmission import transmission_for_angles, transmission_curve
+from .mesh import (EXPORT_FORMATS, EXPORT_EXTENSIONS, STL_FACET_DTYPE, revolved_grid, grid_triangles,
+                   facet_normals, pack_binary_stl, write_binary_stl, read_stl, iter_mesh_bands, format_ascii_facets,
+                   write_stl_streaming, revolved_mesh, write_obj, write_binary_ply, azimuth_range,
+                   export_mesh)
+from .bvh import morton_codes, moller_trumbore, MeshBVH
+from .density import RayDensity
+from .raystore import RAY_DTYPE, PATH_DTYPE, RayStore, trace_to_store
+from .phase_space import adaptive_phase_space
+from .irradiance import RAY_DISTRIBUTIONS, sample_aperture_rays, ReceiverIrradiance
+from .truncation import TRUNCATION_COLUMNS, pareto_front, TruncationIndex
+from .tolerance import perturbed_profiles, trace_stacked_rays, tolerance_analysis
+from .solar import (TABLE_KINDS, HOURS_PER_YEAR, sun_positions, clear_sky_dni, seasonal_tilts, collector_frame,
+                    TransmissionTable, annual_yield)
+from .sweep import SWEEP_COLUMNS, sweep_grid, calculate_wall_area, design_sweep, save_sweep
+from .cache import estimate_nbytes, CachedDesign, CachedMesh, GeometryCache
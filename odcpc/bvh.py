@@ -0,0 +1,211 @@
+# -*- coding:utf-8 -*-
+"""
+Bounding-volume hierarchy over triangle meshes (imported STL) for batched ray tracing
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import numpy as np
+
+def morton_codes(points, bits=21):
+    """Interleaved-bit Morton codes (uint64) of points quantized over their bounding box"""
+    lower = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - lower, 1e-30)
+    scale = (2 ** bits - 1) / extent
+    codes = np.zeros(len(points), dtype=np.uint64)
+    for axis in range(3):
+        value = ((points[:, axis] - lower[axis]) * scale[axis]).astype(np.uint64)
+        # Spread 21 bits to every third bit
+        value = (value | (value << np.uint64(32))) & np.uint64(0x1F00000000FFFF)
+        value = (value | (value << np.uint64(16))) & np.uint64(0x1F0000FF0000FF)
+        value = (value | (value << np.uint64(8))) & np.uint64(0x100F00F00F00F00F)
+        value = (value | (value << np.uint64(4))) & np.uint64(0x10C30C30C30C30C3)
+        value = (value | (value << np.uint64(2))) & np.uint64(0x1249249249249249)
+        codes |= value << np.uint64(axis)
+    return codes
+
+def _cross(a, b):
+    return (a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0])
+
+def _dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+def moller_trumbore(p, d, v0, e1, e2, eps=1e-9):
+    """Ray parameters of ray-triangle intersections (inf where missed), both faces count.
+
+    All arguments are given per component, shape (3, m): ray origins and directions, first
+    vertices and the two edges from it.
+    """
+    pvec = _cross(d, e2)
+    det = _dot(e1, pvec)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv_det = 1.0 / det
+        tvec = (p[0] - v0[0], p[1] - v0[1], p[2] - v0[2])
+        u = _dot(tvec, pvec) * inv_det
+        qvec = _cross(tvec, e1)
+        v = _dot(d, qvec) * inv_det
+        t = _dot(e2, qvec) * inv_det
+    hit = (det != 0) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > eps)
+    return np.where(hit, t, np.inf)
+
+class MeshBVH:
+    """Implicit binary BVH over a triangle soup for vectorized nearest-hit queries.
+
+    Triangles are sorted along a Morton curve of their centroids and grouped into leaves of
+    leaf_size; the tree is a complete binary tree over the leaves, built bottom-up level by level,
+    so construction is a sort plus O(n) reductions. nearest() walks the levels breadth-first for
+    a whole batch of rays, keeping only (ray, node) pairs whose boxes are hit, and runs the
+    Möller–Trumbore test on the triangles of the surviving leaves.
+
+    The wall is closed by two planes: rays crossing z_receiver within receiver_radius of the axis
+    reach the receiver and rays crossing z_aperture leave through the aperture. By default they
+    are the lowest and highest z of the mesh and the radii are the largest rim-vertex distances
+    from the axis within plane_tolerance of those planes. Rays are launched over the rim polygon
+    of the aperture (aperture_outline, the rim vertices in azimuth order), so a faceted export
+    is sampled over its actual cross-section; an explicit aperture_radius launches them over
+    that disk instead.
+    """
+
+    def __init__(self, triangles, leaf_size=8, z_receiver=None, z_aperture=None, receiver_radius=None,
+                 aperture_radius=None, plane_tolerance=1e-6):
+        triangles = np.asarray(triangles, dtype=np.float32).reshape(-1, 3, 3)
+        if not len(triangles):
+            raise ValueError("The mesh has no triangles")
+        self.leaf_size = leaf_size
+        self.n_triangles = len(triangles)
+
+        # Morton order of centroids (summed vertices; the scale does not matter) keeps neighbouring triangles in the same leaves
+        order = np.argsort(morton_codes(triangles[:, 0] + triangles[:, 1] + triangles[:, 2]), kind='stable')
+        triangles = triangles[order]
+        self.order = order  # original index of each sorted triangle
+        # Per-component (3, n) rows of the first vertices and edges for gathered tests
+        self.v0 = np.ascontiguousarray(triangles[:, 0].T)
+        self.e1 = np.ascontiguousarray((triangles[:, 1] - triangles[:, 0]).T)
+        self.e2 = np.ascontiguousarray((triangles[:, 2] - triangles[:, 0]).T)
+
+        # Leaf boxes; the last leaf is padded with its own final triangle
+        n_leaves = -(-self.n_triangles // leaf_size)
+        padded = np.concatenate((triangles, np.repeat(triangles[-1:], n_leaves * leaf_size - self.n_triangles, axis=0)))
+        lower = np.empty((n_leaves, 3))
+        upper = np.empty((n_leaves, 3))
+        for axis in range(3):
+            corners = np.ascontiguousarray(padded[..., axis]).reshape(n_leaves, leaf_size * 3)
+            lower[:, axis] = corners.min(axis=1)
+            upper[:, axis] = corners.max(axis=1)
+        del padded, corners
+
+        # Levels from the leaves up to the root; the last node of an odd level is its parent's only child
+        levels = [np.hstack((lower, upper))]
+        while len(levels[-1]) > 1:
+            boxes = levels[-1]
+            pairs = len(boxes) // 2 * 2
+            parents = np.hstack((np.minimum(boxes[0:pairs:2, :3], boxes[1:pairs:2, :3]),
+                                 np.maximum(boxes[0:pairs:2, 3:], boxes[1:pairs:2, 3:])))
+            levels.append(np.vstack((parents, boxes[pairs:])))
+        # Root first; each level as (6, count) rows: lower x, y, z, upper x, y, z
+        self.boxes = [np.ascontiguousarray(boxes.T) for boxes in levels[::-1]]
+
+        vertices = triangles.reshape(-1, 3)
+        z = vertices[:, 2]
+        z_min, z_max = float(self.boxes[0][2, 0]), float(self.boxes[0][5, 0])
+        tolerance = plane_tolerance * max(1.0, z_max - z_min)
+        self.z_receiver = z_min if z_receiver is None else float(z_receiver)
+        self.L = z_max if z_aperture is None else float(z_aperture)
+
+        def rim_vertices(z_plane):
+            return vertices[np.abs(z - z_plane) <= tolerance, :2].astype(np.float64)
+
+        def rim_radius(z_plane):
+            rim = rim_vertices(z_plane)
+            return np.hypot(rim[:, 0], rim[:, 1]).max(initial=0.0)
+
+        if receiver_radius is None:
+            receiver_radius = rim_radius(self.z_receiver)
+        explicit_aperture = aperture_radius is not None
+        if aperture_radius is None:
+            aperture_radius = rim_radius(self.L)
+        self.receiver_radius = float(receiver_radius)
+        self.aperture_radius = float(aperture_radius)
+        self.radial_segments = None
+        self.aperture_outline = None if explicit_aperture else self.rim_outline(rim_vertices(self.L))
+
+    @staticmethod
+    def rim_outline(rim, decimals=9):
+        """Rim vertices (x, y) as a polygon in azimuth order, one vertex (the outermost) per
+        azimuth; None when the rim has fewer than three distinct azimuths"""
+        azimuth = np.round(np.arctan2(rim[:, 1], rim[:, 0]), decimals)
+        order = np.lexsort((-np.hypot(rim[:, 0], rim[:, 1]), azimuth))
+        _, first = np.unique(azimuth[order], return_index=True)
+        outline = rim[order[first]]
+        return outline if len(outline) >= 3 else None
+
+    @classmethod
+    def from_stl(cls, file_path, **kwargs):
+        from .mesh import read_stl
+        return cls(read_stl(file_path), **kwargs)
+
+    @property
+    def depth(self):
+        return len(self.boxes)
+
+    def nearest(self, p, d, eps=1e-9, chunk=8192):
+        """Nearest triangle hit of each ray: (t, triangle index in the sorted order); t = inf and
+        index -1 where nothing is hit. Rays are processed in chunks to bound the pair lists."""
+        p = np.ascontiguousarray(np.asarray(p, dtype=float).T)
+        d = np.ascontiguousarray(np.asarray(d, dtype=float).T)
+        t_hit = np.full(p.shape[1], np.inf)
+        tri_hit = np.full(p.shape[1], -1, dtype=np.int64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_d = 1.0 / d
+        for start in range(0, p.shape[1], chunk):
+            block = slice(start, start + chunk)
+            t_hit[block], tri_hit[block] = self._nearest_block(p[:, block], d[:, block], inv_d[:, block], eps)
+        return t_hit, tri_hit
+
+    def _nearest_block(self, p, d, inv_d, eps):
+        n_rays = p.shape[1]
+        rays = np.arange(n_rays)
+        nodes = np.zeros(n_rays, dtype=np.int64)
+        with np.errstate(invalid='ignore'):
+            for level, boxes in enumerate(self.boxes):
+                # Slab test; fmin/fmax skip the nan of a zero direction component on a slab plane
+                box = boxes[:, nodes]
+                origin = p[:, rays]
+                inv = inv_d[:, rays]
+                t_near = np.full(len(rays), -np.inf)
+                t_far = np.full(len(rays), np.inf)
+                for axis in range(3):
+                    t1 = (box[axis] - origin[axis]) * inv[axis]
+                    t2 = (box[axis + 3] - origin[axis]) * inv[axis]
+                    t_near = np.fmax(t_near, np.fmin(t1, t2))
+                    t_far = np.fmin(t_far, np.fmax(t1, t2))
+                keep = (t_near <= t_far) & (t_far > eps)
+                rays, nodes = rays[keep], nodes[keep]
+                if level + 1 < self.depth:
+                    rays = np.repeat(rays, 2)
+                    nodes = np.repeat(2 * nodes, 2)
+                    nodes[1::2] += 1
+                    exists = nodes < self.boxes[level + 1].shape[1]
+                    rays, nodes = rays[exists], nodes[exists]
+
+        # Triangles of the leaves that were hit
+        offsets = np.arange(self.leaf_size)
+        tri = (nodes[:, None] * self.leaf_size + offsets).ravel()
+        rays = np.repeat(rays, self.leaf_size)
+        valid = tri < self.n_triangles  # the last leaf may be short
+        rays, tri = rays[valid], tri[valid]
+        t = moller_trumbore(p[:, rays], d[:, rays], self.v0[:, tri].astype(float), self.e1[:, tri].astype(float),
+                            self.e2[:, tri].astype(float), eps)
+
+        t_best = np.full(n_rays, np.inf)
+        np.minimum.at(t_best, rays, t)
+        tri_best = np.full(n_rays, -1, dtype=np.int64)
+        winner = np.isfinite(t) & (t == t_best[rays])
+        tri_best[rays[winner]] = tri[winner]
+        return t_best, tri_best
+
+    def normals(self, points, tri):
+        """Unit facet normals of the hit triangles (orientation does not matter for reflection)"""
+        normal = np.column_stack(_cross(self.e1[:, tri].astype(float), self.e2[:, tri].astype(float)))
+        return normal / np.linalg.norm(normal, axis=1, keepdims=True)
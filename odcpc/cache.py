@@ -0,0 +1,169 @@
+# -*- coding:utf-8 -*-
+"""
+Bounded LRU cache of computed designs and their derived structures
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from .bvh import MeshBVH
+from .geometry import calculate_design
+from .mesh import azimuth_range, revolved_mesh
+from .tracing import make_wall
+
+def estimate_nbytes(value):
+    """Approximate memory held by numpy arrays inside a value (dicts, sequences, object attributes)"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_nbytes(item) for item in value)
+    if hasattr(value, '__dict__'):
+        return estimate_nbytes(vars(value))
+    return 0
+
+def default_cache_dir():
+    """Directory of the on-disk caches: $XDG_CACHE_HOME/odcpc, ~/.cache/odcpc by default"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "odcpc")
+
+class CachedDesign:
+    """Parameters and profile of one design plus structures derived from them on demand"""
+
+    def __init__(self, cache, key, params, profile_z, profile_r):
+        self.cache = cache
+        self.key = key
+        self.params = params
+        self.profile_z = profile_z
+        self.profile_r = profile_r
+        self.derived = {}
+        self.nbytes = estimate_nbytes((params, profile_z, profile_r))
+
+    def get(self, name, build):
+        """Derived structure stored under name, built by build() on first use"""
+        with self.cache.lock:
+            if name in self.derived:
+                return self.derived[name]
+        value = build()
+        with self.cache.lock:
+            if name not in self.derived:
+                self.derived[name] = value
+                size = estimate_nbytes(value)
+                self.nbytes += size
+                self.cache.grow(self, size)
+            return self.derived[name]
+
+    def wall(self, engine="polyline"):
+        """Wall intersection engine (SegmentIndex or ParabolicWall) of the design"""
+        return self.get(('wall', engine), lambda: make_wall(engine, self.params, self.profile_z, self.profile_r))
+
+    def mesh(self, radial_segments, half_only=False):
+        """Indexed revolved mesh (vertices, faces) for the given radial segmentation"""
+        return self.get(('mesh', radial_segments, half_only),
+                        lambda: revolved_mesh(self.profile_z, self.profile_r,
+                                              azimuth_range(radial_segments, half_only)))
+
+class CachedMesh:
+    """BVH of an imported mesh file, cached alongside the designs"""
+
+    def __init__(self, key, bvh):
+        self.key = key
+        self.bvh = bvh
+        self.nbytes = estimate_nbytes(bvh)
+
+class GeometryCache:
+    """Least-recently-used cache of designs keyed by (θ, d1, n, steps, tolerance).
+
+    Each entry holds the parameter dict, the profile arrays and any derived structures (wall
+    engines, meshes). When the arrays held by all entries exceed max_bytes the least recently
+    used designs are evicted; the most recent one is always kept. hits, misses and evictions
+    count the lookups. BVHs of imported mesh files share the same budget (imported_mesh).
+    """
+
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def make_key(theta_deg, d1, n, steps, tolerance=None):
+        steps = max(1, int(steps))
+        tolerance = float(tolerance) if tolerance and steps != 1 else None
+        return (float(theta_deg), float(d1), float(n), steps, tolerance)
+
+    def design(self, theta_deg, d1, n, steps, tolerance=None, progress=None):
+        """Cached design; computed with calculate_design on a miss (progress is passed on to it)"""
+        key = self.make_key(theta_deg, d1, n, steps, tolerance)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        params, profile_z, profile_r = calculate_design(*key, progress=progress)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = CachedDesign(self, key, params, profile_z, profile_r)
+                self.entries[key] = entry
+                self.grow(entry, entry.nbytes)
+            return entry
+
+    def imported_mesh(self, file_path, leaf_size=8):
+        """Cached MeshBVH of an STL file, rebuilt when the file changes (size or modification time)"""
+        stat = os.stat(file_path)
+        key = ('mesh', os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns, leaf_size)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry.bvh
+            self.misses += 1
+
+        bvh = MeshBVH.from_stl(file_path, leaf_size=leaf_size)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = CachedMesh(key, bvh)
+                self.entries[key] = entry
+                self.grow(entry, entry.nbytes)
+            return entry.bvh
+
+    def grow(self, entry, size):
+        """Accounts for size more bytes held by entry and evicts old designs over the limit"""
+        with self.lock:
+            if self.entries.get(entry.key) is not entry:
+                return  # already evicted
+            self.nbytes += size
+            while self.nbytes > self.max_bytes and len(self.entries) > 1:
+                key, evicted = next(iter(self.entries.items()))
+                if evicted is entry:
+                    self.entries.move_to_end(key)
+                    continue
+                del self.entries[key]
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'nbytes': self.nbytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
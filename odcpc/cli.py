@@ -0,0 +1,709 @@
+# -*- coding:utf-8 -*-
+"""
+Command-line interface of the OD-CPC engine
+
+    python -m odcpc params --theta 30 --d1 50
+    python -m odcpc trace --theta 30 --rays 1000000 --engine analytic --output rays.npz
+    python -m odcpc trace --theta 30 --rays 10000000 --store rays/ --path-points 8 --chunk 200000
+    python -m odcpc transmission --theta 30 --angles 181 --rays 2000 --output curve.csv
+    python -m odcpc transmission --theta 30 --angles 91 --rays 20000 --skew --segments 4 --output square.csv
+    python -m odcpc dielectric --theta 20 --n 1.5 --angles 91 --rays 20000 --skew --output dielectric.csv
+    python -m odcpc phase-space --theta 30 --engine analytic --resolution 0.01 --output cutoff.csv
+    python -m odcpc irradiance --theta 30 --rays 1000000 --bins 100 --distribution lambertian --output flux.csv
+    python -m odcpc mesh scan.stl --theta 30 --angles 61 --rays 20000 --compare --output scan.csv
+    python -m odcpc export --theta 30 --steps 10000 --format binary-stl --output cpc.stl
+    python -m odcpc truncate --theta 5 --cuts 1000000 --max-area 2e5 --export cpc.stl --output cuts.csv
+    python -m odcpc tolerance --theta 30 --copies 500 --slope-error 3 --waviness 0.05 --seed 1 --output tolerance.csv
+    python -m odcpc yield --theta 10,20,30,40 --latitude 45 --adjustments 2 --kind trough --output hourly.csv
+    python -m odcpc sweep --theta 5:60:56 --d1 10:100:10 --n 1,1.5 --steps 100 --output sweep.csv
+    python -m odcpc job jobs.json
+
+A job file holds one job object, a list of them, or {"design": {...}, "jobs": [...]} where the
+design options are shared by all jobs. Each job names its "command" and uses the option names
+of that command (dashes or underscores), positional arguments included (e.g. "mesh_file").
+Every command prints a JSON summary to stdout.
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+from .cache import GeometryCache
+from .density import RayDensity
+from .dielectric import ENERGY_SINKS, dielectric_energy_for_angles
+from .irradiance import RAY_DISTRIBUTIONS, ReceiverIrradiance
+from .mesh import export_mesh
+from .phase_space import adaptive_phase_space
+from .raystore import trace_to_store
+from .skew import RevolvedWall, skew_transmission_for_angles
+from .solar import TABLE_KINDS, HOURS_PER_YEAR, TransmissionTable, annual_yield
+from .sweep import design_sweep, save_sweep
+from .tracing import RAY_FATES, FATE_RECEIVER, TRACE_ENGINES, trace_rays_batch
+from .transmission import transmission_curve
+from .tolerance import tolerance_analysis
+from .truncation import TRUNCATION_COLUMNS, TruncationIndex
+
+# Designs shared by the jobs of a job file
+GEOMETRY_CACHE = GeometryCache()
+
+# CLI names of the mesh formats
+FORMAT_NAMES = {"stl": "ASCII STL", "binary-stl": "Binary STL", "obj": "OBJ", "ply": "Binary PLY"}
+
+def add_design_arguments(parser):
+    group = parser.add_argument_group("design")
+    group.add_argument("--theta", type=float, default=30.0, help="acceptance half-angle θ (°)")
+    group.add_argument("--d1", type=float, default=50.0, help="receiver diameter (mm)")
+    group.add_argument("--n", type=float, default=1.0, help="refractive index (1 — mirror)")
+    group.add_argument("--steps", type=int, default=100, help="profile steps (1 — cone)")
+    group.add_argument("--tolerance", type=float, default=None,
+                       help="adaptive profile sampling: maximum chord deviation (mm)")
+
+def sweep_values(text):
+    """Swept values: 'start:stop:count' (inclusive linspace), 'a,b,c' or a single value"""
+    try:
+        if ":" in text:
+            start, stop, count = text.split(":")
+            return np.linspace(float(start), float(stop), int(count))
+        return np.array([float(value) for value in text.split(",")])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid sweep values: '{text}'")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="odcpc", description="OD-CPC — Compound Parabolic Concentrator engine")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    params = commands.add_parser("params", help="closed-form design parameters")
+    add_design_arguments(params)
+
+    trace = commands.add_parser("trace", help="trace a batch of meridional rays")
+    add_design_arguments(trace)
+    trace.add_argument("--engine", choices=TRACE_ENGINES, default="polyline")
+    trace.add_argument("--rays", type=int, default=10000, help="number of rays")
+    trace.add_argument("--angle-min", type=float, default=None, help="smallest angle (°), default -θ")
+    trace.add_argument("--angle-max", type=float, default=None, help="largest angle (°), default +θ")
+    trace.add_argument("--max-bounces", type=int, default=50)
+    trace.add_argument("--seed", type=int, default=None, help="random seed for positions and angles")
+    trace.add_argument("--output", default=None, help="save per-ray results to an .npz file")
+    trace.add_argument("--density", default=None, help="save the (z, r) ray-density image to an .npz file")
+    trace.add_argument("--density-columns", type=int, default=400, help="columns (along z) of the density image")
+    trace.add_argument("--store", default=None,
+                       help="stream per-ray records into memory-mapped .npy files in this directory")
+    trace.add_argument("--path-points", type=int, default=0, help="path vertices kept per ray in the store")
+    trace.add_argument("--chunk", type=int, default=100000, help="rays traced per chunk when storing")
+
+    transmission = commands.add_parser("transmission", help="angular transmission curve (process pool)")
+    add_design_arguments(transmission)
+    transmission.add_argument("--engine", choices=TRACE_ENGINES, default="polyline")
+    transmission.add_argument("--angles", type=int, default=181, help="number of angles over ±90°")
+    transmission.add_argument("--rays", type=int, default=1000, help="rays per angle")
+    transmission.add_argument("--processes", type=int, default=None, help="worker processes, default all cores")
+    transmission.add_argument("--skew", action="store_true",
+                              help="also trace 3D skew rays over the whole aperture for comparison")
+    transmission.add_argument("--segments", type=int, default=0,
+                              help="radial segments of the 3D wall (4 — square), 0 for a smooth revolution")
+    transmission.add_argument("--output", default=None, help="save the curve to a CSV file")
+
+    dielectric = commands.add_parser("dielectric", help="dielectric-filled vs mirror CPC transmission (Fresnel, TIR)")
+    add_design_arguments(dielectric)
+    dielectric.add_argument("--n-outside", type=float, default=1.0, help="refractive index around the concentrator")
+    dielectric.add_argument("--angles", type=int, default=91, help="number of external angles over ±90°")
+    dielectric.add_argument("--rays", type=int, default=10000, help="rays per angle")
+    dielectric.add_argument("--skew", action="store_true", help="3D rays over the whole aperture instead of meridional")
+    dielectric.add_argument("--segments", type=int, default=0,
+                            help="radial segments of the 3D wall (4 — square), 0 for a smooth revolution")
+    dielectric.add_argument("--max-bounces", type=int, default=50)
+    dielectric.add_argument("--min-weight", type=float, default=1e-4, help="stop rays below this energy weight")
+    dielectric.add_argument("--seed", type=int, default=None, help="random seed of the 3D rays")
+    dielectric.add_argument("--output", default=None, help="save the energy table to a CSV file")
+
+    phase = commands.add_parser("phase-space", help="adaptive (position, angle) sampling of the acceptance cutoff")
+    add_design_arguments(phase)
+    phase.add_argument("--engine", choices=TRACE_ENGINES, default="polyline")
+    phase.add_argument("--angle-range", type=float, default=None, help="sampled angles ±this (°), default ±2θ")
+    phase.add_argument("--resolution", type=float, default=0.01, help="finest angle step at the cutoff (°)")
+    phase.add_argument("--position-resolution", type=float, default=1 / 4096,
+                       help="finest position step as a fraction of the aperture")
+    phase.add_argument("--initial-cells", type=int, nargs=2, default=(32, 32), metavar=("POSITIONS", "ANGLES"),
+                       help="starting grid of cells")
+    phase.add_argument("--etendue-error", type=float, default=None, help="stop once the étendue error bound is below this (mm)")
+    phase.add_argument("--max-bounces", type=int, default=50)
+    phase.add_argument("--max-rays", type=int, default=10**8, help="ray budget")
+    phase.add_argument("--output", default=None, help="save the transmission per finest angle row to a CSV file")
+
+    irradiance = commands.add_parser("irradiance", help="receiver irradiance histogram from a ray batch")
+    add_design_arguments(irradiance)
+    irradiance.add_argument("--engine", choices=TRACE_ENGINES, default="polyline")
+    irradiance.add_argument("--rays", type=int, default=1000000, help="number of rays")
+    irradiance.add_argument("--bins", type=int, default=100, help="histogram bins along the receiver")
+    irradiance.add_argument("--distribution", choices=RAY_DISTRIBUTIONS, default="uniform",
+                            help="angular distribution within ±θ")
+    irradiance.add_argument("--area-weighted", action="store_true", help="annuli of the revolved absorber")
+    irradiance.add_argument("--chunk", type=int, default=100000, help="rays traced per chunk")
+    irradiance.add_argument("--seed", type=int, default=None, help="random seed")
+    irradiance.add_argument("--output", default=None, help="save the histogram to a CSV file")
+
+    mesh = commands.add_parser("mesh", help="3D transmission of an imported STL mesh (BVH)")
+    mesh.add_argument("mesh_file", help="ASCII or binary STL of the wall, axis along z, receiver at the lowest z")
+    add_design_arguments(mesh)
+    mesh.add_argument("--angles", type=int, default=61, help="number of angles over ±2θ of the design")
+    mesh.add_argument("--rays", type=int, default=10000, help="rays per angle over the aperture")
+    mesh.add_argument("--azimuth", type=float, default=0.0, help="azimuth of the incidence plane (°)")
+    mesh.add_argument("--max-bounces", type=int, default=50)
+    mesh.add_argument("--seed", type=int, default=None, help="random seed")
+    mesh.add_argument("--compare", action="store_true", help="also trace the ideal revolved wall of the design")
+    mesh.add_argument("--segments", type=int, default=0,
+                      help="radial segments of the compared wall (4 — square), 0 for a smooth revolution")
+    mesh.add_argument("--output", default=None, help="save the curve to a CSV file")
+
+    export = commands.add_parser("export", help="export the revolved wall as a mesh")
+    add_design_arguments(export)
+    export.add_argument("--format", choices=FORMAT_NAMES, default="binary-stl")
+    export.add_argument("--segments", type=int, default=36, help="radial segments (4 — square)")
+    export.add_argument("--half", action="store_true", help="half only")
+    export.add_argument("--decimals", type=int, default=6, help="decimal places of text formats")
+    export.add_argument("--stream", action="store_true", help="stream STL in bands of --chunk facets")
+    export.add_argument("--chunk", type=int, default=65536, help="facets per streamed band")
+    export.add_argument("--output", default=None, help="mesh file to write")
+
+    truncate = commands.add_parser("truncate", help="truncation trade-off: concentration vs wall area and length")
+    add_design_arguments(truncate)
+    truncate.add_argument("--cuts", type=int, default=1000, help="number of equally spaced cut heights to scan")
+    truncate.add_argument("--height", type=float, default=None, help="cut height above the receiver (mm)")
+    truncate.add_argument("--max-area", type=float, default=None, help="wall area budget (mm²)")
+    truncate.add_argument("--max-length", type=float, default=None, help="length budget (mm)")
+    truncate.add_argument("--output", default=None, help="save the scan with its Pareto fronts to a CSV file")
+    truncate.add_argument("--profile", default=None, help="save the truncated profile (z, r) to a CSV file")
+    truncate.add_argument("--export", default=None, help="export the truncated wall as a mesh file")
+    truncate.add_argument("--format", choices=FORMAT_NAMES, default="binary-stl")
+    truncate.add_argument("--segments", type=int, default=36, help="radial segments of the exported mesh")
+
+    tolerance = commands.add_parser("tolerance", help="Monte Carlo of manufacturing errors (perturbed walls)")
+    add_design_arguments(tolerance)
+    tolerance.add_argument("--copies", type=int, default=200, help="number of perturbed walls")
+    tolerance.add_argument("--slope-error", type=float, default=0.0, help="rms slope error of the wall (mrad)")
+    tolerance.add_argument("--waviness", type=float, default=0.0, help="rms low-frequency radial waviness (mm)")
+    tolerance.add_argument("--waviness-periods", type=int, default=3, help="highest waviness harmonic over the length")
+    tolerance.add_argument("--scale-error", type=float, default=0.0, help="rms relative radial scale error")
+    tolerance.add_argument("--tilt-error", type=float, default=0.0, help="rms tilt of the reflector axis (mrad)")
+    tolerance.add_argument("--angles", type=int, default=9, help="number of angles within ±θ")
+    tolerance.add_argument("--rays", type=int, default=200, help="rays per angle and wall")
+    tolerance.add_argument("--bins", type=int, default=50, help="receiver histogram bins")
+    tolerance.add_argument("--max-bounces", type=int, default=50)
+    tolerance.add_argument("--processes", type=int, default=None, help="worker processes, default all cores")
+    tolerance.add_argument("--seed", type=int, default=None, help="random seed of the perturbations")
+    tolerance.add_argument("--output", default=None, help="save the per-wall results to a CSV file")
+
+    annual = commands.add_parser("yield", help="annual energy yield from a cached transmission table")
+    annual.add_argument("--theta", type=sweep_values, default=sweep_values("30"), help="θ candidates (°)")
+    annual.add_argument("--d1", type=float, default=50.0, help="receiver diameter (mm)")
+    annual.add_argument("--n", type=float, default=1.0, help="refractive index (1 — mirror)")
+    annual.add_argument("--steps", type=int, default=100, help="profile steps (1 — cone)")
+    annual.add_argument("--tolerance", type=float, default=None,
+                        help="adaptive profile sampling: maximum chord deviation (mm)")
+    annual.add_argument("--latitude", type=float, default=45.0, help="site latitude (°, south negative)")
+    annual.add_argument("--tilt", type=float, default=None, help="fixed tilt (°), default the latitude")
+    annual.add_argument("--surface-azimuth", type=float, default=None,
+                        help="direction the aperture faces (° from north), default towards the equator")
+    annual.add_argument("--adjustments", type=int, default=0, help="re-tilts per year (0 — fixed tilt)")
+    annual.add_argument("--kind", choices=TABLE_KINDS, default="trough", help="east-west trough or revolved CPC")
+    annual.add_argument("--segments", type=int, default=0,
+                        help="radial segments of the revolved wall (4 — square), 0 for a smooth revolution")
+    annual.add_argument("--engine", choices=TRACE_ENGINES, default="polyline")
+    annual.add_argument("--table-angles", type=int, default=181, help="table angles over ±90°")
+    annual.add_argument("--table-rays", type=int, default=2000, help="rays per table entry")
+    annual.add_argument("--dni", default=None, help="CSV file with 8760 hourly DNI values (W/m²), default clear sky")
+    annual.add_argument("--cache-dir", default=None, help="directory of the cached tables")
+    annual.add_argument("--output", default=None, help="save the hourly collected irradiance per θ to a CSV file")
+
+    sweep = commands.add_parser("sweep", help="evaluate a grid of designs")
+    sweep.add_argument("--theta", type=sweep_values, default=sweep_values("30"), help="θ values (°)")
+    sweep.add_argument("--d1", type=sweep_values, default=sweep_values("50"), help="receiver diameters (mm)")
+    sweep.add_argument("--n", type=sweep_values, default=sweep_values("1"), help="refractive indices")
+    sweep.add_argument("--steps", type=sweep_values, default=sweep_values("100"), help="profile step counts")
+    sweep.add_argument("--engine", choices=TRACE_ENGINES, default="polyline")
+    sweep.add_argument("--transmission-angles", type=int, default=0,
+                       help="trace each design at this many angles within ±θ (0 — no tracing)")
+    sweep.add_argument("--rays", type=int, default=1000, help="rays per traced angle")
+    sweep.add_argument("--processes", type=int, default=None, help="worker processes, default all cores")
+    sweep.add_argument("--output", default=None, help="save the table to a .csv or .npz file")
+
+    job = commands.add_parser("job", help="run the jobs of a JSON job file")
+    job.add_argument("job_file")
+
+    return parser
+
+def design_from(args):
+    return GEOMETRY_CACHE.design(args.theta, args.d1, args.n, args.steps, args.tolerance)
+
+def run_params(args):
+    design = design_from(args)
+    summary = {key: float(value) for key, value in design.params.items()}
+    summary['profile_points'] = len(design.profile_z)
+    return summary
+
+def run_trace(args):
+    design = design_from(args)
+    params = design.params
+    angle_min = -args.theta if args.angle_min is None else args.angle_min
+    angle_max = args.theta if args.angle_max is None else args.angle_max
+
+    if args.store:
+        return run_trace_to_store(args, design, angle_min, angle_max)
+
+    rng = np.random.default_rng(args.seed)
+    half_r = params['d2'] / 2
+    r0 = rng.uniform(-half_r, half_r, args.rays)
+    angles = rng.uniform(angle_min, angle_max, args.rays)
+
+    start = time.perf_counter()
+    if args.density:
+        density = RayDensity.for_design(params, columns=args.density_columns)
+        result = density.trace(params, design.wall(args.engine), r0, angles, max_bounces=args.max_bounces)
+    else:
+        result = trace_rays_batch(params, design.profile_z, design.profile_r, r0, angles,
+                                  max_bounces=args.max_bounces, wall=design.wall(args.engine))
+    elapsed = time.perf_counter() - start
+
+    if args.output:
+        np.savez(args.output, r0=r0, angle_deg=angles, **result)
+    if args.density:
+        np.savez(args.density, image=density.image, extent=np.array(density.extent))
+
+    counts = np.bincount(result['fate'], minlength=len(RAY_FATES))
+    return {
+        'rays': args.rays,
+        'engine': args.engine,
+        'fates': {name: int(count) for name, count in zip(RAY_FATES, counts)},
+        'transmission': float(counts[FATE_RECEIVER] / max(1, args.rays)),
+        'mean_bounces': float(result['bounces'].mean()) if args.rays else 0.0,
+        'seconds': elapsed,
+        'output': args.output,
+    }
+
+def run_trace_to_store(args, design, angle_min, angle_max):
+    """trace --store: inputs drawn and results written chunk by chunk, nothing held for all rays"""
+    params = design.params
+    rng = np.random.default_rng(args.seed)
+    half_r = params['d2'] / 2
+
+    def sample(start, count):
+        return rng.uniform(-half_r, half_r, count), rng.uniform(angle_min, angle_max, count)
+
+    density = RayDensity.for_design(params, columns=args.density_columns) if args.density else None
+    segments = (lambda ray, z0, r0, z1, r1: density.add_segments(z0, r0, z1, r1)) if density else None
+
+    start = time.perf_counter()
+    store = trace_to_store(params, design.wall(args.engine), args.store, args.rays, sample, chunk=max(1, args.chunk),
+                           path_points=args.path_points, max_bounces=args.max_bounces, segments=segments,
+                           meta={'engine': args.engine, 'seed': args.seed})
+    elapsed = time.perf_counter() - start
+    if density:
+        np.savez(args.density, image=density.image, extent=np.array(density.extent))
+
+    counts = store.fate_counts()
+    bounces = sum(float(records['bounces'].sum(dtype=np.int64)) for _, records in store.iter_chunks())
+    return {
+        'rays': args.rays,
+        'engine': args.engine,
+        'fates': {name: int(count) for name, count in zip(RAY_FATES, counts)},
+        'transmission': float(counts[FATE_RECEIVER] / max(1, args.rays)),
+        'mean_bounces': bounces / args.rays if args.rays else 0.0,
+        'path_points': store.path_points,
+        'store_bytes': store.rays.nbytes + (store.paths.nbytes if store.paths is not None else 0),
+        'seconds': elapsed,
+        'store': args.store,
+    }
+
+def run_transmission(args):
+    design = design_from(args)
+    angles = np.linspace(-90, 90, args.angles)
+
+    start = time.perf_counter()
+    transmission = transmission_curve(design.params, design.profile_z, design.profile_r, angles,
+                                      n_positions=args.rays, engine=args.engine, processes=args.processes)
+    columns, header = [angles, transmission], "angle_deg,transmission"
+    if args.skew:
+        transmission_3d = transmission_curve(design.params, design.profile_z, design.profile_r, angles,
+                                             n_positions=args.rays, processes=args.processes, skew=True,
+                                             radial_segments=args.segments or None)
+        columns.append(transmission_3d)
+        header += ",transmission_3d"
+    elapsed = time.perf_counter() - start
+
+    if args.output:
+        np.savetxt(args.output, np.column_stack(columns), delimiter=",", fmt="%.10g", header=header, comments="")
+
+    inside = np.abs(angles) <= args.theta
+    summary = {
+        'angles': args.angles,
+        'rays_per_angle': args.rays,
+        'engine': args.engine,
+        'mean_inside_theta': float(transmission[inside].mean()) if inside.any() else None,
+        'mean_outside_theta': float(transmission[~inside].mean()) if (~inside).any() else None,
+        'seconds': elapsed,
+        'output': args.output,
+    }
+    if args.skew:
+        summary['radial_segments'] = args.segments or None
+        summary['mean_inside_theta_3d'] = float(transmission_3d[inside].mean()) if inside.any() else None
+        summary['mean_outside_theta_3d'] = float(transmission_3d[~inside].mean()) if (~inside).any() else None
+    return summary
+
+def run_dielectric(args):
+    design = design_from(args)
+    segments = args.segments or None
+    wall = design.get(('revolved', segments), lambda: RevolvedWall(design.profile_z, design.profile_r, segments))
+    angles = np.linspace(-90, 90, args.angles)
+    seed = np.random.SeedSequence(args.seed).entropy  # the same rays for both concentrators
+
+    start = time.perf_counter()
+    options = dict(meridional=not args.skew, max_bounces=args.max_bounces, rng=seed)
+    mirror = dielectric_energy_for_angles(wall, angles, args.rays, None, **options)
+    dielectric = dielectric_energy_for_angles(wall, angles, args.rays, args.n, args.n_outside,
+                                              min_weight=args.min_weight, **options)
+    elapsed = time.perf_counter() - start
+
+    if args.output:
+        header = ",".join(["angle_deg", "mirror"] + [f"dielectric_{sink}" for sink in ENERGY_SINKS])
+        np.savetxt(args.output, np.column_stack((angles, mirror[:, 0], dielectric)), delimiter=",",
+                   fmt="%.10g", header=header, comments="")
+
+    external = float(np.degrees(np.arcsin(min(1.0, args.n / args.n_outside * np.sin(np.radians(args.theta))))))
+    inside = np.abs(angles) <= external
+    summary = {
+        'angles': args.angles,
+        'rays_per_angle': args.rays,
+        'rays': "3D" if args.skew else "meridional",
+        'external_acceptance_deg': external,
+        'mirror_mean_inside_theta': float(mirror[np.abs(angles) <= args.theta, 0].mean()),
+        'dielectric_mean_inside_external': float(dielectric[inside, 0].mean()) if inside.any() else None,
+        'dielectric_energy': {sink: float(value) for sink, value in zip(ENERGY_SINKS, dielectric.mean(axis=0))},
+        'seconds': elapsed,
+        'output': args.output,
+    }
+    return summary
+
+def run_phase_space(args):
+    design = design_from(args)
+
+    start = time.perf_counter()
+    result = adaptive_phase_space(design.params, design.wall(args.engine), args.angle_range, args.resolution,
+                                  args.position_resolution, args.initial_cells, args.etendue_error,
+                                  args.max_bounces, args.max_rays)
+    elapsed = time.perf_counter() - start
+
+    if args.output:
+        np.savetxt(args.output, np.column_stack((result['angles_deg'], result['transmission'])), delimiter=",",
+                   fmt="%.10g", header="angle_deg,transmission", comments="")
+
+    summary = {key: value for key, value in result.items() if key not in ("angles_deg", "transmission")}
+    summary['cutoff_deg'] = [None if np.isnan(value) else value for value in result['cutoff_deg']]
+    summary['etendue_fraction'] = result['etendue'] / result['receiver_etendue']
+    summary['engine'] = args.engine
+    summary['seconds'] = elapsed
+    summary['output'] = args.output
+    return summary
+
+def run_irradiance(args):
+    design = design_from(args)
+
+    start = time.perf_counter()
+    histogram = ReceiverIrradiance(design.params, args.bins, args.area_weighted)
+    histogram.trace(design.wall(args.engine), args.rays, args.distribution, chunk=max(1, args.chunk), rng=args.seed)
+    elapsed = time.perf_counter() - start
+
+    if args.output:
+        histogram.save_csv(args.output)
+
+    irradiance = histogram.irradiance()
+    return {
+        'rays': args.rays,
+        'distribution': args.distribution,
+        'transmission': float(histogram.transmission()),
+        'mean_irradiance': float(histogram.mean_irradiance()),
+        'peak_irradiance': float(irradiance.max()),
+        'peak_radius': float(0.5 * (histogram.edges[:-1] + histogram.edges[1:])[irradiance.argmax()]),
+        'seconds': elapsed,
+        'output': args.output,
+    }
+
+def run_mesh(args):
+    start = time.perf_counter()
+    bvh = GEOMETRY_CACHE.imported_mesh(args.mesh_file)
+    loaded = time.perf_counter() - start
+    angles = np.linspace(-2 * args.theta, 2 * args.theta, args.angles)
+    transmission = skew_transmission_for_angles(bvh, angles, args.rays, args.azimuth, args.max_bounces, args.seed)
+    columns, header = [angles, transmission], "angle_deg,transmission"
+    if args.compare:
+        design = design_from(args)
+        segments = args.segments or None
+        ideal = design.get(('revolved', segments),
+                           lambda: RevolvedWall(design.profile_z, design.profile_r, segments))
+        columns.append(skew_transmission_for_angles(ideal, angles, args.rays, args.azimuth, args.max_bounces,
+                                                    args.seed))
+        header += ",transmission_ideal"
+    elapsed = time.perf_counter() - start
+
+    if args.output:
+        np.savetxt(args.output, np.column_stack(columns), delimiter=",", fmt="%.10g", header=header, comments="")
+
+    inside = np.abs(angles) <= args.theta
+    summary = {
+        'triangles': bvh.n_triangles,
+        'bvh_depth': bvh.depth,
+        'length': bvh.L - bvh.z_receiver,
+        'receiver_radius': bvh.receiver_radius,
+        'aperture_radius': bvh.aperture_radius,
+        'mean_inside_theta': float(transmission[inside].mean()) if inside.any() else None,
+        'load_seconds': loaded,
+        'seconds': elapsed,
+        'output': args.output,
+    }
+    if args.compare:
+        summary['mean_inside_theta_ideal'] = float(columns[2][inside].mean()) if inside.any() else None
+        summary['radial_segments'] = segments
+    return summary
+
+def run_export(args):
+    if not args.output:
+        raise ValueError("export needs an output file (--output)")
+    design = design_from(args)
+
+    start = time.perf_counter()
+    faces = export_mesh(args.output, design.profile_z, design.profile_r,
+                        export_format=FORMAT_NAMES[args.format], radial_segments=args.segments,
+                        half_only=args.half, decimal_places=args.decimals,
+                        streaming=args.stream, chunk_triangles=args.chunk)
+    return {'format': args.format, 'faces': faces, 'seconds': time.perf_counter() - start, 'output': args.output}
+
+def run_truncate(args):
+    design = design_from(args)
+    if args.cuts < 1:
+        raise ValueError("Number of cuts must be at least 1")
+
+    start = time.perf_counter()
+    index = design.get(('truncation',), lambda: TruncationIndex(design.profile_z, design.profile_r))
+    table = index.scan(args.cuts)
+    scanned = time.perf_counter() - start
+
+    # The chosen cut: an explicit height, else the best one within the budgets (the full CPC without any)
+    if args.height is not None:
+        if not 0 < args.height:
+            raise ValueError("Cut height must be positive")
+        height = min(args.height, index.length)
+    else:
+        height = index.best_cut(args.max_area, args.max_length)
+    if height <= 0:
+        raise ValueError("The budgets leave no wall to keep")
+    cut = {key: float(value) for key, value in index.evaluate(height).items()}
+    profile_z, profile_r = index.truncated_profile(height)
+
+    if args.output:
+        columns = TRUNCATION_COLUMNS + ("front_area", "front_length")
+        np.savetxt(args.output, np.column_stack([table[name] for name in columns]), delimiter=",",
+                   fmt=["%.10g"] * len(TRUNCATION_COLUMNS) + ["%d", "%d"], header=",".join(columns), comments="")
+    if args.profile:
+        np.savetxt(args.profile, np.column_stack((profile_z, profile_r)), delimiter=",", fmt="%.10g",
+                   header="z,r", comments="")
+    faces = None
+    if args.export:
+        faces = export_mesh(args.export, profile_z, profile_r, export_format=FORMAT_NAMES[args.format],
+                            radial_segments=args.segments)
+
+    full = index.evaluate(index.length)
+    return {
+        'full_length': index.length,
+        'full_concentration': float(full['concentration'][()]),
+        'full_wall_area': float(full['wall_area'][()]),
+        'cut': cut,
+        'length_fraction': height / index.length,
+        'concentration_fraction': cut['concentration'] / float(full['concentration'][()]),
+        'cuts': args.cuts,
+        'front_area_points': int(table['front_area'].sum()),
+        'front_length_points': int(table['front_length'].sum()),
+        'scan_seconds': scanned,
+        'profile_points': len(profile_z),
+        'faces': faces,
+        'seconds': time.perf_counter() - start,
+        'output': args.output,
+        'profile': args.profile,
+        'export': args.export,
+    }
+
+def run_tolerance(args):
+    design = design_from(args)
+    if args.copies < 1:
+        raise ValueError("Number of copies must be at least 1")
+    angles = args.theta * (np.linspace(-1, 1, args.angles) if args.angles > 1 else np.zeros(1))
+
+    start = time.perf_counter()
+    result = tolerance_analysis(design.params, design.profile_z, design.profile_r, args.copies, angles, args.rays,
+                                slope_error_mrad=args.slope_error, waviness=args.waviness,
+                                waviness_periods=args.waviness_periods, scale_error=args.scale_error,
+                                tilt_error_mrad=args.tilt_error, bins=args.bins, max_bounces=args.max_bounces,
+                                processes=args.processes, seed=args.seed)
+    elapsed = time.perf_counter() - start
+
+    mean = result['transmission'].mean(axis=1)
+    if args.output:
+        header = ",".join(["copy", "scale", "tilt_mrad", "mean_transmission", "mean_bounces", "peak_to_mean"]
+                          + [f"transmission_{angle:g}" for angle in angles])
+        table = np.column_stack((np.arange(args.copies), result['scale'], result['tilt'] * 1e3, mean,
+                                 result['mean_bounces'], result['peak_to_mean'], result['transmission']))
+        np.savetxt(args.output, table, delimiter=",", fmt=["%d"] + ["%.10g"] * (table.shape[1] - 1),
+                   header=header, comments="")
+
+    percentiles = np.percentile(mean, (5, 50, 95))
+    return {
+        'copies': args.copies,
+        'rays_per_wall': len(angles) * args.rays,
+        'nominal_transmission': float(result['nominal_transmission'].mean()),
+        'mean_transmission': float(mean.mean()),
+        'std_transmission': float(mean.std()),
+        'transmission_p5_p50_p95': [float(value) for value in percentiles],
+        'worst_transmission': float(mean.min()),
+        'nominal_peak_to_mean': float(result['nominal_peak_to_mean']),
+        'mean_peak_to_mean': float(np.nanmean(result['peak_to_mean'])),
+        'seconds': elapsed,
+        'output': args.output,
+    }
+
+def run_yield(args):
+    theta = sweep_values(args.theta) if isinstance(args.theta, str) else np.atleast_1d(args.theta)
+    dni = None
+    if args.dni:
+        dni = np.loadtxt(args.dni, delimiter=",", ndmin=1) if args.dni.lower().endswith(".csv") else np.loadtxt(args.dni)
+        if dni.ndim > 1:
+            dni = dni[:, -1]  # the last column of a table with hours or timestamps first
+
+    start = time.perf_counter()
+    candidates, hourly = [], []
+    for value in theta:
+        design = GEOMETRY_CACHE.design(float(value), args.d1, args.n, args.steps, args.tolerance)
+        traced = time.perf_counter()
+        table = TransmissionTable.cached(design.params, design.profile_z, design.profile_r, args.kind,
+                                         args.table_angles, args.table_rays, args.segments or None,
+                                         engine=args.engine, cache_dir=args.cache_dir)
+        traced = time.perf_counter() - traced
+        result = annual_yield(table, args.latitude, args.tilt, args.surface_azimuth, args.adjustments, dni)
+        hourly.append(result['collected'])
+        candidates.append({
+            'theta_deg': float(value),
+            'available_kwh_m2': result['available_kwh_m2'],
+            'collected_kwh_m2': result['collected_kwh_m2'],
+            'capture_fraction': result['capture_fraction'],
+            'receiver_kwh_m2': result['receiver_kwh_m2'],
+            'concentration': table.concentration,
+            'operating_hours': result['operating_hours'],
+            'monthly_kwh_m2': [float(month) for month in result['monthly_kwh_m2']],
+            'table_seconds': traced,
+        })
+    elapsed = time.perf_counter() - start
+
+    if args.output:
+        header = ",".join(["hour"] + [f"collected_theta_{value:g}" for value in theta])
+        np.savetxt(args.output, np.column_stack([np.arange(HOURS_PER_YEAR)] + hourly), delimiter=",",
+                   fmt=["%d"] + ["%.6g"] * len(hourly), header=header, comments="")
+
+    best = max(candidates, key=lambda item: item['receiver_kwh_m2']) if candidates else None
+    return {
+        'latitude': args.latitude,
+        'kind': args.kind,
+        'adjustments': args.adjustments,
+        'candidates': candidates,
+        'best_theta_receiver': best['theta_deg'] if best else None,
+        'seconds': elapsed,
+        'output': args.output,
+    }
+
+def run_sweep(args):
+    # Job files may give the swept values as numbers, lists or range strings
+    theta, d1, n, steps = (sweep_values(value) if isinstance(value, str) else np.atleast_1d(value)
+                           for value in (args.theta, args.d1, args.n, args.steps))
+
+    start = time.perf_counter()
+    table = design_sweep(theta, d1, n, np.round(steps).astype(np.int64),
+                         transmission_angles=args.transmission_angles, transmission_rays=args.rays,
+                         engine=args.engine, processes=args.processes)
+    elapsed = time.perf_counter() - start
+
+    if args.output:
+        save_sweep(args.output, table)
+
+    summary = {'designs': len(table['theta_deg']), 'seconds': elapsed, 'output': args.output}
+    for name in ("d2", "L", "C_max", "wall_area", "transmission"):
+        if name in table and len(table[name]):
+            summary[name] = [float(table[name].min()), float(table[name].max())]
+    return summary
+
+COMMANDS = {"params": run_params, "trace": run_trace, "transmission": run_transmission,
+            "dielectric": run_dielectric, "phase-space": run_phase_space, "irradiance": run_irradiance, "mesh": run_mesh, "export": run_export,
+            "truncate": run_truncate, "tolerance": run_tolerance, "yield": run_yield,
+            "sweep": run_sweep}
+
+def job_subparser(parser, command):
+    """The subparser of one command"""
+    for action in parser._actions:
+        if isinstance(action, argparse._SubParsersAction):
+            return action.choices[command]
+    raise ValueError(f"Unknown job command: {command}")
+
+def run_job_file(parser, job_file):
+    """Runs every job of a job file and returns their summaries"""
+    with open(job_file, encoding='utf-8') as f:
+        content = json.load(f)
+
+    shared = {}
+    if isinstance(content, dict) and "jobs" in content:
+        shared = content.get("design", {})
+        jobs = content["jobs"]
+    elif isinstance(content, dict):
+        jobs = [content]
+    else:
+        jobs = content
+
+    summaries = []
+    for job in jobs:
+        options = {key.replace("-", "_"): value for key, value in dict(shared, **job).items()}
+        command = options.pop("command", None)
+        if command not in COMMANDS:
+            raise ValueError(f"Unknown job command: {command}")
+
+        # Required positionals of the command are taken from the job, the other options set afterwards
+        positionals = []
+        for action in job_subparser(parser, command)._actions:
+            if action.option_strings or action.dest == argparse.SUPPRESS:
+                continue
+            value = options.pop(action.dest, None)
+            if value is None:
+                raise ValueError(f"Missing option '{action.dest}' for {command}")
+            positionals.append(str(value))
+
+        args = parser.parse_args([command, *positionals])
+        for key, value in options.items():
+            if not hasattr(args, key):
+                raise ValueError(f"Unknown option '{key}' for {command}")
+            setattr(args, key, value)
+        summaries.append(dict(command=command, **COMMANDS[command](args)))
+    return summaries
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "job":
+            summary = run_job_file(parser, args.job_file)
+        else:
+            summary = COMMANDS[args.command](args)
+    except (ValueError, OSError) as e:
+        print(f"odcpc: error: {e}", file=sys.stderr)
+        return 1
+
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+    return 0
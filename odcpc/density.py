@@ -0,0 +1,108 @@
+# -*- coding:utf-8 -*-
+"""
+Ray-density image of traced meridional rays over the (z, r) plane
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import threading
+
+import numpy as np
+
+from .tracing import trace_rays_batch
+
+class RayDensity:
+    """Ray path length (mm) per pixel of a (z, r) grid, accumulated batch by batch.
+
+    The image has rows along r and columns along z; extent is (z_min, z_max, r_min, r_max)
+    as used by imshow with origin='lower'. Adds and snapshots hold lock, so rays traced by a
+    worker thread and by the GUI thread can go into the same image.
+    """
+
+    def __init__(self, extent, shape=(300, 600)):
+        self.extent = tuple(float(value) for value in extent)
+        self.image = np.zeros(shape)
+        self.rays = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_design(cls, params, columns=400, margin=0.03):
+        """Grid over the concentrator with square pixels and a small margin around it"""
+        L, half_d2 = params['L'], params['d2'] / 2
+        pad = margin * max(L, half_d2)
+        extent = (-pad, L + pad, -half_d2 - pad, half_d2 + pad)
+        rows = max(1, int(round(columns * (extent[3] - extent[2]) / (extent[1] - extent[0]))))
+        return cls(extent, (rows, columns))
+
+    def clear(self):
+        with self.lock:
+            self.image[:] = 0
+            self.rays = 0
+
+    def snapshot(self):
+        """Copy of the image taken while no segments are being added"""
+        with self.lock:
+            return self.image.copy()
+
+    def add_segments(self, z0, r0, z1, r1, max_samples=2**20):
+        """Adds straight segments: each is clipped to the grid and sampled once per pixel along its
+        major direction, every sample carrying its share of the segment length"""
+        rows, columns = self.image.shape
+        z_min, z_max, r_min, r_max = self.extent
+        z0, r0, z1, r1 = (np.asarray(value, dtype=float) for value in (z0, r0, z1, r1))
+        length = np.hypot(z1 - z0, r1 - r0)
+
+        # Segment ends in pixel units
+        u0 = (z0 - z_min) * (columns / (z_max - z_min))
+        du = (z1 - z0) * (columns / (z_max - z_min))
+        v0 = (r0 - r_min) * (rows / (r_max - r_min))
+        dv = (r1 - r0) * (rows / (r_max - r_min))
+
+        # Clip the parameter range to the grid (Liang-Barsky)
+        t_lo = np.zeros(len(u0))
+        t_hi = np.ones(len(u0))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for p0, dp, size in ((u0, du, columns), (v0, dv, rows)):
+                t_a = (0 - p0) / dp
+                t_b = (size - p0) / dp
+                parallel = dp == 0
+                outside = parallel & ((p0 < 0) | (p0 >= size))
+                t_lo = np.where(parallel, t_lo, np.maximum(t_lo, np.minimum(t_a, t_b)))
+                t_hi = np.where(parallel, t_hi, np.minimum(t_hi, np.maximum(t_a, t_b)))
+                t_hi[outside] = -1.0
+        keep = t_hi > t_lo
+        u0, du, v0, dv = u0[keep] + t_lo[keep] * du[keep], du[keep], v0[keep] + t_lo[keep] * dv[keep], dv[keep]
+        du *= t_hi[keep] - t_lo[keep]
+        dv *= t_hi[keep] - t_lo[keep]
+        length = length[keep] * (t_hi[keep] - t_lo[keep])
+
+        steps = np.ceil(np.maximum(np.abs(du), np.abs(dv))).astype(np.int64) + 1
+        inv_steps = 1.0 / steps
+        weight = length * inv_steps
+
+        # Blocks of segments with at most max_samples samples
+        ends = np.cumsum(steps)
+        cuts = np.unique(np.searchsorted(ends, np.arange(max_samples, ends[-1], max_samples))) if len(ends) else []
+        flat = self.image.reshape(-1)
+        for block in np.split(np.arange(len(steps)), cuts):
+            if not len(block):
+                continue
+            counts = steps[block]
+            first = np.repeat(np.cumsum(counts) - counts, counts)
+            t = (np.arange(first.size) - first + 0.5) * np.repeat(inv_steps[block], counts)
+            u = np.repeat(u0[block], counts) + t * np.repeat(du[block], counts)
+            v = np.repeat(v0[block], counts) + t * np.repeat(dv[block], counts)
+            pixel = (np.minimum(v.astype(np.int64), rows - 1) * columns
+                     + np.minimum(u.astype(np.int64), columns - 1))
+            added = np.bincount(pixel, weights=np.repeat(weight[block], counts), minlength=flat.size)
+            with self.lock:
+                flat += added
+
+    def trace(self, params, wall, r0_aperture, angles_deg, max_bounces=50):
+        """Traces a batch of rays with trace_rays_batch and adds all their segments"""
+        result = trace_rays_batch(params, None, None, r0_aperture, angles_deg, max_bounces=max_bounces,
+                                  wall=wall, segments=lambda ray, z0, r0, z1, r1: self.add_segments(z0, r0, z1, r1))
+        with self.lock:
+            self.rays += result['fate'].size
+        return result
@@ -0,0 +1,166 @@
+# -*- coding:utf-8 -*-
+"""
+Dielectric-filled CPC: refraction at the aperture face, TIR or leakage at the wall, Fresnel weights
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import numpy as np
+
+from .skew import collimated_directions, sample_aperture_points, trace_skew_rays
+from .tracing import RAY_FATES, FATE_RECEIVER, FATE_ESCAPE_APERTURE, FATE_NO_INTERSECTION, FATE_MAX_BOUNCES, FATE_WALL_LEAK
+
+# Where the energy of the traced rays ends up, in the order of the 'energy' totals
+ENERGY_SINKS = ("receiver", "entrance_reflection", "aperture_escape", "wall_leakage", "residual")
+
+def fresnel_reflectance(cos_i, n1, n2):
+    """Unpolarized Fresnel reflectance from medium n1 into n2 and the cosine of the refraction
+    angle; total internal reflection gives R = 1 and cos_t = 0"""
+    cos_i = np.abs(cos_i)
+    sin_t2 = (n1 / n2) ** 2 * (1.0 - cos_i ** 2)
+    tir = sin_t2 >= 1.0
+    cos_t = np.sqrt(np.maximum(1.0 - sin_t2, 0.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rs = (n1 * cos_i - n2 * cos_t) / (n1 * cos_i + n2 * cos_t)
+        rp = (n2 * cos_i - n1 * cos_t) / (n2 * cos_i + n1 * cos_t)
+    reflectance = np.where(tir, 1.0, 0.5 * (rs * rs + rp * rp))
+    return np.nan_to_num(reflectance, nan=1.0), cos_t
+
+def trace_dielectric_rays(wall, origins, directions, n, n_outside=1.0, max_bounces=50, min_weight=1e-4):
+    """Traces rays entering a dielectric-filled concentrator (index n in a medium n_outside).
+
+    origins (n_rays, 3) lie on the flat aperture face z = L and directions are the external ones.
+    Every ray enters with the Fresnel transmittance of the face and is refracted. At the wall
+    it is totally internally reflected or splits: the refracted part leaks out and the ray goes
+    on with the reflected weight; at the aperture face from inside likewise (TIR or partial
+    escape). The receiver is in optical contact and absorbs everything reaching it. Rays whose
+    weight drops below min_weight stop with the fate of their last loss (wall_leak or
+    escape_aperture). The wall is a RevolvedWall or MeshBVH as in trace_skew_rays.
+
+    Returns a dict of arrays: 'fate', 'bounces' (wall and face reflections), the final point
+    'hit' (n_rays, 3), 'hit_z', 'hit_r', 'weight' (energy delivered to the receiver per ray)
+    and 'energy', the totals over all rays for each of ENERGY_SINKS (they add up to n_rays).
+    """
+    p = np.array(origins, dtype=float).reshape(-1, 3)
+    d = np.array(directions, dtype=float).reshape(-1, 3)
+    d /= np.linalg.norm(d, axis=1, keepdims=True)
+    n_rays = len(p)
+    energy = dict.fromkeys(ENERGY_SINKS, 0.0)
+
+    fate = np.full(n_rays, FATE_MAX_BOUNCES, dtype=np.int8)
+    bounces = np.zeros(n_rays, dtype=np.int32)
+    hit = p.copy()
+    received = np.zeros(n_rays)
+
+    # Entrance through the face (normal +z towards the outside)
+    cos_i = -d[:, 2]
+    reflectance, cos_t = fresnel_reflectance(cos_i, n_outside, n)
+    eta = n_outside / n
+    d *= eta
+    d[:, 2] += eta * cos_i - cos_t
+    weight = 1.0 - reflectance
+    energy['entrance_reflection'] = float(reflectance.sum())
+    last_loss = np.full(n_rays, FATE_WALL_LEAK, dtype=np.int8)
+
+    live = np.arange(n_rays)
+    while live.size:
+        t, *where = wall.nearest(p[live], d[live])
+
+        # Crossing the receiver or the aperture face before any wall hit
+        dz = d[live, 2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_plane = np.where(dz < 0, (wall.z_receiver - p[live, 2]) / dz,
+                               np.where(dz > 0, (wall.L - p[live, 2]) / dz, np.inf))
+        at_plane = (t_plane <= t) | ~np.isfinite(t)
+        crossed = at_plane & np.isfinite(t_plane)
+        t = np.where(crossed, t_plane, t)
+        points = p[live] + np.where(np.isfinite(t), t, 0)[:, None] * d[live]
+        hit[live] = points
+
+        on_receiver = crossed & (dz < 0) & (np.hypot(points[:, 0], points[:, 1]) <= wall.receiver_radius + 1e-9)
+        done = live[on_receiver]
+        fate[done] = FATE_RECEIVER
+        received[done] = weight[done]
+        energy['receiver'] += float(weight[done].sum())
+
+        lost = at_plane & ~on_receiver & ~(crossed & (dz > 0))
+        done = live[lost]
+        fate[done] = FATE_NO_INTERSECTION
+        energy['residual'] += float(weight[done].sum())
+
+        # Interfaces: the aperture face from inside or the wall
+        at_face = crossed & (dz > 0)
+        at_wall = ~at_plane
+        interface = at_face | at_wall
+        rays = live[interface]
+        normal = np.zeros((len(rays), 3))
+        normal[at_face[interface], 2] = 1.0
+        if at_wall.any():
+            normal[at_wall[interface]] = wall.normals(points[at_wall], *(item[at_wall] for item in where))
+
+        v = d[rays]
+        dot = np.einsum('ij,ij->i', v, normal)
+        reflectance, _ = fresnel_reflectance(dot, n, n_outside)
+        loss = weight[rays] * (1.0 - reflectance)
+        energy['aperture_escape'] += float(loss[at_face[interface]].sum())
+        energy['wall_leakage'] += float(loss[at_wall[interface]].sum())
+        weight[rays] -= loss
+        last_loss[rays] = np.where(at_face[interface], FATE_ESCAPE_APERTURE, FATE_WALL_LEAK)
+
+        v = v - 2 * dot[:, None] * normal
+        v /= np.linalg.norm(v, axis=1, keepdims=True)
+        bounces[rays] += 1
+        p[rays] = points[interface] + v * 1e-6  # a slight shift to avoid self-intersection
+        d[rays] = v
+
+        # Rays spent by the losses and rays that exhausted the bounce budget
+        spent = weight[rays] < min_weight
+        done = rays[spent]
+        fate[done] = last_loss[done]
+        energy['residual'] += float(weight[done].sum())
+        live = rays[~spent]
+        exhausted = bounces[live] > max_bounces
+        energy['residual'] += float(weight[live[exhausted]].sum())
+        live = live[~exhausted]
+
+    return {'fate': fate, 'bounces': bounces, 'hit': hit, 'hit_z': hit[:, 2],
+            'hit_r': np.hypot(hit[:, 0], hit[:, 1]), 'weight': received, 'energy': energy}
+
+def launch_points(wall, n_rays, meridional=False, rng=None):
+    """Start points on the aperture: bin midpoints along the x diameter (meridional, as
+    transmission_for_angles) or random points over the whole aperture"""
+    if meridional:
+        half_r = wall.aperture_radius
+        x = (np.arange(n_rays) + 0.5) / n_rays * 2 * half_r - half_r
+        return np.column_stack((x, np.zeros(n_rays), np.full(n_rays, wall.L)))
+    return sample_aperture_points(wall, n_rays, rng)
+
+def dielectric_energy_for_angles(wall, angles_deg, n_rays, n, n_outside=1.0, meridional=False, azimuth_deg=0.0,
+                                 max_bounces=50, min_weight=1e-4, rng=None, progress=None):
+    """Energy fractions of ENERGY_SINKS (columns) per external incidence angle (rows) for
+    collimated beams tilted in the plane at azimuth_deg; column 0 is the transmission to the
+    receiver. n=None traces the hollow mirror CPC on the same rays (ideal reflections, rays
+    leaving through the aperture count as aperture_escape). progress(done, total) is called
+    after each angle."""
+    rng = np.random.default_rng(rng)
+    fractions = np.zeros((len(angles_deg), len(ENERGY_SINKS)))
+    fractions[:, ENERGY_SINKS.index("entrance_reflection")] = 1.0  # grazing and beyond: nothing enters
+    for i, angle in enumerate(angles_deg):
+        if abs(angle) < 90:
+            origins = launch_points(wall, n_rays, meridional, rng)
+            directions = collimated_directions(angle, n_rays, 0.0 if meridional else azimuth_deg)
+            if n is None:
+                fate = trace_skew_rays(wall, origins, directions, max_bounces)['fate']
+                counts = np.bincount(fate, minlength=len(RAY_FATES))
+                energy = dict.fromkeys(ENERGY_SINKS, 0.0)
+                energy['receiver'] = counts[FATE_RECEIVER]
+                energy['aperture_escape'] = counts[FATE_ESCAPE_APERTURE]
+                energy['residual'] = n_rays - counts[FATE_RECEIVER] - counts[FATE_ESCAPE_APERTURE]
+            else:
+                energy = trace_dielectric_rays(wall, origins, directions, n, n_outside, max_bounces,
+                                               min_weight)['energy']
+            fractions[i] = [energy[sink] / n_rays for sink in ENERGY_SINKS]
+        if progress:
+            progress(i + 1, len(angles_deg))
+    return fractions
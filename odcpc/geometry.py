@@ -0,0 +1,170 @@
+# -*- coding:utf-8 -*-
+"""
+CPC geometry: closed-form parameters and wall profiles
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import numpy as np
+
+def calculate_cpc_parameters(theta_deg, d1, n):
+    """Calculates all CPC parameters once and caches them"""
+    # z = (f/2)(1 + cosφ)  ⇒  cosφ = 2z/f - 1; r = f·sinφ/(1 + cosφ) + d/2 = f·tan(φ/2) + d/2
+    theta = np.radians(theta_deg)
+
+    # Basic constants
+    C = np.cos(theta)
+    S = np.sin(theta)
+    P = 1 + S
+    Q = 1 + P
+    T = 1 + Q
+
+    # Basic calculations
+    d2 = d1 / S
+    focus = (d1 / 2) * (1 + S)
+    L = (focus * C) / (S ** 2)
+    C_max = n ** 2 / (S ** 2)
+
+    # Pre-calculated constants for the profile equation
+    A_const = C ** 2
+    B_const_part1 = 2 * C * S
+    B_const_part2 = 2 * (d1 / 2) * P ** 2
+    D_const_part1 = S ** 2
+    D_const_part2 = 2 * (d1 / 2) * C * Q
+    D_const_part3 = (d1 / 2) ** 2 * P * T
+
+    return {
+        'theta': theta,
+        'theta_deg': theta_deg,
+        'd1': d1,
+        'd2': d2,
+        'focus': focus,
+        'L': L,
+        'C_max': C_max,
+        'C': C,
+        'S': S,
+        'P': P,
+        'Q': Q,
+        'T': T,
+        'A_const': A_const,
+        'B_const_part1': B_const_part1,
+        'B_const_part2': B_const_part2,
+        'D_const_part1': D_const_part1,
+        'D_const_part2': D_const_part2,
+        'D_const_part3': D_const_part3
+    }
+
+def calculate_profile_points(params, num_points):
+    """Returns the wall profile as contiguous float64 arrays (z, r) computed in one pass"""
+    if num_points == 1:
+        z_values = np.array([0, params['L']], dtype=np.float64)
+    else:
+        z_values = np.linspace(0, params['L'], num_points + 1, dtype=np.float64)
+
+    return z_values, calculate_profile_radius(params, z_values)
+
+def calculate_profile_radius(params, z_values):
+    """Exact wall radius r(z) of the conic for an array of axial coordinates"""
+    B = params['B_const_part1'] * z_values + params['B_const_part2']
+    D = (params['D_const_part1'] * z_values ** 2 - 
+         params['D_const_part2'] * z_values - 
+         params['D_const_part3'])
+
+    discriminant = B ** 2 - 4 * params['A_const'] * D
+
+    # Points with a negative discriminant stay on the axis (r = 0); parameters may be arrays
+    # broadcasting against z_values (one row per design)
+    valid = discriminant >= 0
+    root = np.sqrt(np.where(valid, discriminant, 0.0))
+    return np.where(valid, (-B + root) / (2 * params['A_const']), 0.0)
+
+def calculate_chord_deviation(params, z_values):
+    """Largest distance between each profile chord and the exact wall (sampled at ¼, ½, ¾ of the chord)"""
+    r_values = calculate_profile_radius(params, z_values)
+    dz = np.diff(z_values)
+    dr = np.diff(r_values)
+    chord = np.hypot(dz, dr)
+
+    deviation = np.zeros(len(dz))
+    for fraction in (0.25, 0.5, 0.75):
+        z = z_values[:-1] + fraction * dz
+        r = calculate_profile_radius(params, z)
+        # Distance from (z, r) to the chord line
+        offset = np.abs((z - z_values[:-1]) * dr - (r - r_values[:-1]) * dz) / chord
+        np.maximum(deviation, offset, out=deviation)
+    return deviation
+
+def calculate_adaptive_profile_points(params, tolerance, max_points=10**7, progress=None):
+    """Non-uniform profile whose chords deviate from the exact wall by at most tolerance (mm).
+
+    Points are first distributed with density √(κ / 8·tolerance) per unit arc length (the sagitta
+    of a chord of length h is ≈ κ·h²/8), then every chord that still exceeds the tolerance is split.
+    progress(points, max_points) is called before each splitting round.
+    """
+    L = params['L']
+
+    # Curvature of the wall on a reference grid
+    z_ref = np.linspace(0, L, 4097)
+    r_ref = calculate_profile_radius(params, z_ref)
+    slope = np.gradient(r_ref, z_ref)
+    kappa = np.abs(np.gradient(slope, z_ref)) / (1 + slope ** 2) ** 1.5
+
+    # Equidistribute √κ along the arc length
+    density = np.sqrt(np.nan_to_num(kappa) / (8 * tolerance))
+    ds = np.hypot(np.diff(z_ref), np.diff(r_ref))
+    cumulative = np.concatenate(([0.0], np.cumsum(0.5 * (density[1:] + density[:-1]) * ds)))
+    num_points = int(min(max(1, np.ceil(cumulative[-1])), max_points))
+    z_values = np.interp(np.linspace(0, cumulative[-1], num_points + 1), cumulative, z_ref)
+    z_values[0], z_values[-1] = 0.0, L
+
+    # Split the chords that still deviate too much
+    while len(z_values) < max_points:
+        if progress:
+            progress(len(z_values), max_points)
+        too_far = calculate_chord_deviation(params, z_values) > tolerance
+        if not too_far.any():
+            break
+        midpoints = 0.5 * (z_values[:-1] + z_values[1:])[too_far]
+        z_values = np.sort(np.concatenate((z_values, midpoints)))
+
+    z_values = np.ascontiguousarray(z_values, dtype=np.float64)
+    return z_values, calculate_profile_radius(params, z_values)
+
+def calculate_uniform_steps_for_tolerance(params, tolerance, max_steps=10**8, progress=None):
+    """Smallest number of uniform steps whose chords stay within tolerance (mm) of the wall;
+    progress(steps, max_steps) is called before each tested step count"""
+    def fits(steps):
+        if progress:
+            progress(steps, max_steps)
+        z_values = np.linspace(0, params['L'], steps + 1)
+        return calculate_chord_deviation(params, z_values).max() <= tolerance
+
+    high = 1
+    while not fits(high):
+        if high >= max_steps:
+            return max_steps
+        high *= 2
+    low = high // 2
+    while high - low > 1:
+        middle = (low + high) // 2
+        if fits(middle):
+            high = middle
+        else:
+            low = middle
+    return high
+
+def calculate_design(theta_deg, d1, n, steps, tolerance=None, progress=None):
+    """Parameters and wall profile of one design; a tolerance (mm) selects adaptive sampling
+    (progress as in calculate_adaptive_profile_points)"""
+    if not 0 < theta_deg < 90:
+        raise ValueError("Angle θ must be between 0 and 90 degrees")
+
+    params = calculate_cpc_parameters(theta_deg, d1, n)
+    if tolerance and int(steps) != 1:
+        if tolerance <= 0:
+            raise ValueError("Tolerance must be positive")
+        profile_z, profile_r = calculate_adaptive_profile_points(params, tolerance, progress=progress)
+    else:
+        profile_z, profile_r = calculate_profile_points(params, max(1, int(steps)))
+    return params, profile_z, profile_r
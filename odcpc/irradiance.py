@@ -0,0 +1,105 @@
+# -*- coding:utf-8 -*-
+"""
+Receiver irradiance: histogram of receiver hits from large ray batches
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import numpy as np
+
+from .tracing import FATE_RECEIVER, trace_rays_batch
+
+# Angular distributions of the incident rays within ±θ
+RAY_DISTRIBUTIONS = ("uniform", "lambertian")
+
+def sample_aperture_rays(params, n_rays, distribution="uniform", area_weighted=False, rng=None):
+    """Random start positions on the aperture and angles (°) within ±θ.
+
+    'uniform' spreads the angles evenly, 'lambertian' weights them by cos α (sin α uniform).
+    With area_weighted the positions are uniform over the aperture disk of the revolved
+    concentrator (density ∝ |r|) instead of along its diameter.
+    """
+    if distribution not in RAY_DISTRIBUTIONS:
+        raise ValueError(f"Unknown ray distribution: {distribution}")
+    rng = np.random.default_rng(rng)
+    half_r = params['d2'] / 2
+    theta = params['theta']
+
+    if area_weighted:
+        r0 = half_r * np.sqrt(rng.random(n_rays)) * rng.choice((-1.0, 1.0), n_rays)
+    else:
+        r0 = rng.uniform(-half_r, half_r, n_rays)
+
+    if distribution == "lambertian":
+        angles = np.degrees(np.arcsin(rng.uniform(-np.sin(theta), np.sin(theta), n_rays)))
+    else:
+        angles = rng.uniform(-params['theta_deg'], params['theta_deg'], n_rays)
+    return r0, angles
+
+class ReceiverIrradiance:
+    """Histogram of receiver hits along the receiver radius, accumulated batch by batch.
+
+    Without area weighting the bins span the receiver diameter [-d1/2, d1/2] (meridional
+    section); with it they are annuli over [0, d1/2] of the revolved absorber. irradiance()
+    is the local flux density relative to the flux density on the aperture, i.e. the local
+    concentration ratio. Only meridional rays are traced, so the revolved map leaves out the
+    skew rays and overstates the flux near the axis.
+    """
+
+    def __init__(self, params, bins=100, area_weighted=False):
+        half_d1 = params['d1'] / 2
+        self.params = params
+        self.area_weighted = area_weighted
+        self.edges = np.linspace(0 if area_weighted else -half_d1, half_d1, bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.rays = 0
+
+    def add_hits(self, hit_r, rays=None):
+        """Adds receiver hit radii; rays is the number of traced rays they came from"""
+        hit_r = np.abs(hit_r) if self.area_weighted else np.asarray(hit_r)
+        bins = len(self.counts)
+        index = np.searchsorted(self.edges, hit_r, side='right') - 1
+        index[hit_r == self.edges[-1]] = bins - 1  # the receiver edge belongs to the last bin
+        inside = (index >= 0) & (index < bins)
+        self.counts += np.bincount(index[inside], minlength=bins)
+        self.rays += len(hit_r) if rays is None else rays
+
+    def trace(self, wall, n_rays, distribution="uniform", chunk=100000, max_bounces=50, rng=None,
+              progress=None):
+        """Traces n_rays sampled with sample_aperture_rays in chunks and accumulates their hits.
+
+        Only one chunk is held in memory at a time; progress(done, total) is called after each.
+        """
+        rng = np.random.default_rng(rng)
+        for start in range(0, n_rays, chunk):
+            count = min(chunk, n_rays - start)
+            r0, angles = sample_aperture_rays(self.params, count, distribution, self.area_weighted, rng)
+            result = trace_rays_batch(self.params, None, None, r0, angles, max_bounces=max_bounces, wall=wall)
+            self.add_hits(result['hit_r'][result['fate'] == FATE_RECEIVER], rays=count)
+            if progress:
+                progress(start + count, n_rays)
+        return self
+
+    def irradiance(self):
+        """Relative irradiance per bin: hit density over the density of rays on the aperture"""
+        half_d2 = self.params['d2'] / 2
+        if self.area_weighted:
+            bin_size = np.pi * np.diff(self.edges ** 2)
+            aperture = np.pi * half_d2 ** 2
+        else:
+            bin_size = np.diff(self.edges)
+            aperture = 2 * half_d2
+        return self.counts / bin_size / (max(1, self.rays) / aperture)
+
+    def mean_irradiance(self):
+        """Relative irradiance averaged over the whole receiver"""
+        return np.average(self.irradiance(), weights=np.diff(self.edges ** 2 if self.area_weighted else self.edges))
+
+    def transmission(self):
+        return self.counts.sum() / max(1, self.rays)
+
+    def save_csv(self, file_path):
+        np.savetxt(file_path, np.column_stack((self.edges[:-1], self.edges[1:], self.counts, self.irradiance())),
+                   delimiter=",", fmt=("%.10g", "%.10g", "%d", "%.10g"),
+                   header="r_min,r_max,hits,relative_irradiance", comments="")
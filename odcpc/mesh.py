@@ -0,0 +1,255 @@
+# -*- coding:utf-8 -*-
+"""
+Mesh export of the surface of revolution: STL (ASCII, binary, streamed), OBJ and PLY; STL import
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import os
+import re
+
+import numpy as np
+
+# Mesh export
+EXPORT_FORMATS = ("ASCII STL", "Binary STL", "OBJ", "Binary PLY")
+EXPORT_EXTENSIONS = {"ASCII STL": ".stl", "Binary STL": ".stl", "OBJ": ".obj", "Binary PLY": ".ply"}
+
+# Binary STL facet record: normal, three vertices, attribute byte count (50 bytes)
+STL_FACET_DTYPE = np.dtype([('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)), ('attribute', '<u2')])
+
+def revolved_grid(profile_z, profile_r, cos_phi, sin_phi):
+    """Vertices of the surface of revolution as a (profile rows, azimuth columns, 3) grid"""
+    grid = np.empty((len(profile_z), len(cos_phi), 3))
+    np.multiply(profile_r[:, None], cos_phi, out=grid[..., 0])
+    np.multiply(profile_r[:, None], sin_phi, out=grid[..., 1])
+    grid[..., 2] = profile_z[:, None]
+    return grid
+
+def grid_triangles(grid):
+    """Triangles (n_tri, 3, 3) of a vertex grid, two per cell in the order of save_to_stl_thread"""
+    p11, p21 = grid[:-1, :-1], grid[1:, :-1]
+    p12, p22 = grid[:-1, 1:], grid[1:, 1:]
+    triangles = np.empty(p11.shape[:2] + (2, 3, 3), dtype=grid.dtype)
+    triangles[:, :, 0] = np.stack((p11, p21, p12), axis=-2)
+    triangles[:, :, 1] = np.stack((p21, p22, p12), axis=-2)
+    return triangles.reshape(-1, 3, 3)
+
+def facet_normals(triangles):
+    """Unit facet normals (v2 - v1) × (v3 - v1); degenerate facets get a zero normal"""
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    norm = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, norm, out=normals, where=norm > 0)
+    return normals
+
+def pack_binary_stl(triangles, normals):
+    """Packs triangles and normals into binary STL facet records"""
+    records = np.zeros(len(triangles), dtype=STL_FACET_DTYPE)
+    records['normal'] = normals
+    records['vertices'] = triangles
+    return records
+
+def write_binary_stl(file_path, triangles, normals=None, name="OD-CPC_3D_Model"):
+    """Writes a binary STL file with a single buffer write of all facet records"""
+    if normals is None:
+        normals = facet_normals(triangles)
+    records = pack_binary_stl(triangles, normals)
+    with open(file_path, 'wb') as f:
+        f.write(name.encode('ascii').ljust(80, b' ')[:80])
+        f.write(np.uint32(len(records)).tobytes())
+        f.write(records.tobytes())
+
+def read_stl(file_path):
+    """Reads the triangles (n_tri, 3, 3) of an ASCII or binary STL file as float32.
+
+    A file whose size matches the facet count in its header is binary (binary files may also
+    begin with "solid"); anything else is parsed as ASCII vertex lines.
+    """
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        header = f.read(84)
+        if len(header) == 84 and size == 84 + STL_FACET_DTYPE.itemsize * int(np.frombuffer(header[80:], '<u4')[0]):
+            return np.fromfile(f, dtype=STL_FACET_DTYPE)['vertices'].copy()
+        f.seek(0)
+        text = f.read()
+
+    if not text.lstrip().startswith(b"solid"):
+        raise ValueError(f"Not an STL file: {file_path}")
+    number = rb"([-+0-9.eEnNaAiIfF]+)"
+    vertices = re.findall(rb"vertex\s+" + number + rb"\s+" + number + rb"\s+" + number, text)
+    if len(vertices) % 3:
+        raise ValueError(f"Incomplete facet in STL file: {file_path}")
+    return np.array(vertices, dtype=np.float32).reshape(-1, 3, 3)
+
+def iter_mesh_bands(profile_z, profile_r, cos_phi, sin_phi, band_rows):
+    """Yields (rows done, triangles) for consecutive bands of at most band_rows profile intervals"""
+    n_rows = len(profile_z) - 1
+    for start in range(0, n_rows, band_rows):
+        stop = min(start + band_rows, n_rows)
+        grid = revolved_grid(profile_z[start:stop + 1], profile_r[start:stop + 1], cos_phi, sin_phi)
+        yield stop, grid_triangles(grid)
+
+def format_ascii_facets(triangles, normals, decimal_places):
+    """Formats facets as one ASCII STL text block, identical to write_triangle output"""
+    number = f"%.{decimal_places}f"
+    facet = (f"  facet normal {number} {number} {number}\n    outer loop\n"
+             + f"      vertex {number} {number} {number}\n" * 3
+             + "    endloop\n  endfacet\n")
+    values = np.concatenate((normals[:, None, :], triangles), axis=1)
+    return (facet * len(triangles)) % tuple(values.ravel().tolist())
+
+def write_stl_streaming(file_path, profile_z, profile_r, cos_phi, sin_phi, binary=True,
+                        decimal_places=6, chunk_triangles=65536, progress=None, name="OD-CPC_3D_Model"):
+    """Writes the revolved surface band by band so that memory is bounded by chunk_triangles.
+
+    Each band of profile rows is triangulated, formatted (ASCII) or packed (binary) as one block
+    and appended to the file. The binary facet count is written as a placeholder and patched at
+    the end. progress(triangles written, total) is called after every band.
+    """
+    columns = len(cos_phi) - 1
+    band_rows = max(1, chunk_triangles // max(1, 2 * columns))
+    total = (len(profile_z) - 1) * columns * 2
+    written = 0
+
+    with open(file_path, 'wb') as f:
+        if binary:
+            f.write(name.encode('ascii').ljust(80, b' ')[:80])
+            f.write(np.uint32(0).tobytes())
+        else:
+            f.write(f"solid {name}\n".encode('ascii'))
+
+        for _, triangles in iter_mesh_bands(profile_z, profile_r, cos_phi, sin_phi, band_rows):
+            normals = facet_normals(triangles)
+            if binary:
+                f.write(pack_binary_stl(triangles, normals).tobytes())
+            else:
+                f.write(format_ascii_facets(triangles, normals, decimal_places).encode('ascii'))
+            written += len(triangles)
+            if progress:
+                progress(written, total)
+
+        if binary:
+            f.seek(80)
+            f.write(np.uint32(written).tobytes())
+        else:
+            f.write(f"endsolid {name}\n".encode('ascii'))
+
+    return written
+
+def revolved_mesh(profile_z, profile_r, azimuth_range):
+    """Indexed mesh of the surface of revolution with every grid vertex stored once.
+
+    A full turn (last azimuth = first + 2π) wraps around instead of duplicating the seam column.
+    Returns vertices (n, 3) and triangle faces (m, 3) of 0-based indices, with the same
+    winding as the STL writers.
+    """
+    closed = np.isclose(azimuth_range[-1] - azimuth_range[0], 2 * np.pi)
+    if closed:
+        azimuth_range = azimuth_range[:-1]
+
+    grid = revolved_grid(profile_z, profile_r, np.cos(azimuth_range), np.sin(azimuth_range))
+    rows, columns = grid.shape[:2]
+    index = np.arange(rows * columns).reshape(rows, columns)
+
+    # Cell corners straight from the grid topology
+    left = index if closed else index[:, :-1]
+    right = np.roll(index, -1, axis=1) if closed else index[:, 1:]
+    i11, i21 = left[:-1], left[1:]
+    i12, i22 = right[:-1], right[1:]
+
+    faces = np.empty(i11.shape + (2, 3), dtype=np.int64)
+    faces[..., 0, :] = np.stack((i11, i21, i12), axis=-1)
+    faces[..., 1, :] = np.stack((i21, i22, i12), axis=-1)
+    return grid.reshape(-1, 3), faces.reshape(-1, 3)
+
+def _format_rows(row_format, values, block=65536):
+    """Formats a 2D array row by row with one %-operation per block of rows"""
+    for start in range(0, len(values), block):
+        chunk = values[start:start + block]
+        yield (row_format * len(chunk)) % tuple(chunk.ravel().tolist())
+
+def write_obj(file_path, vertices, faces, decimal_places=6, name="OD-CPC_3D_Model"):
+    """Writes an indexed Wavefront OBJ mesh (1-based face indices)"""
+    number = f"%.{decimal_places}f"
+    with open(file_path, 'w', encoding='ascii') as f:
+        f.write(f"# {name}\no {name}\n")
+        for text in _format_rows(f"v {number} {number} {number}\n", vertices):
+            f.write(text)
+        for text in _format_rows("f %d %d %d\n", faces + 1):
+            f.write(text)
+
+def write_binary_ply(file_path, vertices, faces, name="OD-CPC_3D_Model"):
+    """Writes an indexed little-endian binary PLY mesh (float vertices, triangle index lists)"""
+    face_records = np.empty(len(faces), dtype=[('count', 'u1'), ('indices', '<i4', (3,))])
+    face_records['count'] = 3
+    face_records['indices'] = faces
+    header = ("ply\n"
+              "format binary_little_endian 1.0\n"
+              f"comment {name}\n"
+              f"element vertex {len(vertices)}\n"
+              "property float x\nproperty float y\nproperty float z\n"
+              f"element face {len(faces)}\n"
+              "property list uchar int vertex_indices\n"
+              "end_header\n")
+    with open(file_path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        f.write(np.ascontiguousarray(vertices, dtype='<f4').tobytes())
+        f.write(face_records.tobytes())
+
+def azimuth_range(radial_segments, half_only=False):
+    """Azimuths of the revolved grid columns; a half turn keeps radial_segments // 2 cells"""
+    if half_only:
+        return np.linspace(0, np.pi, radial_segments // 2 + 1)
+    return np.linspace(0, 2 * np.pi, radial_segments + 1)
+
+def export_mesh(file_path, profile_z, profile_r, export_format="Binary STL", radial_segments=36,
+                half_only=False, decimal_places=6, streaming=False, chunk_triangles=65536, progress=None,
+                mesh=None):
+    """Writes the revolved wall in one of EXPORT_FORMATS and returns the number of faces.
+
+    STL can be streamed in bands of chunk_triangles facets; OBJ and PLY are always written as
+    indexed meshes, taken from mesh (vertices, faces of revolved_mesh) when it is already built.
+    progress(percent, text) is called as the export advances.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+
+    def report(percent, text):
+        if progress:
+            progress(percent, text)
+
+    azimuths = azimuth_range(radial_segments, half_only)
+    cos_phi = np.cos(azimuths)
+    sin_phi = np.sin(azimuths)
+    total_triangles = (len(profile_z) - 1) * (len(azimuths) - 1) * 2
+
+    if export_format in ("OBJ", "Binary PLY"):
+        # Indexed mesh: every grid vertex once, faces from the grid topology
+        report(0, "Building indexed mesh...")
+        vertices, faces = mesh if mesh is not None else revolved_mesh(profile_z, profile_r, azimuths)
+        report(50, f"Writing {export_format}: {len(vertices)} vertices, {len(faces)} faces")
+        if export_format == "OBJ":
+            write_obj(file_path, vertices, faces, decimal_places=decimal_places)
+        else:
+            write_binary_ply(file_path, vertices, faces)
+        return len(faces)
+
+    binary = export_format == "Binary STL"
+    if binary and not streaming:
+        # All facets at once: vertex grid -> (n_tri, 3, 3) triangles -> one buffer write
+        report(0, f"Building STL mesh: {total_triangles} triangles")
+        triangles = grid_triangles(revolved_grid(profile_z, profile_r, cos_phi, sin_phi))
+        report(50, f"Writing binary STL: {total_triangles} triangles")
+        write_binary_stl(file_path, triangles)
+        return len(triangles)
+
+    # Bands of profile rows, each packed or formatted as one block and appended;
+    # without streaming the ASCII text still goes in bands of the default size, keeping memory bounded
+    def band_done(written, total):
+        percent = written / total * 100 if total > 0 else 100.0
+        report(percent, f"Writing STL: {written}/{total} triangles ({percent:.1f}%)")
+
+    return write_stl_streaming(file_path, profile_z, profile_r, cos_phi, sin_phi, binary=binary,
+                               decimal_places=decimal_places,
+                               chunk_triangles=chunk_triangles if streaming else 65536,
+                               progress=band_done)
@@ -0,0 +1,171 @@
+# -*- coding:utf-8 -*-
+"""
+Adaptive sampling of the aperture phase space (position, sin α) around the acceptance cutoff
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import numpy as np
+
+from .tracing import FATE_RECEIVER, trace_rays_batch
+
+def _depth(cells, extent, resolution):
+    """Subdivision levels for cells of at most resolution over extent, starting from cells"""
+    return max(0, int(np.ceil(np.log2(extent / (cells * resolution))))) if resolution > 0 else 0
+
+def adaptive_phase_space(params, wall, angle_range_deg=None, resolution_deg=0.01, position_resolution=1 / 4096,
+                         initial_cells=(32, 32), etendue_error=None, max_bounces=50, max_rays=10**8):
+    """Transmitted étendue and acceptance cutoff from an adaptive quadtree over (r0, sin α).
+
+    The aperture diameter times the range of sin α (angles within ±angle_range_deg, by
+    default ±min(2θ, 89.9°)) starts as a grid of initial_cells (position, angle) cells whose
+    corner rays are traced with trace_rays_batch. Every cell whose corner fates disagree is split
+    in all pending cells at once, one level per round: only across the angle when both angle
+    edges agree (a boundary of constant angle), only across the position when both position
+    edges agree, both ways otherwise. Splitting stops at cells of resolution_deg (in angle at
+    the cutoff θ) by position_resolution (fraction of the aperture), when the error bound drops
+    below etendue_error or the next round would exceed max_rays. Corner rays are shared
+    between neighbouring cells and traced once.
+
+    A cell with agreeing corners counts as wholly transmitted or blocked; a mixed cell counts
+    with the fraction of its transmitted corners, and its area times the larger of that
+    fraction and its complement bounds its error. Features smaller than an initial cell that
+    no corner ray sees are not detected.
+
+    Returns a dict: 'etendue' (mm, meridional, n = 1 outside), 'etendue_error', 'receiver_etendue'
+    (2·d1, the largest étendue the receiver accepts), the traced 'rays', 'uniform_rays' of a
+    uniform grid at the same resolution, 'cells' and 'mixed_cells', the transmission curve
+    'angles_deg' / 'transmission' on the finest angle rows and the 50 % crossings 'cutoff_deg'
+    (negative, positive side; nan if there is none) with 'cutoff_error_deg'.
+    """
+    half_d2 = params['d2'] / 2
+    if angle_range_deg is None:
+        angle_range_deg = min(2 * params['theta_deg'], 89.9)
+    if not 0 < angle_range_deg < 90:
+        raise ValueError("The angle range must be between 0 and 90 degrees")
+    u_max = np.sin(np.radians(angle_range_deg))
+
+    # Integer lattice of the finest cells; a cell is (i, j, width, height) in lattice units
+    n_x, n_u = (max(1, int(cells)) for cells in initial_cells)
+    du_target = np.cos(params['theta']) * np.radians(resolution_deg)
+    depth_x = _depth(n_x, 1.0, position_resolution)
+    depth_u = _depth(n_u, 2 * u_max, du_target)
+    size_x, size_u = 2 ** depth_x, 2 ** depth_u
+    rows_x, rows_u = n_x * size_x, n_u * size_u
+    step_x, step_u = 2 * half_d2 / rows_x, 2 * u_max / rows_u
+
+    # Traced corners as a sorted key -> transmitted table
+    known_keys = np.empty(0, dtype=np.int64)
+    known_values = np.empty(0, dtype=bool)
+    traced = 0
+
+    def key(i, j):
+        return i.astype(np.int64) * (rows_u + 1) + j
+
+    def lookup(i, j):
+        nonlocal known_keys, known_values, traced
+        keys = key(i, j)
+        missing = np.setdiff1d(keys, known_keys)
+        if len(missing):
+            x = -half_d2 + missing // (rows_u + 1) * step_x
+            u = -u_max + missing % (rows_u + 1) * step_u
+            fate = trace_rays_batch(params, None, None, x, np.degrees(np.arcsin(u)), max_bounces, wall=wall)['fate']
+            traced += len(missing)
+            order = np.argsort(np.concatenate((known_keys, missing)), kind='stable')
+            known_keys = np.concatenate((known_keys, missing))[order]
+            known_values = np.concatenate((known_values, fate == FATE_RECEIVER))[order]
+        return known_values[np.searchsorted(known_keys, keys)]
+
+    def corners(i, j, w, h):
+        return np.stack((lookup(i, j), lookup(i + w, j), lookup(i, j + h), lookup(i + w, j + h)))
+
+    grid_i, grid_j = np.meshgrid(np.arange(n_x) * size_x, np.arange(n_u) * size_u, indexing='ij')
+    i, j = grid_i.ravel(), grid_j.ravel()
+    w, h = np.full(len(i), size_x), np.full(len(i), size_u)
+    values = corners(i, j, w, h)
+
+    leaves = []  # (i, j, w, h, value, mixed) of the finished cells
+    finished_error = 0.0
+
+    def finish(keep, value, mixed, error=0.0):
+        nonlocal finished_error
+        leaves.append((i[keep], j[keep], w[keep], h[keep], value, mixed))
+        finished_error += error
+
+    while len(i):
+        uniform = values.all(axis=0) | ~values.any(axis=0)
+        finish(uniform, values[0, uniform].astype(float), np.zeros(uniform.sum(), dtype=bool))
+        mixed = ~uniform
+        i, j, w, h, values = i[mixed], j[mixed], w[mixed], h[mixed], values[:, mixed]
+
+        # Boundaries of constant angle split only across the angle, of constant position only across the position
+        along_u = (values[0] == values[1]) & (values[2] == values[3])
+        along_x = (values[0] == values[2]) & (values[1] == values[3])
+        split_x = (w > 1) & ~(along_u & (h > 1))
+        split_u = (h > 1) & ~(along_x & (w > 1))
+        fraction = values.mean(axis=0)
+        bound = np.maximum(fraction, 1 - fraction) * w * h * step_x * step_u
+        final = ~split_x & ~split_u
+        if ((etendue_error is not None and finished_error + bound.sum() <= etendue_error)
+                or traced + 5 * np.count_nonzero(~final) > max_rays):
+            final[:] = True
+        finish(final, fraction[final], np.ones(final.sum(), dtype=bool), bound[final].sum())
+        split = ~final
+        i, j, w, h = i[split], j[split], w[split], h[split]
+        split_x, split_u = split_x[split], split_u[split]
+
+        # Children: 2 or 4 cells per split cell
+        w_child = np.where(split_x, w // 2, w)
+        h_child = np.where(split_u, h // 2, h)
+        children = [(i, j)]
+        children.append((i + w_child * split_x, j))
+        children.append((i, j + h_child * split_u))
+        children.append((i + w_child * split_x, j + h_child * split_u))
+        exists = [np.ones(len(i), dtype=bool), split_x, split_u, split_x & split_u]
+        i = np.concatenate([ci[e] for (ci, _), e in zip(children, exists)])
+        j = np.concatenate([cj[e] for (_, cj), e in zip(children, exists)])
+        w = np.concatenate([w_child[e] for e in exists])
+        h = np.concatenate([h_child[e] for e in exists])
+        values = corners(i, j, w, h) if len(i) else np.empty((4, 0), dtype=bool)
+
+    i, j, w, h, value, mixed = (np.concatenate(parts) for parts in zip(*leaves))
+    area = w * h * step_x * step_u
+    etendue = float((value * area).sum())
+    error = float((np.maximum(value, 1 - value) * area)[mixed].sum())
+
+    # Transmission of each finest angle row: the covered aperture fraction of every cell spanning it
+    change = np.zeros(rows_u + 1)
+    np.add.at(change, j, value * w / rows_x)
+    np.add.at(change, j + h, -value * w / rows_x)
+    transmission = np.cumsum(change[:-1])
+    u_rows = -u_max + (np.arange(rows_u) + 0.5) * step_u
+    angles = np.degrees(np.arcsin(u_rows))
+
+    # 50 % crossings outward from the transmitted core on both sides
+    cutoff = [np.nan, np.nan]
+    half = transmission >= 0.5
+    for side, rows in enumerate((np.flatnonzero(half & (u_rows < 0)), np.flatnonzero(half & (u_rows > 0)))):
+        if not len(rows):
+            continue
+        inner = rows[0] if side == 0 else rows[-1]
+        outer = inner - 1 if side == 0 else inner + 1
+        if 0 <= outer < rows_u:
+            t_in, t_out = transmission[inner], transmission[outer]
+            weight = (t_in - 0.5) / (t_in - t_out) if t_in != t_out else 0.5
+            cutoff[side] = float(np.degrees(np.arcsin(u_rows[inner] + weight * (u_rows[outer] - u_rows[inner]))))
+    cutoff_error = float(np.degrees(0.5 * step_u / np.cos(params['theta'])))
+
+    return {
+        'etendue': etendue,
+        'etendue_error': error,
+        'receiver_etendue': float(params['d1'] * 2),
+        'rays': traced,
+        'uniform_rays': (rows_x + 1) * (rows_u + 1),
+        'cells': len(i),
+        'mixed_cells': int(mixed.sum()),
+        'angles_deg': angles,
+        'transmission': transmission,
+        'cutoff_deg': tuple(cutoff),
+        'cutoff_error_deg': cutoff_error,
+    }
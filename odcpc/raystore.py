@@ -0,0 +1,166 @@
+# -*- coding:utf-8 -*-
+"""
+Out-of-core ray results: fixed-dtype records and capped paths in memory-mapped .npy files
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import json
+import os
+
+import numpy as np
+
+from .tracing import RAY_FATES, trace_rays_batch
+
+# One packed record per ray (21 bytes): start position and angle, fate code into RAY_FATES,
+# wall bounces, final point and the number of stored path vertices
+RAY_DTYPE = np.dtype([('r0', '<f4'), ('angle_deg', '<f4'), ('fate', 'i1'), ('bounces', '<u2'),
+                      ('hit_z', '<f4'), ('hit_r', '<f4'), ('path_points', '<u2')])
+# Path vertices: (z, r) per point
+PATH_DTYPE = np.dtype('<f4')
+
+class RayStore:
+    """Ray results of one run in a directory: rays.npy (RAY_DTYPE records), paths.npy (rays,
+    path_points, 2) when path history is kept and meta.json.
+
+    The arrays are memory-mapped, so a store of 10^7 rays is written chunk by chunk and reopened
+    lazily: only the pages that are read are loaded. Paths keep the first path_points vertices
+    (start point, wall hits, end point) of each ray; longer paths are cut off.
+    """
+
+    def __init__(self, directory, rays, paths, meta):
+        self.directory = directory
+        self.rays = rays
+        self.paths = paths
+        self.meta = meta
+
+    @classmethod
+    def create(cls, directory, n_rays, path_points=0, meta=None):
+        """New store for n_rays rays (existing files in the directory are overwritten)"""
+        os.makedirs(directory, exist_ok=True)
+        rays = np.lib.format.open_memmap(os.path.join(directory, "rays.npy"), mode='w+', dtype=RAY_DTYPE,
+                                         shape=(n_rays,))
+        paths = None
+        if path_points:
+            paths = np.lib.format.open_memmap(os.path.join(directory, "paths.npy"), mode='w+', dtype=PATH_DTYPE,
+                                              shape=(n_rays, path_points, 2))
+        elif os.path.exists(os.path.join(directory, "paths.npy")):
+            os.remove(os.path.join(directory, "paths.npy"))
+        meta = dict(meta or {}, rays=n_rays, path_points=path_points, fates=list(RAY_FATES), complete=0)
+        store = cls(directory, rays, paths, meta)
+        store.save_meta()
+        return store
+
+    @classmethod
+    def open(cls, directory, writable=False):
+        """Reopens a store lazily (read-only memory maps unless writable)"""
+        mode = 'r+' if writable else 'r'
+        rays = np.load(os.path.join(directory, "rays.npy"), mmap_mode=mode)
+        paths_file = os.path.join(directory, "paths.npy")
+        paths = np.load(paths_file, mmap_mode=mode) if os.path.exists(paths_file) else None
+        with open(os.path.join(directory, "meta.json"), encoding='utf-8') as f:
+            meta = json.load(f)
+        return cls(directory, rays, paths, meta)
+
+    def save_meta(self):
+        with open(os.path.join(self.directory, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, indent=2)
+
+    def __len__(self):
+        return len(self.rays)
+
+    @property
+    def path_points(self):
+        return 0 if self.paths is None else self.paths.shape[1]
+
+    def flush(self):
+        self.rays.flush()
+        if self.paths is not None:
+            self.paths.flush()
+        self.save_meta()
+
+    def iter_chunks(self, chunk=2**20):
+        """(start, records) blocks of at most chunk rays; records are views into the memory map"""
+        for start in range(0, len(self.rays), chunk):
+            yield start, self.rays[start:start + chunk]
+
+    def fate_counts(self, chunk=2**20):
+        """Rays per fate (index = fate code), counted block by block"""
+        counts = np.zeros(len(RAY_FATES), dtype=np.int64)
+        for _, records in self.iter_chunks(chunk):
+            counts += np.bincount(records['fate'], minlength=len(RAY_FATES))
+        return counts
+
+    def path(self, index):
+        """Stored path vertices (z, r) of one ray as a (points, 2) array"""
+        if self.paths is None:
+            raise ValueError("The store keeps no path history")
+        return np.array(self.paths[index, :self.rays['path_points'][index]], dtype=float)
+
+    def iter_segments(self, chunk=2**16):
+        """Straight path segments (z0, r0, z1, r1) of the stored paths, block by block, e.g. for
+        RayDensity.add_segments"""
+        if self.paths is None:
+            raise ValueError("The store keeps no path history")
+        for start in range(0, len(self.rays), chunk):
+            points = np.asarray(self.paths[start:start + chunk], dtype=float)
+            count = np.asarray(self.rays['path_points'][start:start + chunk], dtype=np.intp)
+            used = np.arange(points.shape[1] - 1) < (count - 1)[:, None]
+            z0, r0 = points[:, :-1, 0][used], points[:, :-1, 1][used]
+            z1, r1 = points[:, 1:, 0][used], points[:, 1:, 1][used]
+            yield z0, r0, z1, r1
+
+def trace_to_store(params, wall, directory, n_rays, sample, chunk=100000, path_points=0, max_bounces=50,
+                   segments=None, meta=None, progress=None):
+    """Traces n_rays meridional rays with trace_rays_batch into a new RayStore, chunk by chunk.
+
+    sample(start, count) returns the aperture positions and angles (°) of rays start..start+count,
+    so neither the inputs nor the results are ever held in memory as a whole. With path_points
+    the first path_points vertices of every ray are kept. segments(ray, z0, r0, z1, r1), if
+    given, also receives the traced segments with global ray indices. progress(done, total) is
+    called after each chunk.
+    """
+    store = RayStore.create(directory, n_rays, path_points,
+                            dict(meta or {}, theta_deg=float(params['theta_deg']), d1=float(params['d1']),
+                                 d2=float(params['d2']), L=float(params['L']), max_bounces=max_bounces))
+    for start in range(0, n_rays, chunk):
+        count = min(chunk, n_rays - start)
+        r0, angles = (np.broadcast_to(np.asarray(value, dtype=float), (count,)) for value in sample(start, count))
+
+        if path_points:
+            paths = np.zeros((count, path_points, 2), dtype=PATH_DTYPE)
+            paths[:, 0, 0] = params['L']
+            paths[:, 0, 1] = r0
+            points = np.ones(count, dtype=np.int64)
+
+        def record(ray, z0, r0_seg, z1, r1):
+            if path_points:
+                slot = points[ray]
+                kept = slot < path_points
+                paths[ray[kept], slot[kept], 0] = z1[kept]
+                paths[ray[kept], slot[kept], 1] = r1[kept]
+                points[ray] += 1
+            if segments is not None:
+                segments(ray + start, z0, r0_seg, z1, r1)
+
+        traced = path_points or segments is not None
+        result = trace_rays_batch(params, None, None, r0, angles, max_bounces=max_bounces, wall=wall,
+                                  segments=record if traced else None)
+
+        records = np.zeros(count, dtype=RAY_DTYPE)
+        records['r0'] = r0
+        records['angle_deg'] = angles
+        records['fate'] = result['fate']
+        records['bounces'] = result['bounces']
+        records['hit_z'] = result['hit_z']
+        records['hit_r'] = result['hit_r']
+        if path_points:
+            records['path_points'] = np.minimum(points, path_points)
+            store.paths[start:start + count] = paths
+        store.rays[start:start + count] = records
+        store.meta['complete'] = start + count
+        store.flush()
+        if progress:
+            progress(start + count, n_rays)
+    return store
@@ -0,0 +1,284 @@
+# -*- coding:utf-8 -*-
+"""
+3D skew-ray tracing on the wall revolved from the profile (smooth or polygonal cross-section)
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import numpy as np
+
+from .tracing import FATE_RECEIVER, FATE_ESCAPE_APERTURE, FATE_NO_INTERSECTION, FATE_MAX_BOUNCES
+
+class RevolvedWall:
+    """Wall of the 3D concentrator built from the profile polyline r(z).
+
+    With radial_segments=None the cross-section is a circle of radius r(z) (every profile
+    segment revolves into a cone frustum). With radial_segments=N it is the regular N-gon of
+    the mesh exporter: corners at azimuths 2πj/N on radius r(z), flat faces in between
+    (N = 4 — square CPC).
+
+    The radial distance R(x, y) (hypot, or the polygon gauge max_j(x·cos c_j + y·sin c_j)/cos(π/N))
+    is convex along a ray and the profile of a CPC is concave, so along a ray from inside
+    g(t) = R - r(z) changes sign once. nearest() brackets that crossing between the profile
+    points the ray passes with a vectorized binary search and solves exactly in the bracketing
+    segment: a quadratic for the cone, linear equations for the flat faces.
+    """
+
+    def __init__(self, profile_z, profile_r, radial_segments=None):
+        self.profile_z = np.ascontiguousarray(profile_z, dtype=np.float64)
+        self.profile_r = np.ascontiguousarray(profile_r, dtype=np.float64)
+        self.radial_segments = radial_segments
+        self.aperture_outline = None  # the aperture is the disk or N-gon of aperture_radius
+
+        # Closing planes of the wall (see trace_skew_rays)
+        self.z_receiver = self.profile_z[0]
+        self.L = self.profile_z[-1]
+        self.receiver_radius = self.profile_r[0]
+        self.aperture_radius = self.profile_r[-1]
+
+        # r(z) = a + b·z on each profile segment
+        self.seg_b = np.diff(self.profile_r) / np.diff(self.profile_z)
+        self.seg_a = self.profile_r[:-1] - self.seg_b * self.profile_z[:-1]
+
+        if radial_segments is not None:
+            if radial_segments < 3:
+                raise ValueError("A polygonal wall needs at least 3 radial segments")
+            centers = 2 * np.pi * (np.arange(radial_segments) + 0.5) / radial_segments
+            self.face_cos = np.cos(centers)
+            self.face_sin = np.sin(centers)
+            self.apothem = np.cos(np.pi / radial_segments)  # face distance per unit corner radius
+
+    def radius(self, x, y):
+        """Radial distance measured in corner radii of the cross-section"""
+        if self.radial_segments is None:
+            return np.hypot(x, y)
+        return (np.multiply.outer(x, self.face_cos) + np.multiply.outer(y, self.face_sin)).max(axis=-1) / self.apothem
+
+    def nearest(self, p, d):
+        """First wall hit of rays starting inside: (t, segment, face); t = inf when the ray leaves
+        through the receiver or aperture plane first. face is -1 for the smooth wall."""
+        z_points = self.profile_z
+        n_rays = len(p)
+        t_hit = np.full(n_rays, np.inf)
+        seg = np.zeros(n_rays, dtype=np.int64)
+        face = np.full(n_rays, -1, dtype=np.int64)
+
+        pz, dz = p[:, 2], d[:, 2]
+        down = dz < -1e-15
+        up = dz > 1e-15
+
+        # Profile points crossed in traversal order: k = first + step·m, m = 0 .. count-1
+        first = np.where(down, np.searchsorted(z_points, pz, side='left') - 1,
+                         np.searchsorted(z_points, pz, side='right'))
+        step = np.where(down, -1, 1)
+        count = np.where(down, first + 1, np.where(up, len(z_points) - first, 0))
+
+        def crosses(rays, m):
+            """Whether the ray is already outside the wall when it reaches crossing m"""
+            k = first[rays] + step[rays] * m
+            t = (z_points[k] - pz[rays]) / dz[rays]
+            point = p[rays] + t[:, None] * d[rays]
+            return self.radius(point[:, 0], point[:, 1]) >= self.profile_r[k], t
+
+        # Rays whose last crossing is still inside reach the receiver or aperture plane
+        t_a = np.zeros(n_rays)
+        t_b = np.full(n_rays, np.inf)
+        rays = np.flatnonzero(count > 0)
+        outside, t_last = crosses(rays, count[rays] - 1)
+        rays = rays[outside]
+
+        # Binary search for the first crossing that is outside: lo is inside, hi outside
+        lo = np.full(len(rays), -1)
+        hi = count[rays] - 1
+        while True:
+            active = hi - lo > 1
+            if not active.any():
+                break
+            mid = (lo + hi) // 2
+            result, _ = crosses(rays[active], mid[active])
+            hi[active] = np.where(result, mid[active], hi[active])
+            lo[active] = np.where(result, lo[active], mid[active])
+
+        _, t_b_rays = crosses(rays, hi)
+        t_b[rays] = t_b_rays
+        has_lo = lo >= 0
+        _, t_lo = crosses(rays[has_lo], lo[has_lo])
+        t_a[rays[has_lo]] = t_lo
+        k_hi = first[rays] + step[rays] * hi
+        seg[rays] = np.where(step[rays] < 0, k_hi, k_hi - 1)
+
+        # Horizontal rays stay in the segment of their start point
+        flat = np.flatnonzero(~down & ~up)
+        seg[flat] = np.clip(np.searchsorted(z_points, pz[flat], side='right') - 1, 0, len(z_points) - 2)
+        rays = np.concatenate((rays, flat))
+
+        # Exact crossing in the bracketing segment
+        if len(rays):
+            t_hit[rays], face[rays] = self.solve_segment(p[rays], d[rays], seg[rays], t_a[rays], t_b[rays])
+        return t_hit, seg, face
+
+    def solve_segment(self, p, d, seg, t_a, t_b):
+        """Crossing of each ray with the wall of its profile segment within [t_a, t_b]"""
+        # r(z(t)) = w0 + w1·t along the ray
+        w0 = self.seg_a[seg] + self.seg_b[seg] * p[:, 2]
+        w1 = self.seg_b[seg] * d[:, 2]
+
+        if self.radial_segments is not None:
+            # Face j: (x·c_j + y·s_j) = apothem·r(z); the first face crossed upwards is hit
+            position = np.multiply.outer(p[:, 0], self.face_cos) + np.multiply.outer(p[:, 1], self.face_sin)
+            rate = (np.multiply.outer(d[:, 0], self.face_cos) + np.multiply.outer(d[:, 1], self.face_sin)
+                    - self.apothem * w1[:, None])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = np.where(rate > 0, (self.apothem * w0[:, None] - position) / rate, np.inf)
+            face = t.argmin(axis=1)
+            t_hit = t[np.arange(len(t)), face]
+            return np.where(np.isfinite(t_hit), t_hit, np.inf), face
+
+        # Cone: (px + t·dx)² + (py + t·dy)² = (w0 + w1·t)²
+        A = d[:, 0] ** 2 + d[:, 1] ** 2 - w1 ** 2
+        B = 2 * (p[:, 0] * d[:, 0] + p[:, 1] * d[:, 1] - w0 * w1)
+        C = p[:, 0] ** 2 + p[:, 1] ** 2 - w0 ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            root = np.sqrt(np.maximum(B * B - 4 * A * C, 0.0))
+            q = -0.5 * (B + np.copysign(root, B))
+            roots = np.stack((q / A, C / q), axis=1)
+
+        # The crossing is the root inside the bracket on the upper nappe (r > 0)
+        tol = 1e-9 * (1.0 + np.abs(t_a))
+        valid = ((roots >= (t_a - tol)[:, None]) & (roots <= (t_b + tol)[:, None])
+                 & (w0[:, None] + w1[:, None] * roots >= 0) & np.isfinite(roots))
+        t_hit = np.where(valid, roots, np.inf).min(axis=1)
+
+        # Rounding at a bracket end: fall back to the secant of the radial gap
+        missing = ~np.isfinite(t_hit) & np.isfinite(t_b)
+        if missing.any():
+            ends = np.stack((t_a[missing], t_b[missing]), axis=1)
+            points = p[missing][:, None, :] + ends[:, :, None] * d[missing][:, None, :]
+            gap = np.hypot(points[..., 0], points[..., 1]) - (w0[missing, None] + w1[missing, None] * ends)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fraction = np.clip(-gap[:, 0] / (gap[:, 1] - gap[:, 0]), 0, 1)
+            t_hit[missing] = ends[:, 0] + fraction * (ends[:, 1] - ends[:, 0])
+        return t_hit, np.full(len(t_hit), -1, dtype=np.int64)
+
+    def normals(self, points, seg, face):
+        """Unit outward normals at wall points"""
+        b = self.seg_b[seg]
+        if self.radial_segments is None:
+            rho = np.hypot(points[:, 0], points[:, 1]) + 1e-300
+            normal = np.stack((points[:, 0] / rho, points[:, 1] / rho, -b), axis=1)
+        else:
+            normal = np.stack((self.face_cos[face], self.face_sin[face], -self.apothem * b), axis=1)
+        return normal / np.linalg.norm(normal, axis=1, keepdims=True)
+
+def trace_skew_rays(wall, origins, directions, max_bounces=50):
+    """Traces 3D rays inside a wall, one bounce per iteration.
+
+    The wall is a RevolvedWall or a MeshBVH: nearest(p, d) returns (t, *hit) with t = inf for a
+    miss and normals(points, *hit) the wall normals; z_receiver, L and receiver_radius close it.
+    origins (n, 3) lie inside the concentrator (usually on the aperture plane z = L) and
+    directions (n, 3) are normalized here. Fates and bounce counting follow trace_rays_batch:
+    receiver when the receiver plane is crossed within receiver_radius of the axis, escape
+    through the aperture plane, no_intersection for rays leaving any other way, max_bounces.
+    Returns a dict of arrays: 'fate', 'bounces', the final point 'hit' (n, 3) and 'hit_z', 'hit_r'.
+    """
+    p = np.array(origins, dtype=float).reshape(-1, 3)
+    d = np.array(directions, dtype=float).reshape(-1, 3)
+    d /= np.linalg.norm(d, axis=1, keepdims=True)
+    n_rays = len(p)
+
+    fate = np.full(n_rays, FATE_MAX_BOUNCES, dtype=np.int8)
+    bounces = np.zeros(n_rays, dtype=np.int32)
+    hit = p.copy()
+
+    live = np.arange(n_rays)
+    while live.size:
+        t, *where = wall.nearest(p[live], d[live])
+
+        # Crossing the receiver or the aperture plane before any wall hit
+        dz = d[live, 2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_plane = np.where(dz < 0, (wall.z_receiver - p[live, 2]) / dz,
+                               np.where(dz > 0, (wall.L - p[live, 2]) / dz, np.inf))
+        leaving = (t_plane <= t) | ~np.isfinite(t)
+        done = live[leaving]
+        t_plane = t_plane[leaving]
+        crossed = np.isfinite(t_plane)
+        hit[done] = p[done] + np.where(crossed, t_plane, 0)[:, None] * d[done]
+        on_receiver = np.hypot(hit[done, 0], hit[done, 1]) <= wall.receiver_radius + 1e-9
+        fate[done] = np.where(crossed & (dz[leaving] < 0) & on_receiver, FATE_RECEIVER,
+                              np.where(crossed & (dz[leaving] > 0), FATE_ESCAPE_APERTURE, FATE_NO_INTERSECTION))
+
+        # Specular reflection on the wall
+        reflect = ~leaving
+        live = live[reflect]
+        points = p[live] + t[reflect][:, None] * d[live]
+        normal = wall.normals(points, *(item[reflect] for item in where))
+        v = d[live] - 2 * np.einsum('ij,ij->i', d[live], normal)[:, None] * normal
+        v /= np.linalg.norm(v, axis=1, keepdims=True)
+
+        bounces[live] += 1
+        hit[live] = points
+        p[live] = points + v * 1e-6  # a slight shift to avoid self-intersection
+        d[live] = v
+
+        # Rays that exhausted the bounce budget keep the last wall point
+        live = live[bounces[live] <= max_bounces]
+
+    return {'fate': fate, 'bounces': bounces, 'hit': hit,
+            'hit_z': hit[:, 2], 'hit_r': np.hypot(hit[:, 0], hit[:, 1])}
+
+def sample_aperture_points(wall, n_rays, rng=None):
+    """Points uniformly distributed over the aperture cross-section (disk, regular polygon or the
+    rim outline of an imported mesh) at z = L"""
+    rng = np.random.default_rng(rng)
+    radius = wall.aperture_radius
+    if wall.aperture_outline is not None:
+        # Triangle fan of the rim polygon around the axis, sectors picked in proportion to their area
+        corner0 = wall.aperture_outline
+        corner1 = np.roll(corner0, -1, axis=0)
+        area = np.abs(corner0[:, 0] * corner1[:, 1] - corner0[:, 1] * corner1[:, 0])
+        sector = np.searchsorted(np.cumsum(area), rng.random(n_rays) * area.sum(), side='right')
+        sector = np.minimum(sector, len(area) - 1)
+        u, v = rng.random(n_rays), rng.random(n_rays)
+        swap = u + v > 1
+        u[swap], v[swap] = 1 - u[swap], 1 - v[swap]
+        x = u * corner0[sector, 0] + v * corner1[sector, 0]
+        y = u * corner0[sector, 1] + v * corner1[sector, 1]
+    elif wall.radial_segments is None:
+        rho = radius * np.sqrt(rng.random(n_rays))
+        phi = rng.uniform(0, 2 * np.pi, n_rays)
+        x, y = rho * np.cos(phi), rho * np.sin(phi)
+    else:
+        # Triangle fan of equal sectors: centre, corner j, corner j + 1
+        sector = rng.integers(0, wall.radial_segments, n_rays)
+        phi0 = 2 * np.pi * sector / wall.radial_segments
+        phi1 = 2 * np.pi * (sector + 1) / wall.radial_segments
+        u, v = rng.random(n_rays), rng.random(n_rays)
+        swap = u + v > 1
+        u[swap], v[swap] = 1 - u[swap], 1 - v[swap]
+        x = radius * (u * np.cos(phi0) + v * np.cos(phi1))
+        y = radius * (u * np.sin(phi0) + v * np.sin(phi1))
+    return np.column_stack((x, y, np.full(n_rays, wall.L)))
+
+def collimated_directions(angle_deg, n_rays, azimuth_deg=0.0):
+    """Directions of a collimated beam tilted by angle_deg from the axis in the plane at azimuth_deg"""
+    alpha = np.radians(angle_deg)
+    psi = np.radians(azimuth_deg)
+    direction = np.array([np.sin(alpha) * np.cos(psi), np.sin(alpha) * np.sin(psi), -np.cos(alpha)])
+    return np.broadcast_to(direction, (n_rays, 3))
+
+def skew_transmission_for_angles(wall, angles_deg, n_rays, azimuth_deg=0.0, max_bounces=50, rng=None,
+                                 progress=None):
+    """Receiver fraction per incidence angle for collimated beams filling the whole aperture;
+    progress(done, total) is called after each angle"""
+    rng = np.random.default_rng(rng)
+    transmission = np.zeros(len(angles_deg))
+    for i, angle in enumerate(angles_deg):
+        if abs(angle) < 90:
+            origins = sample_aperture_points(wall, n_rays, rng)
+            result = trace_skew_rays(wall, origins, collimated_directions(angle, n_rays, azimuth_deg), max_bounces)
+            transmission[i] = (result['fate'] == FATE_RECEIVER).mean()
+        if progress:
+            progress(i + 1, len(angles_deg))
+    return transmission
@@ -0,0 +1,255 @@
+# -*- coding:utf-8 -*-
+"""
+Annual energy yield: hourly sun positions projected on the CPC and a traced transmission table
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from .cache import default_cache_dir
+from .skew import RevolvedWall, skew_transmission_for_angles
+from .tracing import make_wall
+from .transmission import transmission_for_angles
+
+# Concentrator kinds of a transmission table
+TABLE_KINDS = ("trough", "revolved")
+
+# Bumped whenever the traced table changes for the same inputs
+TABLE_VERSION = 1
+
+HOURS_PER_YEAR = 8760
+DAYS_PER_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+def sun_positions(latitude_deg):
+    """Sun at the middle of every hour of a 365-day year in local solar time.
+
+    Cooper's declination; returns a dict of hourly arrays: 'day' (1..365), 'hour' (0..23),
+    'declination' (°), 'elevation' (°), 'azimuth' (° from north, clockwise) and the unit
+    'vector' (hours, 3) towards the sun in (east, north, up) coordinates.
+    """
+    day = np.repeat(np.arange(1, 366), 24)
+    hour = np.tile(np.arange(24), 365)
+    phi = np.radians(latitude_deg)
+    delta = np.radians(23.45) * np.sin(2 * np.pi * (284 + day) / 365)
+    omega = np.radians(15.0 * (hour + 0.5 - 12))
+
+    vector = np.column_stack((-np.cos(delta) * np.sin(omega),
+                              np.sin(delta) * np.cos(phi) - np.cos(delta) * np.sin(phi) * np.cos(omega),
+                              np.sin(phi) * np.sin(delta) + np.cos(phi) * np.cos(delta) * np.cos(omega)))
+    return {
+        'day': day,
+        'hour': hour,
+        'declination': np.degrees(delta),
+        'elevation': np.degrees(np.arcsin(np.clip(vector[:, 2], -1, 1))),
+        'azimuth': np.degrees(np.arctan2(vector[:, 0], vector[:, 1])) % 360,
+        'vector': vector,
+    }
+
+def clear_sky_dni(elevation_deg):
+    """Direct normal irradiance (W/m²) of the Meinel clear-sky model with the Kasten–Young air mass"""
+    zenith = 90.0 - np.asarray(elevation_deg, dtype=float)
+    up = zenith < 90
+    with np.errstate(invalid='ignore', divide='ignore'):
+        air_mass = 1.0 / (np.cos(np.radians(zenith)) + 0.50572 * (96.07995 - zenith) ** -1.6364)
+        return np.where(up, 1353.0 * 0.7 ** (air_mass ** 0.678), 0.0)
+
+def seasonal_tilts(latitude_deg, declination_deg, day, adjustments):
+    """Hourly signed tilt of a collector re-tilted adjustments times a year: equal periods of
+    days, one centred on the June solstice (two periods switch at the equinoxes), each tilted at
+    the latitude minus its mean declination. Positive tilts face the equator; negative ones face
+    the pole, as between the tropics when the noon sun passes on the polar side."""
+    offset = 172 - 365 / (2 * adjustments)
+    period = ((np.asarray(day) - offset) % 365 * adjustments // 365).astype(np.intp)
+    mean = np.bincount(period, weights=declination_deg) / np.bincount(period)
+    towards_equator = 1.0 if latitude_deg >= 0 else -1.0
+    return towards_equator * (latitude_deg - mean[period])
+
+def collector_frame(tilt_deg, surface_azimuth_deg):
+    """Unit vectors (east, north, up) of the collector: the up-slope direction (meridional plane of
+    a trough), the horizontal trough axis and the aperture normal; arrays of shape (..., 3)"""
+    beta = np.radians(np.asarray(tilt_deg, dtype=float))[..., None]
+    gamma = np.radians(np.asarray(surface_azimuth_deg, dtype=float))[..., None]
+    facing = np.concatenate((np.sin(gamma), np.cos(gamma), np.zeros_like(gamma)), axis=-1)
+    up = np.array([0.0, 0.0, 1.0])
+    normal = np.cos(beta) * up + np.sin(beta) * facing
+    slope = np.cos(beta) * facing - np.sin(beta) * up
+    axis = np.concatenate((-np.cos(gamma), np.sin(gamma), np.zeros_like(gamma)), axis=-1)
+    return np.broadcast_arrays(slope, axis, normal)
+
+class TransmissionTable:
+    """Transmission of a CPC against the incidence direction, traced once and interpolated.
+
+    A 'trough' table holds the meridional curve over the projected angle 0..90°, symmetric about
+    the axis (an infinitely long trough only sees the projection of the sun onto its
+    cross-section). A 'revolved' table
+    holds the 3D skew-ray transmission over the off-axis angle 0..90° and the azimuth of the ray
+    within the symmetry sector 0..180°/N of an N-gon wall (one azimuth for a smooth revolution).
+    """
+
+    def __init__(self, kind, angles_deg, azimuths_deg, values, concentration, radial_segments=None):
+        if kind not in TABLE_KINDS:
+            raise ValueError(f"Unknown table kind: {kind}")
+        self.kind = kind
+        self.angles_deg = np.asarray(angles_deg, dtype=float)
+        self.azimuths_deg = np.asarray(azimuths_deg, dtype=float)
+        self.values = np.asarray(values, dtype=float).reshape(len(self.angles_deg), len(self.azimuths_deg))
+        self.concentration = float(concentration)
+        self.radial_segments = radial_segments
+
+    @classmethod
+    def trace(cls, params, profile_z, profile_r, kind="trough", n_angles=181, n_rays=2000, radial_segments=None,
+              azimuth_samples=7, engine="polyline", seed=0, progress=None):
+        """Traces the table: n_angles // 2 + 1 angles over 0..90° (the same steps as n_angles over
+        ±90°), times azimuth_samples azimuths for a revolved N-gon, with n_rays rays each.
+        progress(done, total) is called after each traced column of angles."""
+        ratio = params['d2'] / params['d1']
+        angles = np.linspace(0, 90, n_angles // 2 + 1)
+        if kind == "trough":
+            wall = make_wall(engine, params, profile_z, profile_r)
+            values = transmission_for_angles(params, wall, angles, n_rays)[:, None]
+            if progress:
+                progress(1, 1)
+            return cls(kind, angles, [0.0], values, ratio)
+        if kind != "revolved":
+            raise ValueError(f"Unknown table kind: {kind}")
+
+        azimuths = np.linspace(0, 180 / radial_segments, azimuth_samples) if radial_segments else np.zeros(1)
+        wall = RevolvedWall(profile_z, profile_r, radial_segments)
+        rng = np.random.default_rng(seed)
+        values = np.empty((len(angles), len(azimuths)))
+        for k, azimuth in enumerate(azimuths):
+            values[:, k] = skew_transmission_for_angles(wall, angles, n_rays, azimuth, rng=rng)
+            if progress:
+                progress(k + 1, len(azimuths))
+        return cls(kind, angles, azimuths, values, ratio ** 2, radial_segments)
+
+    @classmethod
+    def cached(cls, params, profile_z, profile_r, kind="trough", n_angles=181, n_rays=2000, radial_segments=None,
+               azimuth_samples=7, engine="polyline", seed=0, cache_dir=None, progress=None):
+        """The table from cache_dir (default_cache_dir() by default), traced and stored on a miss.
+        The file name hashes the profile and every tracing option."""
+        radial_segments = radial_segments or None
+        options = [TABLE_VERSION, kind, n_angles, n_rays, radial_segments, azimuth_samples if radial_segments else 1,
+                   engine if kind == "trough" else None, seed, float(params['d1']), float(params['d2'])]
+        digest = hashlib.sha1(json.dumps(options).encode())
+        digest.update(np.ascontiguousarray(profile_z, dtype=np.float64).tobytes())
+        digest.update(np.ascontiguousarray(profile_r, dtype=np.float64).tobytes())
+        cache_dir = cache_dir or default_cache_dir()
+        file_path = os.path.join(cache_dir, f"transmission-{digest.hexdigest()[:20]}.npz")
+        if os.path.exists(file_path):
+            return cls.load(file_path)
+
+        table = cls.trace(params, profile_z, profile_r, kind, n_angles, n_rays, radial_segments, azimuth_samples,
+                          engine, seed, progress)
+        os.makedirs(cache_dir, exist_ok=True)
+        table.save(file_path)
+        return table
+
+    def save(self, file_path):
+        # Written under a temporary name and renamed, so a concurrent reader never sees half a file
+        temporary = f"{file_path}.{os.getpid()}.tmp.npz"
+        np.savez(temporary, kind=self.kind, angles_deg=self.angles_deg, azimuths_deg=self.azimuths_deg,
+                 values=self.values, concentration=self.concentration, radial_segments=self.radial_segments or 0)
+        os.replace(temporary, file_path)
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as data:
+            return cls(str(data['kind']), data['angles_deg'], data['azimuths_deg'], data['values'],
+                       float(data['concentration']), int(data['radial_segments']) or None)
+
+    def lookup(self, slope, axis, normal):
+        """Transmission for sun directions given by their components along the collector frame
+        (collector_frame); zero for the sun behind the aperture plane"""
+        front = normal > 0
+        if self.kind == "trough":
+            angle = np.abs(np.degrees(np.arctan2(slope, normal)))
+            values = np.interp(angle, self.angles_deg, self.values[:, 0])
+        else:
+            angle = np.degrees(np.arccos(np.clip(normal, -1, 1)))
+            position = np.interp(angle, self.angles_deg, np.arange(len(self.angles_deg)))
+            if len(self.azimuths_deg) > 1:
+                # The rays travel against the sun; fold their azimuth into the symmetry sector of the N-gon
+                sector = 360.0 / self.radial_segments
+                azimuth = np.degrees(np.arctan2(-axis, -slope)) % sector
+                azimuth = np.minimum(azimuth, sector - azimuth)
+                column = np.interp(azimuth, self.azimuths_deg, np.arange(len(self.azimuths_deg)))
+            else:
+                column = np.zeros(np.shape(angle))
+            values = self._bilinear(position, column)
+        return np.where(front, values, 0.0)
+
+    def _bilinear(self, row, column):
+        rows, columns = self.values.shape
+        i = np.clip(np.floor(row).astype(np.intp), 0, max(0, rows - 2))
+        k = np.clip(np.floor(column).astype(np.intp), 0, max(0, columns - 2))
+        u = np.clip(row - i, 0, 1)
+        v = np.clip(column - k, 0, 1)
+        i1 = np.minimum(i + 1, rows - 1)
+        k1 = np.minimum(k + 1, columns - 1)
+        return ((1 - u) * (1 - v) * self.values[i, k] + u * (1 - v) * self.values[i1, k]
+                + (1 - u) * v * self.values[i, k1] + u * v * self.values[i1, k1])
+
+def annual_yield(table, latitude_deg, tilt_deg=None, surface_azimuth_deg=None, adjustments=0, dni=None):
+    """Energy a fixed or seasonally re-tilted CPC collects over a year, integrated over all hours.
+
+    The collector faces the equator by default (surface azimuth 180° north of the equator,
+    0° south of it) at a tilt equal to the latitude; adjustments > 0 re-tilts it that many
+    times a year (seasonal_tilts) instead, turning it round to face the opposite way in the
+    periods whose tilt is negative. dni is an hourly direct normal irradiance series
+    (8760 values, W/m²), clear_sky_dni by default; diffuse light is not counted.
+
+    Returns a dict of hourly arrays ('elevation', 'tilt', 'surface_azimuth', 'cos_incidence', 'transmission',
+    'aperture_irradiance', 'collected') and the totals per aperture area: 'available_kwh_m2'
+    (beam on the aperture plane), 'collected_kwh_m2', 'capture_fraction', 'receiver_kwh_m2'
+    (per receiver area), 'operating_hours' and 'monthly_kwh_m2'.
+    """
+    sun = sun_positions(latitude_deg)
+    if surface_azimuth_deg is None:
+        surface_azimuth_deg = 180.0 if latitude_deg >= 0 else 0.0
+    surface_azimuth = np.full(HOURS_PER_YEAR, float(surface_azimuth_deg))
+    if adjustments:
+        tilt = seasonal_tilts(latitude_deg, sun['declination'], sun['day'], int(adjustments))
+        surface_azimuth = np.where(tilt < 0, (surface_azimuth + 180.0) % 360, surface_azimuth)
+        tilt = np.abs(tilt)
+    else:
+        tilt = np.full(HOURS_PER_YEAR, abs(latitude_deg) if tilt_deg is None else float(tilt_deg))
+    if dni is None:
+        dni = clear_sky_dni(sun['elevation'])
+    else:
+        dni = np.asarray(dni, dtype=float).ravel()
+        if len(dni) != HOURS_PER_YEAR:
+            raise ValueError(f"The DNI series needs {HOURS_PER_YEAR} hourly values, got {len(dni)}")
+
+    slope, axis, normal = collector_frame(tilt, surface_azimuth)
+    vector = sun['vector']
+    components = [np.einsum('ij,ij->i', vector, direction) for direction in (slope, axis, normal)]
+    up = sun['elevation'] > 0
+    transmission = np.where(up, table.lookup(*components), 0.0)
+    aperture = np.where(up, dni * np.maximum(components[2], 0.0), 0.0)
+    collected = aperture * transmission
+
+    month = np.searchsorted(np.cumsum(DAYS_PER_MONTH), sun['day'] - 1, side='right')
+    available = aperture.sum() / 1000
+    total = collected.sum() / 1000
+    return {
+        'elevation': sun['elevation'],
+        'tilt': tilt,
+        'surface_azimuth': surface_azimuth,
+        'cos_incidence': components[2],
+        'transmission': transmission,
+        'aperture_irradiance': aperture,
+        'collected': collected,
+        'available_kwh_m2': float(available),
+        'collected_kwh_m2': float(total),
+        'capture_fraction': float(total / available) if available > 0 else 0.0,
+        'receiver_kwh_m2': float(total * table.concentration),
+        'operating_hours': int(np.count_nonzero(collected > 0)),
+        'monthly_kwh_m2': np.bincount(month, weights=collected, minlength=12) / 1000,
+    }
@@ -0,0 +1,116 @@
+# -*- coding:utf-8 -*-
+"""
+Design-space sweep over θ, receiver diameter, refractive index and step count
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import multiprocessing
+import os
+
+import numpy as np
+
+from .geometry import calculate_cpc_parameters, calculate_profile_points, calculate_profile_radius
+from .tracing import make_wall
+from .transmission import transmission_for_angles
+
+# Columns of a sweep table, in output order
+SWEEP_COLUMNS = ("theta_deg", "d1", "n", "steps", "d2", "L", "focus", "C_max", "wall_area")
+
+def sweep_grid(theta_deg, d1, n, steps):
+    """Flattened Cartesian grid of the swept values (θ varies slowest, steps fastest)"""
+    grids = np.meshgrid(np.atleast_1d(np.asarray(theta_deg, dtype=float)),
+                        np.atleast_1d(np.asarray(d1, dtype=float)),
+                        np.atleast_1d(np.asarray(n, dtype=float)),
+                        np.atleast_1d(np.asarray(steps, dtype=np.int64)), indexing='ij')
+    return tuple(grid.ravel() for grid in grids)
+
+def calculate_wall_area(params, steps, max_elements=2**22):
+    """Area of the wall revolved from a uniform profile of `steps` chords, for arrays of designs.
+
+    Each chord sweeps a conical frustum of area π·(r_i + r_(i+1))·chord. Designs are processed
+    in row blocks of at most max_elements profile points.
+    """
+    L = np.atleast_1d(params['L'])
+    area = np.empty(len(L))
+    fractions = np.linspace(0, 1, steps + 1)
+    rows = max(1, max_elements // (steps + 1))
+    for start in range(0, len(L), rows):
+        block = slice(start, start + rows)
+        block_params = {key: np.atleast_1d(value)[block, None] for key, value in params.items()}
+        z_values = block_params['L'] * fractions
+        r_values = calculate_profile_radius(block_params, z_values)
+        chord = np.hypot(np.diff(z_values, axis=1), np.diff(r_values, axis=1))
+        area[block] = np.pi * ((r_values[:, :-1] + r_values[:, 1:]) * chord).sum(axis=1)
+    return area
+
+def _sweep_transmission_worker(designs, angles, n_positions, engine):
+    """Mean receiver fraction inside ±θ for each design (row: θ, d1, n, steps) of one task"""
+    transmission = np.empty(len(designs))
+    for i, (theta_deg, d1, n, steps) in enumerate(designs):
+        params = calculate_cpc_parameters(theta_deg, d1, n)
+        profile_z, profile_r = calculate_profile_points(params, int(steps))
+        wall = make_wall(engine, params, profile_z, profile_r)
+        transmission[i] = transmission_for_angles(params, wall, theta_deg * angles, n_positions).mean()
+    return transmission
+
+def design_sweep(theta_deg, d1, n, steps, transmission_angles=0, transmission_rays=1000,
+                 engine="polyline", processes=None, progress=None):
+    """Evaluates every combination of the swept values and returns the table as a dict of columns.
+
+    The closed-form quantities and the wall area are computed in vectorized form for the whole
+    grid. With transmission_angles > 0 every design is also ray traced at that many angles
+    spread over ±θ (transmission_rays rays each) across a process pool, adding a
+    'transmission' column. progress(done, total) is called after each finished task.
+    """
+    theta_deg, d1, n, steps = sweep_grid(theta_deg, d1, n, steps)
+    if len(theta_deg) and not ((theta_deg > 0) & (theta_deg < 90)).all():
+        raise ValueError("Angle θ must be between 0 and 90 degrees")
+    if not (d1 > 0).all():
+        raise ValueError("Receiver diameter d1 must be positive")
+    if not (n >= 1).all():
+        raise ValueError("Refractive index n must be at least 1")
+    if (steps < 1).any():
+        raise ValueError("Number of steps must be at least 1")
+
+    params = calculate_cpc_parameters(theta_deg, d1, n)
+    table = {'theta_deg': theta_deg, 'd1': d1, 'n': n, 'steps': steps}
+    for key in ("d2", "L", "focus", "C_max"):
+        table[key] = np.broadcast_to(params[key], theta_deg.shape).astype(float)
+
+    table['wall_area'] = np.empty(len(theta_deg))
+    for value in np.unique(steps):
+        same = steps == value
+        table['wall_area'][same] = calculate_wall_area(
+            {key: np.broadcast_to(item, theta_deg.shape)[same] for key, item in params.items()}, int(value))
+
+    if transmission_angles and len(theta_deg):
+        angles = np.linspace(-1, 1, transmission_angles) if transmission_angles > 1 else np.zeros(1)
+        designs = np.column_stack((theta_deg, d1, n, steps))
+        processes = processes or os.cpu_count() or 1
+        tasks = np.array_split(np.arange(len(designs)), min(len(designs), 4 * processes))
+
+        table['transmission'] = np.empty(len(designs))
+        # spawn: workers must not inherit the Tk interpreter of the GUI process
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(processes) as pool:
+            jobs = [(idx, pool.apply_async(_sweep_transmission_worker,
+                                           (designs[idx], angles, transmission_rays, engine)))
+                    for idx in tasks]
+            for done, (idx, job) in enumerate(jobs, 1):
+                table['transmission'][idx] = job.get()
+                if progress:
+                    progress(done, len(jobs))
+
+    return table
+
+def save_sweep(file_path, table):
+    """Writes a sweep table as .npz (one array per column) or as CSV for any other extension"""
+    columns = [name for name in SWEEP_COLUMNS + ("transmission",) if name in table]
+    if file_path.lower().endswith(".npz"):
+        np.savez(file_path, **{name: table[name] for name in columns})
+    else:
+        np.savetxt(file_path, np.column_stack([table[name] for name in columns]), delimiter=",",
+                   fmt=["%d" if name == "steps" else "%.10g" for name in columns],
+                   header=",".join(columns), comments="")
@@ -0,0 +1,258 @@
+# -*- coding:utf-8 -*-
+"""
+Manufacturing tolerances: Monte Carlo over perturbed wall profiles traced as one stacked batch
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import multiprocessing
+import os
+
+import numpy as np
+
+from .tracing import FATE_RECEIVER, FATE_ESCAPE_APERTURE, FATE_NO_INTERSECTION, FATE_MAX_BOUNCES
+
+def perturbed_profiles(profile_z, profile_r, n_copies, slope_error_mrad=0.0, waviness=0.0, waviness_periods=3,
+                       scale_error=0.0, tilt_error_mrad=0.0, rng=None):
+    """Radii (n_copies, points) of the upper and lower walls of perturbed copies of a profile.
+
+    All copies share the z grid of the profile. Every wall of every copy gets its own errors:
+    - slope error: Gaussian error of each segment slope (σ in mrad), integrated along z as a
+      bridge so that both ends of the wall stay in place;
+    - waviness: random harmonics of 1..waviness_periods periods over the length with an rms
+      radial deviation of waviness (mm);
+    - scale: the radii multiplied by 1 + s, s ~ N(0, scale_error) per copy;
+    - tilt: the wall leans by τ·z, τ ~ N(0, tilt_error) per copy (small-angle tilt of the
+      reflector axis about the receiver centre, the same for both walls).
+    The lower wall is stored with its sign (negative radii).
+    """
+    rng = np.random.default_rng(rng)
+    z = np.asarray(profile_z, dtype=float)
+    r = np.asarray(profile_r, dtype=float)
+    length = z[-1] - z[0]
+    u = (z - z[0]) / length
+    walls = np.broadcast_to(r, (2, n_copies, len(r))).copy()
+
+    if slope_error_mrad:
+        slope = rng.normal(0.0, slope_error_mrad * 1e-3, (2, n_copies, len(r) - 1))
+        drift = np.concatenate((np.zeros((2, n_copies, 1)), np.cumsum(slope * np.diff(z), axis=2)), axis=2)
+        walls += drift - drift[..., -1:] * u
+
+    if waviness:
+        periods = np.arange(1, max(1, int(waviness_periods)) + 1)
+        phase = 2 * np.pi * periods[:, None] * u  # (periods, points)
+        coefficients = rng.normal(0.0, 1.0, (2, 2, n_copies, len(periods)))
+        walls += waviness / np.sqrt(len(periods)) * (coefficients[0] @ np.sin(phase)
+                                                     + coefficients[1] @ np.cos(phase))
+
+    scale = rng.normal(0.0, scale_error, n_copies) if scale_error else np.zeros(n_copies)
+    walls *= 1 + scale[:, None]
+    walls[1] *= -1
+    tilt = rng.normal(0.0, tilt_error_mrad * 1e-3, n_copies) if tilt_error_mrad else np.zeros(n_copies)
+    walls += tilt[:, None] * (z - z[0])
+    return walls[0], walls[1], scale, tilt
+
+def _stacked_nearest(profile_z, walls, copy, z, r, vz, vr, eps=1e-9, max_elements=2**21):
+    """Nearest crossing of each ray with the polyline walls of its own copy: (t, side, segment).
+
+    The ray line is sampled at the node planes of the shared z grid; the wall-minus-ray
+    distance is linear within a segment, so a sign change between two nodes is an exact
+    crossing. Horizontal rays are intersected with the segment holding their height.
+    """
+    n_seg = len(profile_z) - 1
+    t_best = np.full(len(z), np.inf)
+    side = np.zeros(len(z), dtype=np.intp)
+    segment = np.zeros(len(z), dtype=np.intp)
+    rows = max(1, max_elements // (n_seg + 1))
+    horizontal = np.abs(vz) < 1e-12
+    z_seg = np.clip(np.searchsorted(profile_z, z, side='right') - 1, 0, n_seg - 1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for code, wall in enumerate(walls):
+            for start in range(0, len(z), rows):
+                block = slice(start, start + rows)
+                vzb = np.where(horizontal[block], 1.0, vz[block])[:, None]
+                t_nodes = (profile_z - z[block, None]) / vzb
+                gap = wall[copy[block]] - (r[block, None] + t_nodes * vr[block, None])
+                crossing = (gap[:, :-1] * gap[:, 1:] <= 0) & ((gap[:, :-1] != 0) | (gap[:, 1:] != 0))
+                fraction = gap[:, :-1] / (gap[:, :-1] - gap[:, 1:])
+                t = t_nodes[:, :-1] + fraction * (t_nodes[:, 1:] - t_nodes[:, :-1])
+                t = np.where(crossing & (t > eps), t, np.inf)
+                j = t.argmin(axis=1)
+                t = t[np.arange(len(j)), j]
+
+                # Horizontal rays: the segment at their own height
+                flat = horizontal[block]
+                if flat.any():
+                    k = z_seg[block][flat]
+                    c = copy[block][flat]
+                    w = (z[block][flat] - profile_z[k]) / (profile_z[k + 1] - profile_z[k])
+                    r_wall = wall[c, k] + w * (wall[c, k + 1] - wall[c, k])
+                    t_flat = (r_wall - r[block][flat]) / vr[block][flat]
+                    t[flat] = np.where(t_flat > eps, t_flat, np.inf)
+                    j[flat] = k
+
+                closer = t < t_best[block]
+                t_best[block] = np.where(closer, t, t_best[block])
+                side[block] = np.where(closer, code, side[block])
+                segment[block] = np.where(closer, j, segment[block])
+    return t_best, side, segment
+
+def trace_stacked_rays(profile_z, upper, lower, copy, r0_aperture, angles_deg, half_d1, max_bounces=50):
+    """Traces meridional rays, each inside its own copy of the wall, as one batch.
+
+    upper and lower are (copies, points) wall radii on the shared z grid profile_z (receiver at
+    z = 0, aperture at profile_z[-1]); copy holds the copy index of each ray. Rays start on the
+    aperture plane as in trace_rays_batch and the result has the same fields.
+    """
+    profile_z = np.asarray(profile_z, dtype=float)
+    walls = (np.asarray(upper, dtype=float), np.asarray(lower, dtype=float))
+    copy, r0, angles = np.broadcast_arrays(np.asarray(copy, dtype=np.intp), np.asarray(r0_aperture, dtype=float),
+                                           np.asarray(angles_deg, dtype=float))
+    copy, r0, angles = copy.ravel(), r0.ravel(), angles.ravel()
+    n_rays = r0.size
+    L = profile_z[-1]
+
+    dz = np.full(n_rays, -1.0)
+    dr = np.tan(np.radians(angles))
+    v_len = np.sqrt(dz * dz + dr * dr)
+    dz /= v_len
+    dr /= v_len
+    pz = np.full(n_rays, float(L))
+    pr = r0.copy()
+
+    fate = np.full(n_rays, FATE_MAX_BOUNCES, dtype=np.int8)
+    bounces = np.zeros(n_rays, dtype=np.int32)
+    hit_z = np.zeros(n_rays)
+    hit_r = np.zeros(n_rays)
+
+    live = np.arange(n_rays)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        while live.size:
+            z, r, vz, vr = pz[live], pr[live], dz[live], dr[live]
+            t_wall, side, seg = _stacked_nearest(profile_z, walls, copy[live], z, r, vz, vr)
+
+            # Receiver (z = 0) before any wall
+            moving = np.abs(vz) > 1e-12
+            t_rec = np.where(moving & (vz < 0), -z / vz, np.inf)
+            r_rec = r + vr * t_rec
+            to_receiver = (t_rec > 1e-9) & (t_rec <= t_wall) & (np.abs(r_rec) <= half_d1 + 1e-9)
+            done = live[to_receiver]
+            fate[done] = FATE_RECEIVER
+            hit_z[done] = 0.0
+            hit_r[done] = r_rec[to_receiver]
+
+            # Aperture plane before any wall, or nothing ahead
+            t_ap = np.where(moving & (vz > 0), (L - z) / vz, np.inf)
+            to_aperture = ~to_receiver & (t_ap > 1e-9) & (t_ap <= t_wall)
+            done = live[to_aperture]
+            fate[done] = FATE_ESCAPE_APERTURE
+            hit_z[done] = L
+            hit_r[done] = (r + vr * t_ap)[to_aperture]
+            lost = ~to_receiver & ~to_aperture & ~np.isfinite(t_wall)
+            fate[live[lost]] = FATE_NO_INTERSECTION
+
+            # Specular reflection on the wall segment
+            reflect = ~to_receiver & ~to_aperture & ~lost
+            live = live[reflect]
+            t, side, seg = t_wall[reflect], side[reflect], seg[reflect]
+            z, r, vz, vr = z[reflect], r[reflect], vz[reflect], vr[reflect]
+            iz = z + t * vz
+            ir = r + t * vr
+            c = copy[live]
+            seg_dr = np.where(side == 0, walls[0][c, seg + 1] - walls[0][c, seg],
+                              walls[1][c, seg + 1] - walls[1][c, seg])
+            seg_dz = profile_z[seg + 1] - profile_z[seg]
+            n_len = np.hypot(seg_dz, seg_dr)
+            nz, nr = -seg_dr / n_len, seg_dz / n_len
+            dot = vz * nz + vr * nr
+            vz = vz - 2 * dot * nz
+            vr = vr - 2 * dot * nr
+            v_len = np.hypot(vz, vr) + 1e-12
+            vz /= v_len
+            vr /= v_len
+
+            bounces[live] += 1
+            hit_z[live] = iz
+            hit_r[live] = ir
+            pz[live] = iz + vz * 1e-6  # a slight shift to avoid self-intersection
+            pr[live] = ir + vr * 1e-6
+            dz[live] = vz
+            dr[live] = vr
+            live = live[bounces[live] <= max_bounces]
+
+    return {'fate': fate, 'bounces': bounces, 'hit_z': hit_z, 'hit_r': hit_r}
+
+def _tolerance_worker(profile_z, upper, lower, angles_deg, n_positions, half_d1, bins, max_bounces):
+    """Transmission per angle, mean bounces of received rays and receiver histogram of each copy"""
+    n_copies = len(upper)
+    # Bin midpoints across each copy's own aperture, the same angles for every copy
+    fractions = (np.arange(n_positions) + 0.5) / n_positions
+    r0 = lower[:, -1, None] + fractions * (upper[:, -1] - lower[:, -1])[:, None]
+    copy = np.repeat(np.arange(n_copies), len(angles_deg) * n_positions).reshape(n_copies, len(angles_deg), n_positions)
+    result = trace_stacked_rays(profile_z, upper, lower, copy, r0[:, None, :],
+                                np.asarray(angles_deg, dtype=float)[None, :, None], half_d1, max_bounces)
+
+    received = (result['fate'] == FATE_RECEIVER).reshape(n_copies, len(angles_deg), n_positions)
+    transmission = received.mean(axis=2)
+    counts = received.sum(axis=(1, 2))
+    bounces = result['bounces'].reshape(received.shape)
+    with np.errstate(invalid='ignore'):
+        mean_bounces = np.where(received, bounces, 0).sum(axis=(1, 2)) / counts
+
+    flat = received.ravel()
+    column = np.clip(((result['hit_r'][flat] + half_d1) / (2 * half_d1) * bins).astype(np.intp), 0, bins - 1)
+    histogram = np.bincount(copy.ravel()[flat] * bins + column, minlength=n_copies * bins).reshape(n_copies, bins)
+    return transmission, mean_bounces, histogram
+
+def tolerance_analysis(params, profile_z, profile_r, n_copies, angles_deg, n_positions=200, slope_error_mrad=0.0,
+                       waviness=0.0, waviness_periods=3, scale_error=0.0, tilt_error_mrad=0.0, bins=50,
+                       max_bounces=50, processes=None, seed=None, progress=None):
+    """Monte Carlo of the transmission over n_copies perturbed copies of the wall (perturbed_profiles).
+
+    All copies are drawn up front from the seed and split into blocks of copies; each block is
+    traced as one stacked batch (n_positions rays across its aperture at every angle for every
+    copy) in a process pool, so the results do not depend on the number of processes. The
+    unperturbed profile is traced as copy 0 of the first block for reference.
+
+    Returns a dict: 'transmission' (copies, angles), 'mean_bounces' and 'peak_to_mean' (receiver
+    histogram peak over its mean, per copy), 'histogram' (copies, bins), the drawn 'scale' and
+    'tilt' of each copy, and the same 'nominal_*' entries of the unperturbed wall.
+    progress(done, total) is called after each finished block.
+    """
+    angles_deg = np.asarray(angles_deg, dtype=float)
+    upper, lower, scale, tilt = perturbed_profiles(profile_z, profile_r, n_copies, slope_error_mrad, waviness,
+                                                   waviness_periods, scale_error, tilt_error_mrad, seed)
+    upper = np.vstack((profile_r, upper))
+    lower = np.vstack((-np.asarray(profile_r), lower))
+    half_d1 = params['d1'] / 2
+
+    processes = processes or os.cpu_count() or 1
+    # Blocks bounded by the stacked (ray, node) arrays of one bounce
+    block = max(1, min(-(-len(upper) // processes), 2**24 // max(1, len(angles_deg) * n_positions * len(profile_z))))
+    tasks = [slice(start, start + block) for start in range(0, len(upper), block)]
+
+    transmission = np.empty((len(upper), len(angles_deg)))
+    mean_bounces = np.empty(len(upper))
+    histogram = np.empty((len(upper), bins), dtype=np.int64)
+    # spawn: workers must not inherit the Tk interpreter of the GUI process
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(min(processes, len(tasks))) as pool:
+        jobs = [(idx, pool.apply_async(_tolerance_worker, (profile_z, upper[idx], lower[idx], angles_deg,
+                                                           n_positions, half_d1, bins, max_bounces)))
+                for idx in tasks]
+        for done, (idx, job) in enumerate(jobs, 1):
+            transmission[idx], mean_bounces[idx], histogram[idx] = job.get()
+            if progress:
+                progress(done, len(jobs))
+
+    mean = histogram.mean(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        peak_to_mean = np.where(mean > 0, histogram.max(axis=1) / mean, np.nan)
+    return {
+        'transmission': transmission[1:], 'mean_bounces': mean_bounces[1:], 'peak_to_mean': peak_to_mean[1:],
+        'histogram': histogram[1:], 'scale': scale, 'tilt': tilt,
+        'nominal_transmission': transmission[0], 'nominal_mean_bounces': mean_bounces[0],
+        'nominal_peak_to_mean': peak_to_mean[0], 'nominal_histogram': histogram[0],
+    }
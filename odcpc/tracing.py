@@ -0,0 +1,455 @@
+# -*- coding:utf-8 -*-
+"""
+Meridional ray tracing: wall intersection engines, single-ray and batch tracers
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import math
+
+import numpy as np
+
+# Ray fates reported by the batch tracer (index = fate code)
+RAY_FATES = ("receiver", "escape_aperture", "escape_direct", "no_intersection", "max_bounces", "wall_leak")
+FATE_RECEIVER = 0
+FATE_ESCAPE_APERTURE = 1
+FATE_ESCAPE_DIRECT = 2  # reserved: rays launched on the aperture plane never take the direct-escape shortcut
+FATE_NO_INTERSECTION = 3
+FATE_MAX_BOUNCES = 4
+FATE_WALL_LEAK = 5  # dielectric tracer: refracted out through the wall
+
+class SegmentIndex:
+    """Bounding-interval hierarchy over the upper and lower profile segments.
+
+    Segments are grouped into leaves of consecutive segments (the profile is monotone in z,
+    so neighbours are spatially close) and leaf boxes are merged pairwise up to a single root.
+    A query walks all rays down the tree level by level and solves the 2x2 intersection system
+    only for segments in the leaves whose boxes the ray actually crosses.
+    """
+
+    def __init__(self, profile_z, profile_r, leaf_size=8):
+        profile_z = np.ascontiguousarray(profile_z, dtype=np.float64)
+        profile_r = np.ascontiguousarray(profile_r, dtype=np.float64)
+        seg_dz = np.diff(profile_z)
+        seg_dr = np.diff(profile_r)
+
+        # Upper segments first, then the mirrored lower ones (same order as the original scan)
+        self.n_upper = len(profile_z) - 1
+        self.seg_z0 = np.concatenate((profile_z[:-1], profile_z[:-1]))
+        self.seg_r0 = np.concatenate((profile_r[:-1], -profile_r[:-1]))
+        self.seg_dz = np.concatenate((seg_dz, seg_dz))
+        self.seg_dr = np.concatenate((seg_dr, -seg_dr))
+        self.leaf_size = leaf_size
+
+        n_seg = len(self.seg_z0)
+        z_end = self.seg_z0 + self.seg_dz
+        r_end = self.seg_r0 + self.seg_dr
+        margin = 1e-9 * (1.0 + max(np.abs(profile_z).max(), np.abs(profile_r).max()))
+
+        # Leaf boxes, padded slightly so that hits on segment ends are never culled
+        starts = np.arange(0, n_seg, leaf_size)
+        boxes = (np.minimum.reduceat(np.minimum(self.seg_z0, z_end), starts) - margin,
+                 np.maximum.reduceat(np.maximum(self.seg_z0, z_end), starts) + margin,
+                 np.minimum.reduceat(np.minimum(self.seg_r0, r_end), starts) - margin,
+                 np.maximum.reduceat(np.maximum(self.seg_r0, r_end), starts) + margin)
+
+        # Merge pairs of nodes up to the root; levels are stored root first
+        self.levels = [boxes]
+        while len(boxes[0]) > 1:
+            pairs = np.arange(0, len(boxes[0]), 2)
+            boxes = (np.minimum.reduceat(boxes[0], pairs), np.maximum.reduceat(boxes[1], pairs),
+                     np.minimum.reduceat(boxes[2], pairs), np.maximum.reduceat(boxes[3], pairs))
+            self.levels.insert(0, boxes)
+
+        # Padding so that every leaf holds leaf_size segments; padded ones are degenerate and never hit
+        pad = len(self.levels[-1][0]) * leaf_size - n_seg
+        self._z0 = np.concatenate((self.seg_z0, np.zeros(pad)))
+        self._r0 = np.concatenate((self.seg_r0, np.zeros(pad)))
+        self._dz = np.concatenate((self.seg_dz, np.zeros(pad)))
+        self._dr = np.concatenate((self.seg_dr, np.zeros(pad)))
+
+    @staticmethod
+    def _crosses(p, inv, lo, hi, t_lo, t_hi):
+        """Narrows the [t_lo, t_hi] interval of a ray with one slab of a box"""
+        t1 = (lo - p) * inv
+        t2 = (hi - p) * inv
+        return np.maximum(t_lo, np.fmin(t1, t2)), np.minimum(t_hi, np.fmax(t1, t2))
+
+    def nearest(self, pz, pr, dz, dr, eps=1e-9):
+        """Nearest segment hit for each ray.
+
+        Returns (t, seg): distance along the ray (inf when nothing is hit) and the global segment
+        index (upper segments first). Ties are resolved towards the lower index.
+        """
+        n_rays = len(pz)
+        t_best = np.full(n_rays, np.inf)
+        seg_best = np.full(n_rays, np.iinfo(np.intp).max, dtype=np.intp)
+        if not n_rays:
+            return t_best, seg_best
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_z = 1.0 / dz
+            inv_r = 1.0 / dr
+
+            # Walk the tree: keep (ray, node) pairs whose box is crossed ahead of the ray
+            ray = np.arange(n_rays)
+            node = np.zeros(n_rays, dtype=np.intp)
+            for depth, (z_lo, z_hi, r_lo, r_hi) in enumerate(self.levels):
+                if depth:
+                    ray = np.concatenate((ray, ray))
+                    node = np.concatenate((2 * node, 2 * node + 1))
+                    exists = node < len(z_lo)
+                    ray, node = ray[exists], node[exists]
+                t_lo, t_hi = self._crosses(pz[ray], inv_z[ray], z_lo[node], z_hi[node],
+                                           np.full(len(ray), -np.inf), np.full(len(ray), np.inf))
+                t_lo, t_hi = self._crosses(pr[ray], inv_r[ray], r_lo[node], r_hi[node], t_lo, t_hi)
+                crossed = (t_hi >= t_lo) & (t_hi > eps)
+                ray, node = ray[crossed], node[crossed]
+
+            # Exact tests against the segments of the remaining leaves
+            seg = (node[:, None] * self.leaf_size + np.arange(self.leaf_size)).ravel()
+            ray = np.repeat(ray, self.leaf_size)
+            vz, vr = dz[ray], dr[ray]
+            bz = self._z0[seg] - pz[ray]
+            br = self._r0[seg] - pr[ray]
+            sz, sr = self._dz[seg], self._dr[seg]
+
+            # Cramer's rule for: point + t*direction = segment_start + u*segment_vector
+            det = sz * vr - vz * sr
+            t = (sz * br - sr * bz) / det
+            u = (vz * br - vr * bz) / det
+            valid = (det != 0) & (t > eps) & (u >= 0) & (u <= 1.0)
+            ray, seg, t = ray[valid], seg[valid], t[valid]
+
+        np.minimum.at(t_best, ray, t)
+        nearest = t == t_best[ray]
+        np.minimum.at(seg_best, ray[nearest], seg[nearest])
+        return t_best, seg_best
+
+    def normals(self, seg, hz=None, hr=None):
+        """Unit normals of the given segments, oriented as in the single-ray tracer (hit points are not needed)"""
+        seg = np.where(seg < len(self.seg_z0), seg, 0)
+        length = np.hypot(self.seg_dz[seg], self.seg_dr[seg]) + 1e-12
+        tz = self.seg_dz[seg] / length
+        tr = self.seg_dr[seg] / length
+        upper = seg < self.n_upper
+        nz = np.where(upper, tr, -tr)
+        nr = np.where(upper, -tz, tz)
+        n_len = np.hypot(nz, nr) + 1e-12
+        return nz / n_len, nr / n_len
+
+class ParabolicWall:
+    """Exact CPC wall: the tilted parabola A·r² + B(z)·r + D(z) = 0 used by calculate_profile_points.
+
+    Drop-in replacement for SegmentIndex: rays are intersected with the conic by a closed-form
+    quadratic solve and reflected about the analytic normal, so the cost per bounce is constant
+    and does not depend on the profile step. Surface codes are 0 (upper) and 1 (lower).
+    The cone drawn for a single step is not modelled: this is always the ideal CPC wall.
+    """
+    n_upper = 1  # one exact piece per surface
+
+    def __init__(self, params):
+        self.A = params['A_const']
+        self.B1 = params['B_const_part1']
+        self.B2 = params['B_const_part2']
+        self.D1 = params['D_const_part1']
+        self.D2 = params['D_const_part2']
+        self.D3 = params['D_const_part3']
+        self.L = params['L']
+
+    def nearest(self, pz, pr, dz, dr, eps=1e-9):
+        """Nearest wall hit for each ray: (t, surface), t is inf when the ray misses both walls"""
+        t_best = np.full(len(pz), np.inf)
+        surface = np.zeros(len(pz), dtype=np.intp)
+        z_tol = 1e-9 * (1.0 + self.L)
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for code, sign in ((0, 1.0), (1, -1.0)):
+                # The lower wall is the upper one mirrored about the axis
+                qr = sign * pr
+                vr = sign * dr
+
+                # F(pz + t·dz, qr + t·vr) = a·t² + b·t + c
+                a = self.A * vr ** 2 + self.B1 * dz * vr + self.D1 * dz ** 2
+                b = (2 * self.A * qr * vr + self.B1 * (pz * vr + qr * dz) + 2 * self.D1 * pz * dz
+                     + self.B2 * vr - self.D2 * dz)
+                c = (self.A * qr ** 2 + self.B1 * pz * qr + self.D1 * pz ** 2
+                     + self.B2 * qr - self.D2 * pz - self.D3)
+
+                # Numerically stable roots; a → 0 (ray parallel to the parabola axis) leaves the linear root c/q
+                disc = b * b - 4 * a * c
+                q = -0.5 * (b + np.copysign(np.sqrt(disc), b))
+                for t in (q / a, c / q):
+                    z = pz + t * dz
+                    r = qr + t * vr
+                    # Only the physical arc: 0 ≤ z ≤ L on the branch taken by the profile (larger root in r)
+                    valid = ((disc >= 0) & (t > eps) & (z >= -z_tol) & (z <= self.L + z_tol)
+                             & (2 * self.A * r + self.B1 * z + self.B2 >= 0))
+                    closer = valid & (t < t_best)
+                    t_best = np.where(closer, t, t_best)
+                    surface = np.where(closer, code, surface)
+
+        return t_best, surface
+
+    def normals(self, seg, hz, hr):
+        """Unit normals from the gradient of the conic at the hit points"""
+        sign = np.where(seg == 0, 1.0, -1.0)
+        r = sign * hr
+        nz = self.B1 * r + 2 * self.D1 * hz - self.D2
+        nr = sign * (2 * self.A * r + self.B1 * hz + self.B2)
+        n_len = np.hypot(nz, nr) + 1e-12
+        return nz / n_len, nr / n_len
+
+# Wall intersection engines selectable for tracing
+TRACE_ENGINES = ("polyline", "analytic")
+
+def make_wall(engine, params, profile_z, profile_r):
+    """Builds the wall intersection engine: 'polyline' (SegmentIndex) or 'analytic' (ParabolicWall)"""
+    if engine == "analytic":
+        return ParabolicWall(params)
+    if engine == "polyline":
+        return SegmentIndex(profile_z, profile_r)
+    raise ValueError(f"Unknown tracing engine: {engine}")
+
+def trace_rays_batch(params, profile_z, profile_r, r0_aperture, angles_deg, max_bounces=50,
+                     engine="polyline", wall=None, segments=None):
+    """Traces many meridional rays from the aperture at once, one bounce per iteration.
+
+    Positions and angles are broadcast against each other. The wall is intersected with the
+    chosen engine (see TRACE_ENGINES); a prebuilt wall (SegmentIndex or ParabolicWall) may be
+    passed instead. Returns a dict of arrays: 'fate' (codes into RAY_FATES), 'bounces' and
+    the final point 'hit_z', 'hit_r'.
+
+    segments(ray, z0, r0, z1, r1), if given, receives the path segments traced in each
+    iteration (ray indices and segment ends as arrays).
+    """
+    if wall is None:
+        wall = make_wall(engine, params, profile_z, profile_r)
+
+    r0, angles = np.broadcast_arrays(np.asarray(r0_aperture, dtype=float), np.asarray(angles_deg, dtype=float))
+    r0 = r0.ravel()
+    angles = angles.ravel()
+    n_rays = r0.size
+
+    L = params['L']
+    half_d1 = params['d1'] / 2
+    half_d2 = params['d2'] / 2
+
+    # Initial directions: towards the receiver, normalized
+    dz = np.full(n_rays, -1.0)
+    dr = np.tan(np.radians(angles))
+    v_len = np.sqrt(dz * dz + dr * dr)
+    dz /= v_len
+    dr /= v_len
+
+    pz = np.full(n_rays, float(L))
+    pr = r0.copy()
+
+    fate = np.full(n_rays, FATE_MAX_BOUNCES, dtype=np.int8)
+    bounces = np.zeros(n_rays, dtype=np.int32)
+    hit_z = np.zeros(n_rays)
+    hit_r = np.zeros(n_rays)
+
+    live = np.arange(n_rays)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        while live.size:
+            z, r, vz, vr = pz[live], pr[live], dz[live], dr[live]
+
+            # 1. Receiver (z = 0)
+            moving = np.abs(vz) > 1e-12
+            t_rec = np.where(moving, -z / vz, -1.0)
+            r_rec = r + vr * t_rec
+            to_receiver = moving & (t_rec > 1e-9) & (np.abs(r_rec) <= half_d1 + 1e-9)
+
+            done = live[to_receiver]
+            fate[done] = FATE_RECEIVER
+            hit_z[done] = 0.0
+            hit_r[done] = r_rec[to_receiver]
+            if segments is not None:
+                segments(done, z[to_receiver], r[to_receiver], np.zeros(done.size), r_rec[to_receiver])
+
+            rest = ~to_receiver
+            live = live[rest]
+            z, r, vz, vr = z[rest], r[rest], vz[rest], vr[rest]
+            if not live.size:
+                break
+
+            # Nearest wall intersection
+            t_wall, seg = wall.nearest(z, r, vz, vr)
+
+            # 2. Aperture (z = L) when no wall is hit on the way
+            towards = (vz > 0) & (z < L)
+            t_ap = np.where(towards, (L - z) / vz, -1.0)
+            r_ap = r + vr * t_ap
+            to_aperture = (towards & (t_ap > 1e-9) & (np.abs(r_ap) <= half_d2 + 1e-9)
+                           & ~(t_wall < t_ap - 1e-9))
+
+            done = live[to_aperture]
+            fate[done] = FATE_ESCAPE_APERTURE
+            hit_z[done] = (z + vz * t_ap)[to_aperture]
+            hit_r[done] = r_ap[to_aperture]
+
+            # 3. No wall ahead: the ray leaves the concentrator
+            lost = ~to_aperture & ~np.isfinite(t_wall)
+            done = live[lost]
+            fate[done] = FATE_NO_INTERSECTION
+            hit_z[done] = (z + vz * L)[lost]
+            hit_r[done] = (r + vr * L)[lost]
+
+            if segments is not None:
+                ended = to_aperture | lost
+                segments(live[ended], z[ended], r[ended], hit_z[live[ended]], hit_r[live[ended]])
+
+            # 4. Specular reflection on the wall
+            reflect = ~to_aperture & ~lost
+            live = live[reflect]
+            t = t_wall[reflect]
+            z, r, vz, vr = z[reflect], r[reflect], vz[reflect], vr[reflect]
+
+            iz = z + t * vz
+            ir = r + t * vr
+            if segments is not None:
+                segments(live, z, r, iz, ir)
+            nz, nr = wall.normals(seg[reflect], iz, ir)
+            dot = vz * nz + vr * nr
+            vz = vz - 2 * dot * nz
+            vr = vr - 2 * dot * nr
+            v_len = np.hypot(vz, vr) + 1e-12
+            vz /= v_len
+            vr /= v_len
+
+            bounces[live] += 1
+            hit_z[live] = iz
+            hit_r[live] = ir
+            pz[live] = iz + vz * 1e-6  # a slight shift to avoid self-intersection
+            pr[live] = ir + vr * 1e-6
+            dz[live] = vz
+            dr[live] = vr
+
+            # Rays that exhausted the bounce budget keep the last wall point
+            live = live[bounces[live] <= max_bounces]
+
+    return {'fate': fate, 'bounces': bounces, 'hit_z': hit_z, 'hit_r': hit_r}
+
+def trace_ray_from_aperture(params, wall, r0_aperture, angle_deg, max_bounces=50):
+    """Traces one meridional ray from the aperture, recording its path and per-segment metadata"""
+
+    # Convert angle to radians
+    alpha = math.radians(angle_deg)
+
+    # Beam direction: inside CPC (towards collector)
+    dz = -1.0  # moving towards z=0
+    dr = math.tan(alpha)  # radial component
+
+    # Normalize the direction
+    v = np.array([dz, dr], dtype=float)
+    v_len = np.linalg.norm(v)
+    if v_len > 0:
+        v = v / v_len
+
+    # Starting point on the aperture
+    z0 = params['L']
+    r0 = float(r0_aperture)
+    path = [(z0, r0)]
+    segments = []
+
+    bounce_count = 0
+    current_point = np.array([z0, r0], dtype=float)
+    current_direction = v.copy()
+
+    # Wall intersection engine over both surfaces (upper and mirrored lower)
+    index = wall
+
+    # We first check whether the beam comes back out through the aperture (simplified check)
+    # If the angle is too large (greater than the concentrator angle), the beam will not hit the collector
+    if abs(angle_deg) > params['theta_deg'] + 5:  # adding a small margin of error
+        # The beam will not enter the collector, but will exit through the aperture.
+        # Find the exit point through the aperture
+        if abs(current_direction[0]) > 1e-12:
+            t_to_aperture = (z0 - current_point[0]) / current_direction[0]
+            if t_to_aperture > 1e-9:
+                exit_pt = current_point + current_direction * t_to_aperture
+                path.append((float(exit_pt[0]), float(exit_pt[1])))
+                segments.append({"angle_deg": angle_deg, "type": "escape_direct"})
+                return path, segments
+
+    while bounce_count <= max_bounces:
+        # 1. Check the intersection with the collector (z=0)
+        if abs(current_direction[0]) > 1e-12:
+            t_to_receiver = (0.0 - current_point[0]) / current_direction[0]
+            if t_to_receiver > 1e-9:
+                receiver_intersect = current_point + current_direction * t_to_receiver
+                receiver_r = receiver_intersect[1]
+                # Check if it gets to the manifold
+                if abs(receiver_r) <= params['d1']/2 + 1e-9:
+                    path.append((0.0, receiver_r))
+                    segments.append({"angle_deg": angle_deg, "type": "receiver", "final_r": receiver_r})
+                    break
+
+        # 2. Check intersection with aperture (z = L)
+        aperture_z = params['L']
+        if current_direction[0] > 0 and current_point[0] < aperture_z:  # moves towards the aperture
+            t_to_aperture = (aperture_z - current_point[0]) / current_direction[0]
+            if t_to_aperture > 1e-9:
+                aperture_intersect = current_point + current_direction * t_to_aperture
+                aperture_r = aperture_intersect[1]
+
+                # Check if it fits into the aperture and does not go inside the hub
+                if abs(aperture_r) <= params['d2']/2 + 1e-9:
+                    # Check if the beam hits the profile before reaching the aperture
+                    t_wall, _ = index.nearest(current_point[:1], current_point[1:], 
+                                              current_direction[:1], current_direction[1:])
+                    profile_intersection_earlier = t_wall[0] < t_to_aperture - 1e-9
+
+                    if not profile_intersection_earlier:
+                        # The beam actually comes out through the aperture
+                        path.append((float(aperture_intersect[0]), float(aperture_intersect[1])))
+                        segments.append({"angle_deg": math.degrees(math.atan2(current_direction[1], -current_direction[0])), 
+                                       "type": "escape_aperture", "final_r": aperture_r})
+                        break
+
+        # 3. Find the nearest intersection with the upper and lower surfaces
+        t_wall, seg = index.nearest(current_point[:1], current_point[1:], 
+                                    current_direction[:1], current_direction[1:])
+
+        if np.isfinite(t_wall[0]):
+            seg_index = int(seg[0])
+            surface_type = "upper" if seg_index < index.n_upper else "lower"
+
+            # Add an intersection point to a path
+            intersect_pt = current_point + t_wall[0] * current_direction
+            path.append((float(intersect_pt[0]), float(intersect_pt[1])))
+
+            # Normal at the intersection point (perpendicular to the segment tangent)
+            nz, nr = index.normals(seg, intersect_pt[:1], intersect_pt[1:])
+            normal = np.array([nz[0], nr[0]])
+
+            # Reflection
+            incident = current_direction
+            dot = np.dot(incident, normal)
+            reflected = incident - 2 * dot * normal
+            reflected = reflected / (np.linalg.norm(reflected) + 1e-12)
+
+            # Save segment information
+            current_angle = math.degrees(math.atan2(current_direction[1], -current_direction[0]))
+            segments.append({
+                "angle_deg": current_angle, 
+                "type": "reflect", 
+                "surface": surface_type,
+                "segment_index": seg_index % index.n_upper
+            })
+
+            # Update point and direction for next step
+            current_point = intersect_pt + reflected * 1e-6  # a slight shift to avoid self-intersection
+            current_direction = reflected
+            bounce_count += 1
+
+        else:
+            # There are no intersections - the beam goes to infinity
+            far_point = current_point + current_direction * params['L']
+            path.append((float(far_point[0]), float(far_point[1])))
+            segments.append({"angle_deg": angle_deg, "type": "no_intersection"})
+            break
+
+    return path, segments
@@ -0,0 +1,80 @@
+# -*- coding:utf-8 -*-
+"""
+Angular transmission curve traced across a process pool
+
+@Author: Otkupman D.G.
+@License: MIT
+"""
+
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .skew import RevolvedWall, skew_transmission_for_angles
+from .tracing import FATE_RECEIVER, make_wall, trace_rays_batch
+
+# Transmission curve (process pool)
+_worker_state = None
+
+def _transmission_worker_init(shm_name, n_points, params, engine, skew, radial_segments):
+    """Attaches a pool worker to the shared profile and builds its wall engine once"""
+    global _worker_state
+    shm = shared_memory.SharedMemory(name=shm_name)
+    profile = np.ndarray((2, n_points), dtype=np.float64, buffer=shm.buf)
+    if skew:
+        wall = RevolvedWall(profile[0], profile[1], radial_segments)
+    else:
+        wall = make_wall(engine, params, profile[0], profile[1])
+    _worker_state = (shm, params, wall)  # the segment keeps the profile view alive
+
+def _transmission_worker(angles_deg, n_positions, seed):
+    """Fraction of rays reaching the receiver for each angle of one task"""
+    _, params, wall = _worker_state
+    if isinstance(wall, RevolvedWall):
+        return skew_transmission_for_angles(wall, angles_deg, n_positions, rng=seed)
+    return transmission_for_angles(params, wall, angles_deg, n_positions)
+
+def transmission_for_angles(params, wall, angles_deg, n_positions):
+    """Receiver fraction per angle for rays launched uniformly over the aperture"""
+    angles_deg = np.asarray(angles_deg, dtype=float)
+    half_r = params['d2'] / 2
+    r0 = (np.arange(n_positions) + 0.5) / n_positions * 2 * half_r - half_r  # bin midpoints
+    result = trace_rays_batch(params, None, None, r0[None, :], angles_deg[:, None], wall=wall)
+    return (result['fate'].reshape(len(angles_deg), n_positions) == FATE_RECEIVER).mean(axis=1)
+
+def transmission_curve(params, profile_z, profile_r, angles_deg, n_positions=1000,
+                       engine="polyline", processes=None, progress=None, skew=False, radial_segments=None):
+    """Angular transmission curve of the CPC traced across a process pool.
+
+    The profile is placed once in shared memory; every worker attaches to it and builds its
+    wall engine in the pool initializer, so tasks only carry their slice of angles.
+    With skew the curve is traced in 3D instead (RevolvedWall with radial_segments,
+    n_positions random rays over the whole aperture per angle, seeded per task); engine is
+    then unused. progress(done, total) is called after each finished task.
+    """
+    angles_deg = np.asarray(angles_deg, dtype=float)
+    processes = processes or os.cpu_count() or 1
+    tasks = np.array_split(np.arange(len(angles_deg)), min(len(angles_deg), 4 * processes))
+
+    profile = np.stack((profile_z, profile_r)).astype(np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=profile.nbytes)
+    try:
+        np.ndarray(profile.shape, dtype=np.float64, buffer=shm.buf)[:] = profile
+        transmission = np.empty(len(angles_deg))
+        # spawn: workers must not inherit the Tk interpreter of the GUI process
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(processes, initializer=_transmission_worker_init,
+                          initargs=(shm.name, profile.shape[1], params, engine, skew, radial_segments)) as pool:
+            jobs = [(idx, pool.apply_async(_transmission_worker, (angles_deg[idx], n_positions, seed)))
+                    for seed, idx in enumerate(tasks)]
+            for done, (idx, job) in enumerate(jobs, 1):
+                transmission[idx] = job.get()
+                if progress:
+                    progress(done, len(jobs))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return transmission